@@ -5,9 +5,13 @@ Created on Wed Oct 22 16:31:16 2025
 @author: yor25yat
 """
 
+import copy
+import functools
 import json
 from opentrons import protocol_api, types
 import math
+import os
+import time
  
 metadata = {
     "protocolName": "CG_sampleready_E.coli_transformation_run_parameters_V2",
@@ -18,15 +22,268 @@ metadata = {
 }
  
 requirements = {"robotType": "Flex", "apiLevel": "2.24"}
+
+# Recovery plates in load order. Runs over 96 samples carry on into the next plate.
+RECOVERY_PLATE_SLOTS = ("C2", "C1", "C3", "D2")
+
+# On the robot each run appends its timing trace (JSON lines) to a file here; see RunTimer.
+# Summarise traces with `python -m biof_tools.run_timing <dir>`.
+TIMING_TRACE_DIR = "/data/user_storage/transformation_timing"
+ 
+# Liquid classes: shared base sections plus the settings each class changes (dotted paths).
+# Keep in sync with biof_tools/data/liquid_classes.json; check with
+# `python -m biof_tools.liquid_classes check <this file>`. "$name" values are filled in at run time.
+LIQUID_CLASS_BASE = {
+    "aspirate": {
+        "aspirate_position": {
+            "offset": {"x": 0, "y": 0, "z": 1},
+            "position_reference": "well-bottom",
+        },
+        "flow_rate_by_volume": [(0, 24)],
+        "pre_wet": False,
+        "correction_by_volume": [(0, 0)],
+        "delay": {"enabled": False},
+        "mix": {"enabled": False},
+        "submerge": {
+            "delay": {"enabled": False},
+            "speed": 100,
+            "start_position": {
+                "offset": {"x": 0, "y": 0, "z": 2},
+                "position_reference": "well-top",
+            },
+        },
+        "retract": {
+            "air_gap_by_volume": [(0, 0)],
+            "delay": {"enabled": False},
+            "end_position": {
+                "offset": {"x": 0, "y": 0, "z": 2},
+                "position_reference": "well-top",
+            },
+            "speed": 50,
+            "touch_tip": {"enabled": False},
+        },
+    },
+    "dispense": {
+        "dispense_position": {
+            "offset": {"x": 0, "y": 0, "z": 1},
+            "position_reference": "well-bottom",
+        },
+        "flow_rate_by_volume": [(0, 50)],
+        "delay": {"enabled": False},
+        "submerge": {
+            "delay": {"enabled": False},
+            "speed": 100,
+            "start_position": {
+                "offset": {"x": 0, "y": 0, "z": 2},
+                "position_reference": "well-top",
+            },
+        },
+        "retract": {
+            "air_gap_by_volume": [(0, 0)],
+            "delay": {"enabled": False},
+            "end_position": {
+                "offset": {"x": 0, "y": 0, "z": 2},
+                "position_reference": "well-top",
+            },
+            "speed": 50,
+            "touch_tip": {"enabled": False},
+            "blowout": {"enabled": False},
+        },
+        "correction_by_volume": [(0, 0)],
+        "push_out_by_volume": [(0, 2)],
+        "mix": {"enabled": False},
+    },
+    "multi_dispense": {
+        "dispense_position": {
+            "offset": {"x": 0, "y": 0.8, "z": -3},
+            "position_reference": "well-top",
+        },
+        "flow_rate_by_volume": [(0, 50)],
+        "delay": {"enabled": False},
+        "submerge": {
+            "delay": {"enabled": False},
+            "speed": 100,
+            "start_position": {
+                "offset": {"x": 0, "y": 0, "z": 2},
+                "position_reference": "well-top",
+            },
+        },
+        "retract": {
+            "air_gap_by_volume": [(0, 0)],
+            "delay": {"enabled": False},
+            "end_position": {
+                "offset": {"x": 0, "y": 0, "z": 2},
+                "position_reference": "well-top",
+            },
+            "speed": 50,
+            "touch_tip": {"enabled": False},
+            "blowout": {"enabled": False},
+        },
+        "correction_by_volume": [(0, 0)],
+        "conditioning_by_volume": [(0, 0)],
+        "disposal_by_volume": [(0, 0)],
+    },
+}
+
+LIQUID_CLASSES = {
+    "distribute_step_1": {
+        "pipette": "flex_8channel_50",
+        "tiprack": "opentrons/opentrons_flex_96_tiprack_50ul/1",
+        "sections": ["aspirate", "dispense", "multi_dispense"],
+        "set": {
+            "aspirate.aspirate_position.offset.z": 0.2,
+            "dispense.dispense_position": {
+                "offset": {"x": 0, "y": 1.2, "z": -3},
+                "position_reference": "well-top",
+            },
+        },
+    },
+    "transfer_step_3": {
+        "pipette": "flex_8channel_1000",
+        "tiprack": "opentrons/opentrons_flex_96_tiprack_200ul/1",
+        "set": {
+            "aspirate.flow_rate_by_volume": [(0, 716)],
+            "dispense.dispense_position": {
+                "offset": {"x": 0, "y": 0, "z": 0},
+                "position_reference": "well-center",
+            },
+            "dispense.flow_rate_by_volume": [(0, 716)],
+            "dispense.push_out_by_volume": [(0, 20)],
+        },
+    },
+    "add SOC to 384 well plate": {
+        "pipette": "flex_8channel_50",
+        "tiprack": "opentrons/opentrons_flex_96_tiprack_50ul/1",
+        "set": {"dispense.retract.end_position.offset.z": 0},
+    },
+    "transfer_step_6": {
+        "pipette": "flex_8channel_50",
+        "tiprack": "opentrons/opentrons_flex_96_tiprack_50ul/1",
+        "set": {
+            "aspirate.aspirate_position.offset.z": 0.6,
+            "aspirate.flow_rate_by_volume": [(0, 29.5)],
+            "aspirate.mix": {"enabled": True, "repetitions": 3, "volume": 20},
+            "dispense.dispense_position.offset.z": 3,
+            "dispense.submerge.start_position.offset.z": 0,
+            "dispense.mix": {"enabled": True, "repetitions": 4, "volume": "$mix_volume"},
+        },
+    },
+    "stage SOC in 384 well plate": {
+        "pipette": "flex_8channel_1000",
+        "tiprack": "opentrons/opentrons_flex_96_tiprack_200ul/1",
+        "sections": ["aspirate", "dispense", "multi_dispense"],
+        "set": {
+            "aspirate.flow_rate_by_volume": [(0, 160)],
+            "multi_dispense.flow_rate_by_volume": [(0, 160)],
+            "multi_dispense.disposal_by_volume": [(0, 5)],
+        },
+    },
+}
+
+
+def _liquid_class_properties(name, **params):
+    spec = LIQUID_CLASSES[name]
+    sections = {
+        section: copy.deepcopy(LIQUID_CLASS_BASE[section])
+        for section in spec.get("sections", ("aspirate", "dispense"))
+    }
+    for path, value in spec["set"].items():
+        *parents, leaf = path.split(".")
+        target = sections
+        for key in parents:
+            target = target[key]
+        target[leaf] = copy.deepcopy(value)
+    for section in sections.values():
+        _fill_params(section, params)
+    return {spec["pipette"]: {spec["tiprack"]: sections}}
+
+
+def _fill_params(properties, params):
+    for key, value in properties.items():
+        if isinstance(value, dict):
+            _fill_params(value, params)
+        elif isinstance(value, str) and value.startswith("$"):
+            properties[key] = params[value[1:]]
+
+
+class RunTimer:
+    """Monotonic timings of the run's steps, liquid-handling calls and operator pauses.
+
+    Each event becomes one JSON line as soon as it ends, so a stopped run
+    still leaves its trace: ``{"event": "step" | "call" | "pause", "name",
+    "step", "t" (seconds since the run started), "s" (duration)}`` after a
+    ``"run"`` header with the parameters. Nothing is written while the
+    protocol is analysed or simulated.
+    """
+
+    def __init__(self, protocol, params):
+        self.protocol = protocol
+        self.origin = time.monotonic()
+        self.run_id = time.strftime("%Y%m%dT%H%M%S")
+        self.path = None
+        self.events = []
+        self.step_number = None
+        self.step_name = None
+        self.step_start = None
+        if not protocol.is_simulating():
+            try:
+                os.makedirs(TIMING_TRACE_DIR, exist_ok=True)
+                self.path = os.path.join(TIMING_TRACE_DIR, f"{self.run_id}.jsonl")
+            except OSError:
+                protocol.comment(f"Timing trace disabled: cannot create {TIMING_TRACE_DIR}")
+        self._write({"event": "run", "run": self.run_id, "protocol": metadata["protocolName"],
+                     "params": params})
+
+    def _write(self, entry):
+        self.events.append(entry)
+        if self.path is not None:
+            with open(self.path, "a", encoding="utf-8") as trace:
+                trace.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def _record(self, event, name, start):
+        end = time.monotonic()
+        self._write({"event": event, "name": name, "step": self.step_number,
+                     "t": round(start - self.origin, 3), "s": round(end - start, 3)})
+
+    def step(self, number, name):
+        """End the current step and start the next, marking it in the run log."""
+        self.finish()
+        self.protocol.comment(f"Step {number}: {name}")
+        self.step_number, self.step_name, self.step_start = number, name, time.monotonic()
+
+    def finish(self):
+        if self.step_start is not None:
+            self._record("step", self.step_name, self.step_start)
+            self.step_start = None
+
+    def pause(self, message):
+        """``protocol.pause``, timing how long the operator took to resume."""
+        start = time.monotonic()
+        self.protocol.pause(message)
+        self._record("pause", message.strip(), start)
+
+    def wrap(self, instrument, label, *methods):
+        """Time every call of ``methods`` on ``instrument`` (a pipette or module)."""
+        for method in methods:
+            original = getattr(instrument, method)
+
+            def timed(*args, _original=original, _name=f"{label} {method}", **kwargs):
+                start = time.monotonic()
+                try:
+                    return _original(*args, **kwargs)
+                finally:
+                    self._record("call", _name, start)
+
+            setattr(instrument, method, functools.wraps(original)(timed))
  
 def add_parameters(parameters):
     parameters.add_int(
         variable_name="number_of_samples",
         display_name="Number of Samples",
-        description="Total number of samples to process (must be multiple of 8)",
+        description="Total number of samples to process (must be multiple of 8, up to 96 per recovery plate)",
         default=24,
         minimum=8,
-        maximum=96,
+        maximum=384,
         unit="samples"
     )
     parameters.add_int(
@@ -92,6 +349,45 @@ def add_parameters(parameters):
         unit="column"
     )
 
+    parameters.add_int(
+        variable_name="recovery_plates",
+        display_name="Recovery plates (96-well)",
+        description="Number of 96-well recovery plates on the deck (C2, then C1, C3, D2). Samples continue into the next plate when one is full",
+        default=1,
+        minimum=1,
+        maximum=4,
+        unit="plates"
+    )
+
+    parameters.add_bool(
+        variable_name="partial_tip_pickup",
+        display_name="Partial tips for last column",
+        description="When the sample count is not a multiple of 8, recover the last column with only as many tips as it has samples",
+        default=False
+    )
+
+    parameters.add_str(
+        variable_name="step_7_schedule",
+        display_name="Step 7 schedule",
+        description="sequential: SOC is added to each 384 column just before it is mixed. staged: the right pipette adds SOC to all 384 wells first with one tip",
+        default="sequential",
+        choices=[
+            {"display_name": "Sequential", "value": "sequential"},
+            {"display_name": "Staged SOC", "value": "staged"}
+        ]
+    )
+
+    parameters.add_str(
+        variable_name="deck_mode",
+        display_name="Deck mode",
+        description="standard: the 384 plate comes off deck while SOC is pre-filled. pause_free: SOC is pre-filled while the block cools, before any cells are out, and the 384 plate stays in B2",
+        default="standard",
+        choices=[
+            {"display_name": "Standard", "value": "standard"},
+            {"display_name": "Pause-free", "value": "pause_free"}
+        ]
+    )
+
 def run(protocol: protocol_api.ProtocolContext) -> None:
     # Access runtime parameters
     bacteria_volume = protocol.params.bacteria_volume
@@ -99,6 +395,17 @@ def run(protocol: protocol_api.ProtocolContext) -> None:
     number_of_samples = protocol.params.number_of_samples
     start_well_384 = protocol.params.start_well_384
     start_column_96 = protocol.params.start_column_96
+    step_7_schedule = protocol.params.step_7_schedule
+    recovery_plates = protocol.params.recovery_plates
+    partial_tip_pickup = protocol.params.partial_tip_pickup
+    deck_mode = protocol.params.deck_mode
+    timer = RunTimer(protocol, {
+        "number_of_samples": number_of_samples, "bacteria_volume": bacteria_volume,
+        "soc_volume": soc_volume, "start_well_384": start_well_384,
+        "start_column_96": start_column_96, "step_7_schedule": step_7_schedule,
+        "recovery_plates": recovery_plates, "partial_tip_pickup": partial_tip_pickup,
+        "deck_mode": deck_mode,
+    })
     
     # Calculate number of columns needed (8 samples per column for 8-channel pipette)
     num_columns = math.ceil(number_of_samples / 8)
@@ -106,19 +413,24 @@ def run(protocol: protocol_api.ProtocolContext) -> None:
     # Calculate end column for 96-well plate
     end_column_96 = start_column_96 + num_columns - 1 #the minus one is because Python works with counting starting from 0.
     
-    # Validate that we don't exceed plate boundaries
-    if end_column_96 > 12:
-        raise ValueError(f"Not enough columns in 96-well plate. Need {num_columns} columns starting from column {start_column_96}")
+    # Validate that we don't exceed plate boundaries. Columns past 12 run on into the next recovery plate.
+    if end_column_96 > 12 * recovery_plates:
+        plates_text = "96-well plate" if recovery_plates == 1 else f"{recovery_plates} 96-well plates"
+        raise ValueError(f"Not enough columns in {plates_text}. Need {num_columns} columns starting from column {start_column_96}")
+    plates_used = (end_column_96 - 1) // 12 + 1
+    column_plates = [(column - 1) // 12 for column in range(start_column_96, end_column_96 + 1)]
     
     # Parse starting well for 384-well plate to get row and column
     start_row_384 = start_well_384[0]
     start_col_384 = int(start_well_384[1:])
-    
-    # Calculate end column for 384-well plate
-    end_col_384 = start_col_384 + num_columns - 1
-    
-    if end_col_384 > 24:
-        raise ValueError(f"Not enough columns in 384-well plate. Need {num_columns} columns starting from column {start_col_384}")
+
+    # The 8-channel head lands on row A or B of each 384 column (A1, B1, A2, B2, ... B24),
+    # so the plate has 48 head positions. Work out the first and last one we need.
+    start_head_384 = (start_col_384 - 1) * 2 + "AB".index(start_row_384)
+    end_head_384 = start_head_384 + num_columns - 1
+
+    if end_head_384 > 47:
+        raise ValueError(f"Not enough columns in 384-well plate. Need {num_columns} columns starting from well {start_well_384}")
     
     # Load Modules:
     temperature_module_1 = protocol.load_module("temperatureModuleV2", "B1")
@@ -155,12 +467,15 @@ def run(protocol: protocol_api.ProtocolContext) -> None:
         namespace="opentrons",
         version=4,
     )
-    _96_well_PCR = protocol.load_labware(
-        "biorad_96_wellplate_200ul_pcr",
-        location="C2",
-        namespace="opentrons",
-        version=3,
-    )
+    recovery_plates_96 = [
+        protocol.load_labware(
+            "biorad_96_wellplate_200ul_pcr",
+            location=slot,
+            namespace="opentrons",
+            version=3,
+        )
+        for slot in RECOVERY_PLATE_SLOTS[:plates_used]
+    ]
     _384_well_plate = protocol.load_labware(
         "appliedbiosystemsmicroamp_384_wellplate_40ul",
         location="B2",
@@ -180,6 +495,39 @@ def run(protocol: protocol_api.ProtocolContext) -> None:
  
     # Load Waste Chute:
     waste_chute = protocol.load_waste_chute()
+
+    for pipette in (pipette_left, pipette_right):
+        timer.wrap(pipette, pipette.mount, "transfer_with_liquid_class", "distribute_with_liquid_class")
+    timer.wrap(temperature_module_1, "temperature module", "set_temperature", "await_temperature")
+
+    # Tip columns left in the 50 µL racks (tip_rack_1, tip_rack_2). When a run needs more, the
+    # operator swaps in full racks: at the "plate back" pause if step 7 would run out, otherwise
+    # mid step 7. tip_rack_3 (200 µL) covers the right pipette for any run size.
+    left_tip_capacity = len(tip_rack_1.columns()) + len(tip_rack_2.columns())
+    left_tips_left = left_tip_capacity
+
+    def replace_left_tips(message):
+        nonlocal left_tips_left
+        timer.pause(message)
+        pipette_left.reset_tipracks()
+        left_tips_left = left_tip_capacity
+
+    def use_left_tips(columns):
+        nonlocal left_tips_left
+        if columns > left_tips_left:
+            replace_left_tips("Replace the 50 µL tip racks in A1 and A2 with full racks.")
+        left_tips_left -= columns
+
+    # Define Liquid Classes: each (class, parameters) pair is defined once per run and reused.
+    liquid_classes = {}
+
+    def get_liquid_class(name, **params):
+        key = (name, tuple(sorted(params.items())))
+        if key not in liquid_classes:
+            liquid_classes[key] = protocol.define_liquid_class(
+                name=name, properties=_liquid_class_properties(name, **params)
+            )
+        return liquid_classes[key]
  
     # Define Liquids:
     liq_assembly = protocol.define_liquid(
@@ -196,390 +544,201 @@ def run(protocol: protocol_api.ProtocolContext) -> None:
     )
  
     # Load Liquids:
-    aluminum_block_1.load_liquid(
-        wells=[
-            "A12", "B12", "C12", "D12", "E12", "F12", "G12", "H12"
-        ],
-        liquid=liq_comp_cells,
-        volume=50,
-    )
+    # One comp cell strip per recovery plate, in block column 12, then 11, 10 and 9.
+    cell_strips = [aluminum_block_1.columns()[11 - plate] for plate in range(plates_used)]
+    for strip in cell_strips:
+        aluminum_block_1.load_liquid(
+            wells=[well.well_name for well in strip],
+            liquid=liq_comp_cells,
+            volume=50,
+        )
     
     # Generate destination wells for 384-well plate based on parameters
-    # The 384-well plate follows an alternating A/B pattern within each column
-    dest_wells_384 = []
-    for col_offset in range(num_columns):
-        col_num = start_col_384 + col_offset
-        # Determine if we start with A or B row based on the starting well
-        if start_row_384 == 'A':
-            well_a = f"A{col_num}"
-            well_b = f"B{col_num}"
-            dest_wells_384.extend([_384_well_plate[well_a], _384_well_plate[well_b]])
-        else:  # Starting with B
-            well_b = f"B{col_num}"
-            # Next well in pattern would be A of next column
-            if col_num < 24:
-                well_a_next = f"A{col_num + 1}"
-                dest_wells_384.extend([_384_well_plate[well_b], _384_well_plate[well_a_next]])
-            else:
-                dest_wells_384.append(_384_well_plate[well_b])
-    
-    # Trim to exact number of columns needed
-    dest_wells_384 = dest_wells_384[:num_columns]
-    
+    # The 384-well plate follows an alternating A/B pattern within each column:
+    # head position h sits on row "AB"[h % 2] of column h // 2 + 1.
+    rows_384 = _384_well_plate.rows()
+    dest_wells_384 = [
+        rows_384[head % 2][head // 2] for head in range(start_head_384, end_head_384 + 1)
+    ]
+
     # Load liquid into calculated 384-well plate wells
     for well in dest_wells_384:
         well.load_liquid(liquid=liq_assembly, volume=5)
     
+    # SOC for each recovery plate comes from its own reservoir well (A1, A2, ...).
+    soc_wells = reservoir_1.wells()[:plates_used]
     reservoir_1.load_liquid(
-        wells=["A1"],
+        wells=[well.well_name for well in soc_wells],
         liquid=liq_SOC,
         volume=12000,
     )
     
-    # Generate destination columns for 96-well plate based on parameters
-    dest_columns_96 = []
-    for col_offset in range(num_columns):
-        col_num = start_column_96 + col_offset
-        dest_columns_96.append(_96_well_PCR.columns()[col_num - 1][0])
+    # Generate destination columns for 96-well plates based on parameters
+    dest_columns_96 = [
+        recovery_plates_96[plate].rows()[0][(column - 1) % 12]
+        for plate, column in zip(column_plates, range(start_column_96, end_column_96 + 1))
+    ]
+
+    # SOC for each destination column comes from its plate's reservoir well.
+    soc_sources = [soc_wells[plate] for plate in column_plates]
+
+    def fill_recovery_plates():
+        # Step 5: Transfer SOC (using runtime parameter) to 96 well plate
+        timer.step(5, "fill recovery plates with SOC")
+        pipette_right.transfer_with_liquid_class(
+            volume=soc_volume,
+            source=soc_sources,
+            dest=dest_columns_96,
+            new_tip="once",
+            trash_location=waste_chute,
+            group_wells=False,
+            keep_last_tip=False,
+            liquid_class=get_liquid_class("transfer_step_3"),
+        )
 
     # PROTOCOL STEPS
     # Step 1: take temperature module to 4 degrees
-    temperature_module_1.set_temperature(celsius=4)
+    timer.step(1, "cool temperature module")
+    if deck_mode == "pause_free":
+        # Pre-fill SOC while the block cools: no cells are out yet, so the 384 plate can stay in
+        # B2 for the rest of the run. Steps keep their numbers so timing traces line up by step.
+        temperature_module_1.start_set_temperature(celsius=4)
+        fill_recovery_plates()
+    else:
+        temperature_module_1.set_temperature(celsius=4)
 
     # Step 2: pause to put competent cells into temperature module. 
-    protocol.pause("put Competent cells strip in Column 12. \n")
-
-    # Step 3: Distribute bacteria (using runtime parameter)
-    pipette_left.distribute_with_liquid_class(
-        volume=bacteria_volume,
-        source=[aluminum_block_1["A12"]],
-        dest=dest_wells_384,
-        new_tip="once",
-        group_wells=False,
-        trash_location=waste_chute,
-        liquid_class=protocol.define_liquid_class(
-            name="distribute_step_1",
-            properties={"flex_8channel_50": {"opentrons/opentrons_flex_96_tiprack_50ul/1": {
-                "aspirate": {
-                    "aspirate_position": {
-                        "offset": {"x": 0, "y": 0, "z": 0.2},
-                        "position_reference": "well-bottom",
-                    },
-                    "flow_rate_by_volume": [(0, 24)],
-                    "pre_wet": False,
-                    "correction_by_volume": [(0, 0)],
-                    "delay": {"enabled": False},
-                    "mix": {"enabled": False},
-                    "submerge": {
-                        "delay": {"enabled": False},
-                        "speed": 100,
-                        "start_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                    },
-                    "retract": {
-                        "air_gap_by_volume": [(0, 0)],
-                        "delay": {"enabled": False},
-                        "end_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                        "speed": 50,
-                        "touch_tip": {"enabled": False},
-                    },
-                },
-                "dispense": {
-                    "dispense_position": {
-                        "offset": {"x": 0, "y": 1.2, "z": -3},
-                        "position_reference": "well-top",
-                    },
-                    "flow_rate_by_volume": [(0, 50)],
-                    "delay": {"enabled": False},
-                    "submerge": {
-                        "delay": {"enabled": False},
-                        "speed": 100,
-                        "start_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                    },
-                    "retract": {
-                        "air_gap_by_volume": [(0, 0)],
-                        "delay": {"enabled": False},
-                        "end_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                        "speed": 50,
-                        "touch_tip": {"enabled": False},
-                        "blowout": {"enabled": False},
-                    },
-                    "correction_by_volume": [(0, 0)],
-                    "push_out_by_volume": [(0, 2)],
-                    "mix": {"enabled": False},
-                },
-                "multi_dispense": {
-                    "dispense_position": {
-                        "offset": {"x": 0, "y": 0.8, "z": -3},
-                        "position_reference": "well-top",
-                    },
-                    "flow_rate_by_volume": [(0, 50)],
-                    "delay": {"enabled": False},
-                    "submerge": {
-                        "delay": {"enabled": False},
-                        "speed": 100,
-                        "start_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                    },
-                    "retract": {
-                        "air_gap_by_volume": [(0, 0)],
-                        "delay": {"enabled": False},
-                        "end_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                        "speed": 50,
-                        "touch_tip": {"enabled": False},
-                        "blowout": {"enabled": False},
-                    },
-                    "correction_by_volume": [(0, 0)],
-                    "conditioning_by_volume": [(0, 0)],
-                    "disposal_by_volume": [(0, 0)],
-                },
-            }}},
-        ),
-    )
+    timer.step(2, "load competent cells")
+    if deck_mode == "pause_free":
+        temperature_module_1.await_temperature(celsius=4)
+    if plates_used == 1:
+        timer.pause("put Competent cells strip in Column 12. \n")
+    else:
+        strip_columns = ", ".join(str(12 - plate) for plate in range(plates_used))
+        timer.pause(f"put Competent cells strips in Columns {strip_columns}. \n")
 
-    # Step 4:
-    protocol.pause("Take the plate out AND PRESS RESUME to let the protocol pre-fill the destination plate with SOC.\n")
-
-    # Step 5: Transfer SOC (using runtime parameter) to 96 well plate
-    soc_sources = [reservoir_1["A1"]] * num_columns # Create source list (all from reservoir A1)
-
-    pipette_right.transfer_with_liquid_class(
-        volume=soc_volume,
-        source=soc_sources,
-        dest=dest_columns_96,
-        new_tip="once",
-        trash_location=waste_chute,
-        group_wells=False,
-        keep_last_tip=False,
-        liquid_class=protocol.define_liquid_class(
-            name="transfer_step_3",
-            properties={"flex_8channel_1000": {"opentrons/opentrons_flex_96_tiprack_200ul/1": {
-                "aspirate": {
-                    "aspirate_position": {
-                        "offset": {"x": 0, "y": 0, "z": 1},
-                        "position_reference": "well-bottom",
-                    },
-                    "flow_rate_by_volume": [(0, 716)],
-                    "pre_wet": False,
-                    "correction_by_volume": [(0, 0)],
-                    "delay": {"enabled": False},
-                    "mix": {"enabled": False},
-                    "submerge": {
-                        "delay": {"enabled": False},
-                        "speed": 100,
-                        "start_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                    },
-                    "retract": {
-                        "air_gap_by_volume": [(0, 0)],
-                        "delay": {"enabled": False},
-                        "end_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                        "speed": 50,
-                        "touch_tip": {"enabled": False},
-                    },
-                },
-                "dispense": {
-                    "dispense_position": {
-                        "offset": {"x": 0, "y": 0, "z": 0},
-                        "position_reference": "well-center",
-                    },
-                    "flow_rate_by_volume": [(0, 716)],
-                    "delay": {"enabled": False},
-                    "submerge": {
-                        "delay": {"enabled": False},
-                        "speed": 100,
-                        "start_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                    },
-                    "retract": {
-                        "air_gap_by_volume": [(0, 0)],
-                        "delay": {"enabled": False},
-                        "end_position": {
-                            "offset": {"x": 0, "y": 0, "z": 2},
-                            "position_reference": "well-top",
-                        },
-                        "speed": 50,
-                        "touch_tip": {"enabled": False},
-                        "blowout": {"enabled": False},
-                    },
-                    "correction_by_volume": [(0, 0)],
-                    "push_out_by_volume": [(0, 20)],
-                    "mix": {"enabled": False},
-                },
-            }}},
-        ),
-    )
+    # Step 3: Distribute bacteria (using runtime parameter), each plate's columns from its own strip.
+    # The tip only touches the cells and dispenses above the 384 wells, so one tip serves every strip.
+    timer.step(3, "distribute competent cells")
+    use_left_tips(1)
+    for plate, strip in enumerate(cell_strips):
+        pipette_left.distribute_with_liquid_class(
+            volume=bacteria_volume,
+            source=[strip[0]],
+            dest=[well for well, well_plate in zip(dest_wells_384, column_plates) if well_plate == plate],
+            new_tip="once" if plate == 0 else "never",
+            group_wells=False,
+            trash_location=waste_chute,
+            keep_last_tip=plate < plates_used - 1,
+            liquid_class=get_liquid_class("distribute_step_1"),
+        )
+
+    if deck_mode != "pause_free":
+        # Step 4:
+        timer.step(4, "take out 384 plate")
+        timer.pause("Take the plate out AND PRESS RESUME to let the protocol pre-fill the destination plate with SOC.\n")
+
+        fill_recovery_plates()
 
-    # Step 6:
-    protocol.pause("Put the plate back into B2")
+        # Step 6: fold a tip rack swap into this pause when step 7 would otherwise run out part way.
+        timer.step(6, "put back 384 plate")
+        if num_columns > left_tips_left:
+            replace_left_tips("Put the plate back into B2 and replace the 50 µL tip racks in A1 and A2 with full racks.")
+        else:
+            timer.pause("Put the plate back into B2")
 
     # Step 7: Transfer SOC to Assembly plate (using runtime parameter) then mix and transfer the diluted bact into 96 well plate. 
-    for x in range(num_columns):
+    # The liquid classes are the same for every column, so define them once up front.
+    timer.step(7, "recover samples")
+    transfer_step_6_class = get_liquid_class(
+        "transfer_step_6", mix_volume=(soc_volume + bacteria_volume + 10 + 20) / 2
+    )
+    add_soc_class = get_liquid_class("add SOC to 384 well plate")
+
+    def recover_column(soc_source, well_384, well_96):
         pipette_left.transfer_with_liquid_class(
             volume=10,
-            source=soc_sources[x],
-            dest=dest_wells_384[x],
+            source=soc_source,
+            dest=well_384,
             new_tip="always",
             group_wells = False,
             keep_last_tip = True,
-            liquid_class=protocol.define_liquid_class(
-                name="add SOC to 384 well plate",
-                properties={"flex_8channel_50": {"opentrons/opentrons_flex_96_tiprack_50ul/1": {
-                    "aspirate": {
-                        "aspirate_position": {
-                            "offset": {"x": 0, "y": 0, "z": 1},
-                            "position_reference": "well-bottom",
-                            },
-                        "flow_rate_by_volume": [(0, 24)],
-                        "pre_wet": False,
-                        "correction_by_volume": [(0, 0)],
-                        "delay": {"enabled": False},
-                        "mix": {"enabled": False},
-                        "submerge": {
-                            "delay": {"enabled": False},
-                            "speed": 100,
-                            "start_position": {
-                                "offset": {"x": 0, "y": 0, "z": 2},
-                                "position_reference": "well-top",
-                                },
-                            },
-                        "retract": {
-                            "air_gap_by_volume": [(0, 0)],
-                            "delay": {"enabled": False},
-                            "end_position": {
-                                "offset": {"x": 0, "y": 0, "z": 2},
-                                "position_reference": "well-top",
-                                },
-                            "speed": 50,
-                            "touch_tip": {"enabled": False},
-                            },
-                        },
-                    "dispense": {
-                        "dispense_position": {
-                            "offset": {"x": 0, "y": 0, "z": 1},
-                            "position_reference": "well-bottom",
-                            },
-                        "flow_rate_by_volume": [(0, 50)],
-                        "delay": {"enabled": False},
-                        "submerge": {
-                            "delay": {"enabled": False},
-                            "speed": 100,
-                            "start_position": {
-                                "offset": {"x": 0, "y": 0, "z": 2},
-                                "position_reference": "well-top",
-                                },
-                            },
-                        "retract": {
-                            "air_gap_by_volume": [(0, 0)],
-                            "delay": {"enabled": False},
-                            "end_position": {
-                                "offset": {"x": 0, "y": 0, "z": 0},
-                                "position_reference": "well-top",
-                                },
-                            "speed": 50,
-                            "touch_tip": {"enabled": False},
-                            "blowout": {"enabled": False},
-                        },
-                        "correction_by_volume": [(0, 0)],
-                        "push_out_by_volume": [(0, 2)],
-                        "mix": {"enabled": False},
-                    },
-                }}},
-            ),
+            liquid_class=add_soc_class,
         )
         pipette_left.transfer_with_liquid_class(
             volume=40,
-            source=dest_wells_384[x],
-            dest=dest_columns_96[x],
+            source=well_384,
+            dest=well_96,
             new_tip="never",
             trash_location=waste_chute,
             group_wells=False,
             keep_last_tip=False,
-            liquid_class=protocol.define_liquid_class(
-                name="transfer_step_6",
-                properties={"flex_8channel_50": {"opentrons/opentrons_flex_96_tiprack_50ul/1": {
-                    "aspirate": {
-                        "aspirate_position": {
-                            "offset": {"x": 0, "y": 0, "z": 0.6},
-                            "position_reference": "well-bottom",
-                        },
-                        "flow_rate_by_volume": [(0, 29.5)],
-                        "pre_wet": False,
-                        "correction_by_volume": [(0, 0)],
-                        "delay": {"enabled": False},
-                        "mix": {"enabled": True, "repetitions": 3, "volume": 20},
-                        "submerge": {
-                            "delay": {"enabled": False},
-                            "speed": 100,
-                            "start_position": {
-                                "offset": {"x": 0, "y": 0, "z": 2},
-                                "position_reference": "well-top",
-                            },
-                        },
-                        "retract": {
-                            "air_gap_by_volume": [(0, 0)],
-                            "delay": {"enabled": False},
-                            "end_position": {
-                                "offset": {"x": 0, "y": 0, "z": 2},
-                                "position_reference": "well-top",
-                            },
-                            "speed": 50,
-                            "touch_tip": {"enabled": False},
-                        },
-                    },
-                    "dispense": {
-                        "dispense_position": {
-                            "offset": {"x": 0, "y": 0, "z": 3},
-                            "position_reference": "well-bottom",
-                        },
-                        "flow_rate_by_volume": [(0, 50)],
-                        "delay": {"enabled": False},
-                        "submerge": {
-                            "delay": {"enabled": False},
-                            "speed": 100,
-                            "start_position": {
-                                "offset": {"x": 0, "y": 0, "z": 0},
-                                "position_reference": "well-top",
-                            },
-                        },
-                        "retract": {
-                            "air_gap_by_volume": [(0, 0)],
-                            "delay": {"enabled": False},
-                            "end_position": {
-                                "offset": {"x": 0, "y": 0, "z": 2},
-                                "position_reference": "well-top",
-                            },
-                            "speed": 50,
-                            "touch_tip": {"enabled": False},
-                            "blowout": {"enabled": False},
-                        },
-                        "correction_by_volume": [(0, 0)],
-                        "push_out_by_volume": [(0, 2)],
-                        "mix": {"enabled": True, "repetitions": 4, "volume": ((soc_volume+bacteria_volume+10+20)/2)},
-                    },
-                }}},
-            ),
+            liquid_class=transfer_step_6_class,
+        )
+
+    # With partial tip pickup, a part-filled last column is recovered separately below.
+    trailing_samples = number_of_samples % 8
+    partial_last_column = partial_tip_pickup and trailing_samples > 0
+    full_columns = num_columns - 1 if partial_last_column else num_columns
+
+    if step_7_schedule == "staged":
+        # Both mounts share one gantry, so they cannot move at the same time. Instead the idle
+        # right pipette stages SOC into every 384 well first (non-contact multi-dispense, one tip),
+        # which takes the reservoir round trip out of each left-pipette column.
+        for plate, soc_well in enumerate(soc_wells):
+            pipette_right.distribute_with_liquid_class(
+                volume=10,
+                source=[soc_well],
+                dest=[well for well, well_plate in zip(dest_wells_384, column_plates) if well_plate == plate],
+                new_tip="once" if plate == 0 else "never",
+                group_wells=False,
+                trash_location=waste_chute,
+                keep_last_tip=plate < plates_used - 1,
+                liquid_class=get_liquid_class("stage SOC in 384 well plate"),
+            )
+        x = 0
+        while x < full_columns:
+            count = min(full_columns - x, left_tips_left or left_tip_capacity)
+            use_left_tips(count)
+            pipette_left.transfer_with_liquid_class(
+                volume=40,
+                source=dest_wells_384[x:x + count],
+                dest=dest_columns_96[x:x + count],
+                new_tip="always",
+                trash_location=waste_chute,
+                group_wells=False,
+                keep_last_tip=False,
+                liquid_class=transfer_step_6_class,
+            )
+            x += count
+    else:
+        for x in range(full_columns):
+            use_left_tips(1)
+            recover_column(soc_sources[x], dest_wells_384[x], dest_columns_96[x])
+
+    if partial_last_column:
+        # Pick up one tip per sample. H1 is the primary nozzle and the active nozzles reach back
+        # towards row A, so each transfer targets the well of the column's last sample.
+        pipette_left.configure_nozzle_layout(
+            style=protocol_api.PARTIAL_COLUMN if trailing_samples > 1 else protocol_api.SINGLE,
+            start="H1",
+            end=f"{'ABCDEFGH'[8 - trailing_samples]}1" if trailing_samples > 1 else None,
+            tip_racks=[tip_rack_1, tip_rack_2],
         )
+        last_well_384 = rows_384[end_head_384 % 2 + 2 * (trailing_samples - 1)][end_head_384 // 2]
+        last_well_96 = recovery_plates_96[column_plates[-1]].rows()[trailing_samples - 1][(end_column_96 - 1) % 12]
+        use_left_tips(1)
+        if step_7_schedule == "staged":
+            pipette_left.transfer_with_liquid_class(
+                volume=40,
+                source=last_well_384,
+                dest=last_well_96,
+                new_tip="always",
+                trash_location=waste_chute,
+                group_wells=False,
+                keep_last_tip=False,
+                liquid_class=transfer_step_6_class,
+            )
+        else:
+            recover_column(soc_sources[-1], last_well_384, last_well_96)
+    timer.finish()
@@ -0,0 +1,7 @@
+"""Offline tooling for the Earlham Biofoundry robotic protocols.
+
+The protocols themselves stay self-contained so they can be uploaded to the
+instruments as-is; the modules in this package are used on workstations and by
+the LIMS to plan, check and analyse runs. Run them from the repository root,
+e.g. ``python -m biof_tools.well_layout``.
+"""
@@ -0,0 +1,356 @@
+"""On-disk cache of Flex protocol analyses, keyed by content, API level and parameters.
+
+Queuing the same protocol with the same runtime parameters should not mean
+analysing it again. ``analyze`` keys each analysis on:
+- the SHA-256 of the protocol file;
+- its ``apiLevel``;
+- the full resolved parameter set, so a default spelled out and a default
+  left implicit share an entry;
+- the analyzer and, for simulations, the ``TimeModel``.
+It answers from an ``AnalysisCache`` when it can.
+
+Two analyzers are supported:
+
+* ``flex_sim`` (default) - ``biof_tools.flex_sim``. The entry holds the
+  command list in columns (field names once, then one row per command),
+  any error, and the time and tip estimates.
+* ``opentrons`` - ``python -m opentrons.cli analyze`` when the ``opentrons``
+  package is installed. The entry holds the analysis' ``commands`` and
+  ``errors`` as the robot software reports them.
+
+Entries are gzip-compressed JSON files named by their key. They are written
+under a temporary name and renamed into place, and each hit refreshes the
+entry's modification time. Least recently used entries are evicted once
+the cache exceeds ``max_bytes`` or ``max_entries``.
+
+    python -m biof_tools.analysis_cache --param number_of_samples=96 --json
+    python -m biof_tools.analysis_cache --param number_of_samples=96 --opentrons
+    python -m biof_tools.analysis_cache --stats
+"""
+
+import builtins
+from dataclasses import asdict, fields
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+from . import flex_sim
+from .bms_diff import file_digest
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "biof_tools", "analysis",
+)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+COMMAND_FIELDS = tuple(field.name for field in fields(flex_sim.SimCommand))
+SUFFIX = f".v{CACHE_VERSION}.json.gz"
+
+
+class AnalysisCache:
+    """Analysis entries on disk with least-recently-used eviction by total size and count.
+
+    As with ``bms_diff.TreeCache``, an entry's modification time is its last
+    use, so there is no index file to keep consistent between processes.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_entries=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """The entry stored under ``key``, or ``None``."""
+        path = self._entry(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as handle:
+                entry = json.load(handle)
+        except (OSError, EOFError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted by another process meanwhile
+        return entry
+
+    def put(self, key, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._entry(key)
+        partial = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(partial, "wt", encoding="utf-8", compresslevel=6) as handle:
+            json.dump(entry, handle, separators=(",", ":"))
+        os.replace(partial, path)
+        self.evict()
+
+    def entries(self):
+        """``(mtime, size, path)`` of every entry, most recently used first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = []
+        for name in names:
+            if name.endswith(SUFFIX):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        found.sort(reverse=True)
+        return found
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within its bounds."""
+        total = 0
+        for count, (_, size, path) in enumerate(self.entries(), 1):
+            total += size
+            if total > self.max_bytes or (self.max_entries is not None and count > self.max_entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+
+
+def api_level(protocol):
+    """``apiLevel`` of a loaded protocol module, from ``requirements`` or ``metadata``."""
+    for name in ("requirements", "metadata"):
+        level = (getattr(protocol, name, None) or {}).get("apiLevel")
+        if level:
+            return str(level)
+    return None
+
+
+def cache_key(digest, level, params, analyzer, time_model=None):
+    text = json.dumps({
+        "protocol": digest,
+        "apiLevel": level,
+        "params": params,
+        "analyzer": analyzer,
+        "time_model": asdict(time_model) if time_model is not None else None,
+    }, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+_loaded = {}
+
+
+def _load(path, digest):
+    """The protocol module at ``path``, loaded once per content hash in this process."""
+    module = _loaded.get((path, digest))
+    if module is None:
+        module = _loaded[path, digest] = flex_sim.load_protocol(path)
+    return module
+
+
+def _lookup(path, params, cache, analyzer, time_model=None):
+    """``(entry, key, protocol, resolved)`` for an analysis; ``entry`` is ``None`` on a miss.
+
+    Keys are built from the resolved parameters, which takes importing the
+    protocol. A small alias entry keyed on the overrides as given points at
+    the full key, so a repeated request is answered without the import.
+    """
+    digest = file_digest(path)
+    alias = cache_key(digest, None, sorted((params or {}).items()), analyzer + ":alias", time_model)
+    if cache is not None:
+        pointer = cache.get(alias)
+        entry = cache.get(pointer["key"]) if pointer else None
+        if entry is not None:
+            return entry, pointer["key"], None, entry["params"]
+    protocol = _load(path, digest)
+    resolved = flex_sim.parameter_definitions(protocol).resolve(params)
+    key = cache_key(digest, api_level(protocol), resolved, analyzer, time_model)
+    if cache is None:
+        return None, key, protocol, resolved
+    entry = cache.get(key)
+    cache.put(alias, {"key": key})
+    return entry, key, protocol, resolved
+
+
+def _error(exc):
+    return {"type": type(exc).__name__, "detail": str(exc)}
+
+
+def _exception(error):
+    """An exception of the recorded type where it is known, else a ``RuntimeError``."""
+    cls = getattr(flex_sim, error["type"], None) or getattr(builtins, error["type"], None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        return cls(error["detail"])
+    return RuntimeError(f"{error['type']}: {error['detail']}")
+
+
+def _estimates(result):
+    return {
+        "seconds": round(result.seconds, 3),
+        "wait_seconds": round(result.wait_seconds(), 3),
+        "segments": [round(seconds, 3) for seconds in result.segments()],
+        "tips": dict(result.tips_used()),
+        "counts": dict(result.counts()),
+    }
+
+
+def simulation_entry(result):
+    """Cache entry for a ``flex_sim.SimResult``."""
+    return {
+        "analyzer": "flex_sim",
+        "params": result.params,
+        "errors": [] if result.error is None else [_error(result.error)],
+        "fields": COMMAND_FIELDS,
+        "commands": [[getattr(command, name) for name in COMMAND_FIELDS] for command in result.commands],
+        "estimates": _estimates(result),
+    }
+
+
+def simulation_result(entry):
+    """The ``flex_sim.SimResult`` a ``simulation_entry`` was made from."""
+    columns = entry["fields"]
+    commands = []
+    for row in entry["commands"]:
+        values = dict(zip(columns, row))
+        values["wells"] = tuple(values.get("wells") or ())
+        commands.append(flex_sim.SimCommand(**values))
+    errors = entry["errors"]
+    return flex_sim.SimResult(entry["params"], commands, _exception(errors[0]) if errors else None)
+
+
+def analyze(path=flex_sim.DEFAULT_PROTOCOL, params=None, cache=None, time_model=None):
+    """``(SimResult, cached)`` for a protocol file and parameter overrides."""
+    time_model = time_model or flex_sim.TimeModel()
+    entry, key, protocol, resolved = _lookup(path, params, cache, "flex_sim", time_model)
+    if entry is not None:
+        return simulation_result(entry), True
+    result = flex_sim.run_protocol(protocol, resolved, time_model)
+    if cache is not None:
+        cache.put(key, simulation_entry(result))
+    return result, False
+
+
+def opentrons_version():
+    from importlib import metadata
+
+    try:
+        return metadata.version("opentrons")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def analyze_with_opentrons(path=flex_sim.DEFAULT_PROTOCOL, params=None, cache=None):
+    """``(entry, cached)`` from ``opentrons.cli analyze`` with runtime parameters ``params``.
+
+    ``entry`` holds ``commands`` and ``errors`` as the analysis reports them.
+    """
+    import subprocess
+    import tempfile
+
+    version = opentrons_version()
+    if version is None:
+        raise RuntimeError("the opentrons package is not installed")
+    entry, key, _, resolved = _lookup(path, params, cache, f"opentrons-{version}")
+    if entry is not None:
+        return entry, True
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "analysis.json")
+        completed = subprocess.run(
+            [sys.executable, "-m", "opentrons.cli", "analyze", "--json-output", output, path,
+             "--rtp-values", json.dumps(resolved)],
+            capture_output=True, text=True,
+        )
+        if not os.path.exists(output):
+            raise RuntimeError(f"opentrons analysis failed: {completed.stderr.strip()}")
+        with open(output, encoding="utf-8") as handle:
+            analysis = json.load(handle)
+    entry = {
+        "analyzer": f"opentrons-{version}",
+        "params": resolved,
+        "errors": [{"type": error.get("errorType", "error"), "detail": error.get("detail", "")}
+                   for error in analysis.get("errors", [])],
+        "commands": analysis.get("commands", []),
+    }
+    if cache is not None:
+        cache.put(key, entry)
+    return entry, False
+
+
+def summary(entry, cached):
+    """The JSON-able summary handed to other tools: parameters, errors and estimates."""
+    return {
+        "analyzer": entry["analyzer"],
+        "cached": cached,
+        "params": entry["params"],
+        "ok": not entry["errors"],
+        "errors": entry["errors"],
+        "commands": len(entry["commands"]),
+        "estimates": entry.get("estimates"),
+    }
+
+
+def main(argv=None):
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Analyse a Flex protocol, answering from a local cache.")
+    parser.add_argument("protocol", nargs="?", default=flex_sim.DEFAULT_PROTOCOL)
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("--opentrons", action="store_true",
+                        help="use the opentrons package's analysis instead of the simulator")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-mb", type=float, default=DEFAULT_MAX_BYTES / 1024 / 1024,
+                        help="cache size bound")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--clear-cache", action="store_true")
+    parser.add_argument("--stats", action="store_true", help="print the cache size and stop")
+    args = parser.parse_args(argv)
+
+    cache = None if args.no_cache else AnalysisCache(args.cache_dir, int(args.max_mb * 1024 * 1024))
+    if cache is not None and args.clear_cache:
+        cache.clear()
+    if args.stats:
+        if cache is not None:
+            entries = cache.entries()
+            print(f"{args.cache_dir}: {len(entries)} entries, "
+                  f"{sum(size for _, size, _ in entries) / 1024:.0f} KiB of {args.max_mb:g} MiB")
+        return
+
+    started = time.perf_counter()
+    try:
+        if args.opentrons:
+            entry, cached = analyze_with_opentrons(args.protocol, flex_sim.parse_params(args.param), cache)
+        else:
+            result, cached = analyze(args.protocol, flex_sim.parse_params(args.param), cache)
+            entry = simulation_entry(result)
+    except (OSError, ValueError, RuntimeError) as exc:
+        print(f"{args.protocol}: error: {exc}", file=sys.stderr)
+        sys.exit(2)
+    elapsed = time.perf_counter() - started
+    if args.json:
+        print(json.dumps(summary(entry, cached), indent=1))
+    elif args.opentrons:
+        print("parameters: " + ", ".join(f"{k}={v}" for k, v in entry["params"].items()))
+        print(f"commands: {len(entry['commands'])}")
+        for error in entry["errors"]:
+            print(f"error: {error['type']}: {error['detail']}")
+    else:
+        print("\n".join(flex_sim.report(result)))
+    print(f"# {'cache hit' if cached else 'analysed'} in {elapsed * 1000:.0f} ms", file=sys.stderr)
+    sys.exit(1 if entry["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
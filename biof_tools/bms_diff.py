@@ -0,0 +1,309 @@
+"""Semantic diff of CyBio Felix ``.bms`` method versions.
+
+``load_tree`` reduces a method to plain data: one dict per command with its
+``kind``, ``title``, ``enabled`` flag, ``properties`` and sub-``steps``.
+Nested property objects (variable descriptors, control attributes) are
+flattened into dicts of their own properties. ``diff`` lines the steps of
+two versions up level by level, matching siblings on kind and title, and
+reports added, removed and changed steps with the property values that
+differ (``volume``, ``relposz``, ``positioningtype``, ...).
+
+Parsed trees are kept in a ``TreeCache``: JSON files named by the SHA-256
+of the method file, so renamed copies and unchanged revisions are never
+parsed twice. The least recently used entries are evicted past
+``max_entries``.
+
+    python -m biof_tools.bms_diff old/AMPure_beads_PCR_cleanup_V13.bms \\
+        "CyBio Felix protocols/BioF-CYB-0010 AMPure_beads_PCR_cleanup_V14.bms"
+"""
+
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+import hashlib
+import json
+import os
+import sys
+
+from .bms_reader import MethodFile, Record, property_list
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "biof_tools", "bms",
+)
+
+
+def _plain(value):
+    """A property value as plain data; object values become dicts of their properties."""
+    if not isinstance(value, Record):
+        return value
+    if not value.is_object:
+        return value.value
+    if value.class_name == "scripting::CPropertyList":
+        return {name: _plain(item) for name, item in property_list(value).items()}
+    plain = {}
+    for member in value.members:
+        item = _plain(member)
+        # Wrappers (``data``), base classes (``unnamed1``) and property lists merge into the object.
+        if member.key in ("data", "unnamed1", "properties") and isinstance(item, dict):
+            plain.update(item)
+        else:
+            plain[member.key] = item
+    return plain
+
+
+def _step(command):
+    return {
+        "kind": command.kind,
+        "title": command.title,
+        "enabled": command.enabled,
+        "properties": {name: _plain(value) for name, value in command.properties.items()},
+        "steps": [_step(sub) for sub in command.subcommands],
+    }
+
+
+def parse_tree(path):
+    """Plain-data command tree of the method at ``path``."""
+    with MethodFile(path) as method:
+        tree = _step(method.root_command)
+        tree["method_properties"] = {name: _plain(value) for name, value in method.properties.items()}
+    return tree
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TreeCache:
+    """On-disk cache of parsed method trees, keyed by file content, with LRU eviction.
+
+    An entry's modification time is its last use, so eviction needs no index
+    file and concurrent readers cannot corrupt one.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_entries=256):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _entry(self, digest):
+        return os.path.join(self.directory, f"{digest}.v{CACHE_VERSION}.json")
+
+    def get(self, path):
+        """The tree of ``path``, parsed only if no entry has its content hash."""
+        entry = self._entry(file_digest(path))
+        try:
+            with open(entry, encoding="utf-8") as handle:
+                tree = json.load(handle)
+        except (OSError, ValueError):
+            pass
+        else:
+            self.hits += 1
+            os.utime(entry)
+            return tree
+        self.misses += 1
+        tree = parse_tree(path)
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name first, so a reader never sees half an entry.
+        partial = f"{entry}.{os.getpid()}.tmp"
+        with open(partial, "w", encoding="utf-8") as handle:
+            json.dump(tree, handle, separators=(",", ":"))
+        os.replace(partial, entry)
+        self.evict()
+        return tree
+
+    def entries(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.endswith(".json")]
+
+    def evict(self):
+        """Remove the least recently used entries beyond ``max_entries``."""
+        entries = []
+        for entry in self.entries():
+            try:
+                entries.append((os.stat(entry).st_mtime, entry))
+            except FileNotFoundError:
+                pass
+        entries.sort(reverse=True)
+        for _, entry in entries[self.max_entries:]:
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for entry in self.entries():
+            os.remove(entry)
+
+
+def load_tree(path, cache=None):
+    return cache.get(path) if cache is not None else parse_tree(path)
+
+
+# Diff
+
+
+@dataclass
+class StepDiff:
+    change: str  # "added", "removed" or "changed"
+    path: tuple  # run-order path in the new version (the old one for removed steps)
+    old_path: tuple
+    kind: str
+    title: str = None
+    steps: int = 0  # size of an added or removed subtree
+    values: list = field(default_factory=list)  # (property, old, new)
+
+    def __str__(self):
+        sign = {"added": "+", "removed": "-", "changed": "~"}[self.change]
+        where = _format_path(self.path)
+        if self.change == "changed" and self.old_path != self.path:
+            where += f" (was {_format_path(self.old_path)})"
+        title = f" {self.title!r}" if self.title else ""
+        line = f"{sign} {where} {self.kind}{title}"
+        if self.steps:
+            line += f" with {self.steps} sub-step{'s' if self.steps != 1 else ''}"
+        return "\n".join([line] + [f"    {name}: {old!r} -> {new!r}" for name, old, new in self.values])
+
+
+def _format_path(path):
+    return ".".join(str(number) for number in path) or "method"
+
+
+def flatten(properties, prefix=""):
+    """``{"a": {"b": 1}}`` -> ``{"a.b": 1}``."""
+    flat = {}
+    for name, value in properties.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name}."))
+        else:
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def _size(step):
+    return sum(1 + _size(sub) for sub in step["steps"])
+
+
+def _signature(step):
+    return step["kind"], step["title"]
+
+
+def _compare(old, new, old_path, new_path, out):
+    values = []
+    if old["enabled"] != new["enabled"]:
+        values.append(("enabled", old["enabled"], new["enabled"]))
+    before, after = flatten(old["properties"]), flatten(new["properties"])
+    for name in sorted(before.keys() | after.keys()):
+        if before.get(name) != after.get(name):
+            values.append((name, before.get(name), after.get(name)))
+    if values:
+        out.append(StepDiff("changed", new_path, old_path, new["kind"], new["title"], values=values))
+    _diff_steps(old["steps"], new["steps"], old_path, new_path, out)
+
+
+def _diff_steps(old_steps, new_steps, old_path, new_path, out):
+    matcher = SequenceMatcher(None, [_signature(step) for step in old_steps],
+                              [_signature(step) for step in new_steps], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        pairs = []
+        if tag == "equal":
+            pairs = list(zip(range(i1, i2), range(j1, j2)))
+        elif tag == "replace":
+            # A step whose title changed is still the same kind of step: pair those in order.
+            olds = list(range(i1, i2))
+            for j in range(j1, j2):
+                i = next((i for i in olds if old_steps[i]["kind"] == new_steps[j]["kind"]), None)
+                if i is not None:
+                    olds.remove(i)
+                    pairs.append((i, j))
+        paired_old = {i for i, _ in pairs}
+        paired_new = {j for _, j in pairs}
+        for i in range(i1, i2):
+            if i not in paired_old:
+                step = old_steps[i]
+                path = old_path + (i + 1,)
+                out.append(StepDiff("removed", path, path, step["kind"], step["title"], _size(step)))
+        for i, j in pairs:
+            _compare(old_steps[i], new_steps[j], old_path + (i + 1,), new_path + (j + 1,), out)
+        for j in range(j1, j2):
+            if j not in paired_new:
+                step = new_steps[j]
+                path = new_path + (j + 1,)
+                out.append(StepDiff("added", path, path, step["kind"], step["title"], _size(step)))
+
+
+def diff(old_tree, new_tree):
+    """``StepDiff`` list between two trees from ``load_tree``, in new-version order."""
+    out = []
+    _compare(old_tree, new_tree, (), (), out)
+    method_values = []
+    before = flatten(old_tree.get("method_properties", {}))
+    after = flatten(new_tree.get("method_properties", {}))
+    for name in sorted(before.keys() | after.keys()):
+        if before.get(name) != after.get(name):
+            method_values.append((name, before.get(name), after.get(name)))
+    if method_values:
+        root = next((entry for entry in out if entry.path == ()), None)
+        if root is None:
+            root = StepDiff("changed", (), (), new_tree["kind"], new_tree["title"])
+            out.insert(0, root)
+        root.values.extend(method_values)
+    return out
+
+
+def main(argv=None):
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Diff CyBio Felix .bms method versions.")
+    parser.add_argument("paths", nargs="+", help="two or more versions, oldest first; "
+                        "each is compared with the one before it")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--max-entries", type=int, default=256, help="cache size in parsed methods")
+    parser.add_argument("--clear-cache", action="store_true")
+    parser.add_argument("--summary", action="store_true", help="only count the differences")
+    args = parser.parse_args(argv)
+    if len(args.paths) < 2:
+        parser.error("need at least two method files")
+
+    cache = None if args.no_cache else TreeCache(args.cache_dir, args.max_entries)
+    if cache is not None and args.clear_cache:
+        cache.clear()
+    started = time.perf_counter()
+    status = 0
+    try:
+        trees = [load_tree(path, cache) for path in args.paths]
+    except (OSError, ValueError) as exc:
+        # MethodFormatError is a ValueError.
+        print(f"error: {exc}", file=sys.stderr)
+        sys.exit(2)
+    for (old_path, old_tree), (new_path, new_tree) in zip(
+            zip(args.paths, trees), zip(args.paths[1:], trees[1:])):
+        entries = diff(old_tree, new_tree)
+        print(f"--- {old_path}\n+++ {new_path}")
+        if entries:
+            status = 1
+        if args.summary:
+            counts = {change: sum(entry.change == change for entry in entries)
+                      for change in ("added", "removed", "changed")}
+            print(", ".join(f"{count} {change}" for change, count in counts.items()))
+        else:
+            for entry in entries:
+                print(entry)
+    if cache is not None:
+        print(f"# {len(args.paths)} methods in {time.perf_counter() - started:.2f} s, "
+              f"{cache.hits} from cache", file=sys.stderr)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""Set user variables of CyBio Felix ``.bms`` methods without the editor.
+
+Variables are declared by ``scripting:cmd:variable:definition`` steps, one
+``scripting::CVariableDescriptor`` per variable with its ``variable_name``,
+``variable_value``, ``variable_type`` and control (``min``/``max`` or a
+list of allowed keys). ``variables`` finds them through
+``biof_tools.bms_reader``. ``write_patched`` writes a copy of the method in
+which only the value records change: each new value replaces the old
+UTF-16LE string and its u32 length, and every other byte is written
+straight from the memory map. Nothing in the format stores offsets, so a
+value may change length.
+
+Names match case-insensitively, as ``$(...)`` references do. A name that
+is declared in more than one step is qualified with the step path, e.g.
+``24.2.1.1:aspirate_volume``.
+
+``batch`` writes one method per row of a CSV whose columns are variable
+names (plus an optional ``output`` file name), from a single scan of the
+source. The ``.bms.isf`` sidecar is copied alongside, since patching
+leaves the step outline unchanged. Each method is written under a
+temporary name and renamed into place after the source is closed, so
+``-o`` may name the source to patch it in place.
+
+    python -m biof_tools.bms_patch "Shaking_Plates/Shaking Method.bms" --list
+    python -m biof_tools.bms_patch "Shaking_Plates/Shaking Method.bms" \\
+        -s Shake_Time=120 -s Shake_Speed=1200 -o shake_2min.bms
+    python -m biof_tools.bms_patch "Shaking_Plates/Shaking Method.bms" --csv runs.csv -d runs/
+"""
+
+from dataclasses import dataclass
+import csv
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+
+from .bms_reader import MethodFile, Record, property_records
+
+DEFINITION = "scripting:cmd:variable:definition"
+NUMERIC_TYPES = {"2": "long", "3": "double"}
+_U32 = struct.Struct("<I")
+# The editor leaves an unnamed ``variable``/``variable<n>`` placeholder in every definition step.
+_PLACEHOLDER = re.compile(r"variable\d*")
+
+
+class VariableError(ValueError):
+    """Raised for unknown or ambiguous variables and values a variable does not accept."""
+
+
+@dataclass(frozen=True)
+class Variable:
+    name: str
+    value: str
+    type: str
+    control: str
+    step: tuple  # run-order path of the declaring step
+    start: int  # byte offset of the value's u32 length field
+    end: int  # byte offset just past the value
+    minimum: str = ""
+    maximum: str = ""
+    choices: tuple = ()
+    title: str = ""
+
+    @property
+    def qualified_name(self):
+        return f"{'.'.join(map(str, self.step))}:{self.name}"
+
+
+def _descriptor_properties(adapter):
+    """The property records of a variable's ``CContainerProperty``."""
+    record = adapter
+    while record is not None and record.is_object:
+        properties = record.member("properties")
+        if properties is not None:
+            return property_records(properties)
+        record = record.member("data") or record.member("unnamed1")
+    return {}
+
+
+def _definitions(command, path=()):
+    for sub in command.subcommands:
+        step = path + (sub.number,)
+        if sub.kind == DEFINITION:
+            yield step, sub
+        yield from _definitions(sub, step)
+
+
+def variables(method):
+    """Every variable declared in an open ``MethodFile``, in run order."""
+    found = []
+    for step, command in _definitions(method.root_command):
+        for adapter in command.properties.values():
+            if not isinstance(adapter, Record):
+                continue  # ``variable`` holds the count
+            properties = _descriptor_properties(adapter)
+            name = properties.get("variable_name")
+            value = properties.get("variable_value")
+            if name is None or value is None or _PLACEHOLDER.fullmatch(name.value):
+                continue
+            control = properties.get("variable_control")
+            limits = _descriptor_properties(control) if control is not None and control.is_object else {}
+            entries = limits.get("entries")
+            choices = tuple(
+                limits[f"key_{number}"].value
+                for number in range(1, int(entries.value) + 1 if entries is not None else 1)
+                if f"key_{number}" in limits
+            )
+            start, end = method.value_span(value.index)
+            text = {field: record.value for field, record in properties.items()
+                    if not record.is_object}
+            found.append(Variable(
+                name=name.value,
+                value=value.value,
+                type=text.get("variable_type", ""),
+                control=text.get("variable_control_type", ""),
+                step=step,
+                start=start - 4,
+                end=end,
+                minimum=limits["min"].value if "min" in limits else "",
+                maximum=limits["max"].value if "max" in limits else "",
+                choices=choices,
+                title=text.get("variable_title", ""),
+            ))
+    return found
+
+
+def resolve(declared, name):
+    """The variable called ``name`` (or ``path:name``) among ``declared``."""
+    step, _, bare = name.rpartition(":")
+    matches = [variable for variable in declared if variable.name.lower() == bare.lower()
+               and (not step or ".".join(map(str, variable.step)) == step)]
+    if not matches:
+        raise VariableError(f"No variable {name!r}")
+    if len(matches) > 1:
+        raise VariableError(f"Variable {name!r} is declared in several steps; use one of "
+                            + ", ".join(variable.qualified_name for variable in matches))
+    return matches[0]
+
+
+def validate(variable, value):
+    """Check ``value`` against the variable's type and control limits."""
+    if variable.choices and value not in variable.choices:
+        raise VariableError(f"{variable.name} must be one of {', '.join(variable.choices)}, not {value!r}")
+    if variable.type not in NUMERIC_TYPES or "$(" in value:
+        return
+    try:
+        number = float(value)
+    except ValueError:
+        raise VariableError(
+            f"{variable.name} is a {NUMERIC_TYPES[variable.type]} variable, not {value!r}"
+        ) from None
+    if variable.minimum and number < float(variable.minimum):
+        raise VariableError(f"{variable.name} = {value} is below its minimum {variable.minimum}")
+    if variable.maximum and number > float(variable.maximum):
+        raise VariableError(f"{variable.name} = {value} is above its maximum {variable.maximum}")
+
+
+def changes(declared, values):
+    """``{Variable: new value}`` for ``{name: value}``, validated."""
+    resolved = {}
+    for name, value in values.items():
+        variable = resolve(declared, name)
+        value = str(value)
+        validate(variable, value)
+        resolved[variable] = value
+    return resolved
+
+
+def write_patched(method, patches, handle):
+    """Write ``method`` to the binary ``handle`` with ``patches`` (``{Variable: value}``) applied."""
+    pos = 0
+    for variable, value in sorted(patches.items(), key=lambda item: item[0].start):
+        with method.raw(pos, variable.start) as chunk:
+            handle.write(chunk)
+        encoded = value.encode("utf-16-le")
+        handle.write(_U32.pack(len(encoded) // 2))
+        handle.write(encoded)
+        pos = variable.end
+    with method.raw(pos) as chunk:
+        handle.write(chunk)
+
+
+def _write(method, patches, out_path):
+    """Write the patched method under a temporary name next to ``out_path`` and return that name.
+
+    ``_finish`` renames it into place once the source is closed, so
+    ``out_path`` may be the source itself.
+    """
+    descriptor, partial = tempfile.mkstemp(
+        suffix=".tmp", prefix=os.path.basename(out_path) + ".", dir=os.path.dirname(out_path) or "."
+    )
+    try:
+        with os.fdopen(descriptor, "wb") as handle:
+            write_patched(method, patches, handle)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return partial
+
+
+def _finish(path, partial, out_path):
+    shutil.copymode(path, partial)
+    os.replace(partial, out_path)
+    sidecar, out_sidecar = path + ".isf", out_path + ".isf"
+    if os.path.exists(sidecar) and not (os.path.exists(out_sidecar) and os.path.samefile(sidecar, out_sidecar)):
+        shutil.copyfile(sidecar, out_sidecar)
+
+
+def patch_file(path, values, out_path):
+    """Write a copy of the method at ``path`` with variables set from ``{name: value}``.
+
+    ``out_path`` may be ``path`` to patch the method in place.
+    """
+    with MethodFile(path) as method:
+        partial = _write(method, changes(variables(method), values), out_path)
+    _finish(path, partial, out_path)
+
+
+def batch(path, rows, output_dir, name_column="output"):
+    """Write one patched method per row (``{name: value}`` dicts) into ``output_dir``.
+
+    Empty cells keep the method's value. A row's output name must be a
+    plain file name, unique in the batch. Returns the paths written.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    written = []
+    os.makedirs(output_dir, exist_ok=True)
+    pending = []
+    names = {}
+    try:
+        with MethodFile(path) as method:
+            declared = variables(method)
+            for number, row in enumerate(rows, 1):
+                values = {name: value for name, value in row.items()
+                          if name != name_column and value not in (None, "")}
+                try:
+                    patches = changes(declared, values)
+                except VariableError as exc:
+                    raise VariableError(f"row {number}: {exc}") from None
+                name = row.get(name_column) or f"{stem}_{number:03d}.bms"
+                if os.path.basename(name) != name or name in (".", ".."):
+                    raise ValueError(f"row {number}: output {name!r} is not a plain file name")
+                if os.path.normcase(name) in names:
+                    raise ValueError(f"row {number}: output {name!r} is already written by "
+                                     f"row {names[os.path.normcase(name)]}")
+                names[os.path.normcase(name)] = number
+                out_path = os.path.join(output_dir, name)
+                pending.append((_write(method, patches, out_path), out_path))
+        # Renamed only after the source is closed: a row may name the source itself.
+        while pending:
+            partial, out_path = pending.pop(0)
+            _finish(path, partial, out_path)
+            written.append(out_path)
+    finally:
+        for partial, _ in pending:
+            if os.path.exists(partial):
+                os.remove(partial)
+    return written
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Set user variables of CyBio Felix .bms methods.")
+    parser.add_argument("path")
+    parser.add_argument("--list", action="store_true", help="list the method's variables")
+    parser.add_argument("-s", "--set", action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("-o", "--output", help="patched method for --set")
+    parser.add_argument("--csv", help="one run per row: variable columns and an optional 'output' column")
+    parser.add_argument("-d", "--output-dir", default=".", help="directory for --csv methods")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.list:
+            with MethodFile(args.path) as method:
+                print("step,name,value,type,control,min,max,choices,title")
+                writer = csv.writer(sys.stdout, lineterminator="\n")
+                for variable in variables(method):
+                    writer.writerow([".".join(map(str, variable.step)), variable.name, variable.value,
+                                     NUMERIC_TYPES.get(variable.type, variable.type), variable.control,
+                                     variable.minimum, variable.maximum, " ".join(variable.choices),
+                                     variable.title])
+        if args.set:
+            if not args.output:
+                parser.error("--set needs -o/--output")
+            values = dict(item.split("=", 1) for item in args.set if "=" in item)
+            if len(values) != len(args.set):
+                parser.error("--set takes NAME=VALUE")
+            patch_file(args.path, values, args.output)
+            print(f"{args.output}: {len(values)} variable(s) set")
+        if args.csv:
+            with open(args.csv, newline="", encoding="utf-8-sig") as handle:
+                written = batch(args.path, csv.DictReader(handle), args.output_dir)
+            print(f"{len(written)} methods written to {args.output_dir}")
+    except (OSError, ValueError) as exc:
+        # VariableError and MethodFormatError are ValueErrors.
+        print(f"{args.path}: error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
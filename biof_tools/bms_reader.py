@@ -0,0 +1,491 @@
+"""Memory-mapped, lazily decoded reader for CyBio Felix ``.bms`` method files.
+
+A ``.bms`` file is a serialised ``scripting::CMethod`` object graph: a
+NUL-terminated GUID header followed by one record per tree node::
+
+    u32 key length, ASCII key, u32 value length, UTF-16LE value, u32 child count
+
+Records are written breadth-first, so the children of record ``i`` are the
+``count[i]`` records starting at ``1 + sum(count[:i])``. ``MethodFile`` scans
+the file once for the record offsets and keeps that prefix sum as the child
+index (two ``array``s, no decoded strings). Keys and values are decoded from
+the memory map only when a node is looked at.
+
+Objects are records whose value is ``"class <name>"``; their members hang off
+an ``objid`` child and a base-class part is a member called ``unnamed1``. A
+command is a ``scripting::CCmdProxy`` whose ``command_data`` holds the
+concrete command (``CCmdShake``, ``CPlugin2Command`` subclasses, ...); at the
+end of its ``unnamed1`` chain is the ``scripting::CCmd`` with the
+``subordinates`` (a ``scripting::CCmdList``) and the ``properties``. The
+method root (``root_command``) is such a command too, but ``walk`` starts
+below it, so ``--classes`` counts one ``scripting::CCmd`` more than the
+commands listed: 492 against 491 for the V14 AMPure method.
+
+    with MethodFile(path) as method:
+        for depth, command in method.walk():
+            print(depth, command.command_type, command.labware, command.volume)
+
+    python -m biof_tools.bms_reader "CyBio Felix protocols/*.bms"
+"""
+
+from array import array
+from bisect import bisect_right
+from collections import Counter
+import mmap
+import struct
+import sys
+
+_U32 = struct.Struct("<I")
+_CLASS = "class ".encode("utf-16-le")
+_CMD = "scripting::CCmd"
+
+
+class MethodFormatError(ValueError):
+    """Raised when a file is not a well-formed ``.bms`` method."""
+
+
+class Record:
+    """One node of the method tree; its key and value are decoded on access."""
+
+    __slots__ = ("method", "index")
+
+    def __init__(self, method, index):
+        self.method = method
+        self.index = index
+
+    def __repr__(self):
+        return f"<Record {self.index} {self.key}={self.value!r}>"
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and (self.method, self.index) == (other.method, other.index)
+
+    def __hash__(self):
+        return hash((id(self.method), self.index))
+
+    @property
+    def key(self):
+        return self.method.key(self.index)
+
+    @property
+    def value(self):
+        return self.method.value(self.index)
+
+    @property
+    def child_count(self):
+        return self.method.child_counts[self.index]
+
+    @property
+    def children(self):
+        first = self.method.first_child[self.index]
+        return [Record(self.method, index) for index in range(first, first + self.child_count)]
+
+    def child(self, key, default=None):
+        for record in self.children:
+            if record.key == key:
+                return record
+        return default
+
+    @property
+    def parent(self):
+        return self.method.parent(self.index)
+
+    @property
+    def is_object(self):
+        return self.method.is_object(self.index)
+
+    @property
+    def class_name(self):
+        return self.value[len("class "):] if self.is_object else None
+
+    @property
+    def members(self):
+        """The members of an object (the children of its ``objid`` record)."""
+        objid = self.child("objid")
+        return objid.children if objid is not None else []
+
+    def member(self, key, default=None):
+        for record in self.members:
+            if record.key == key:
+                return record
+        return default
+
+
+def _numbered(records, prefix):
+    """Records called ``<prefix><n>``, in ``n`` order (the files store them last first)."""
+    numbered = []
+    for record in records:
+        key = record.key
+        if key.startswith(prefix) and key[len(prefix):].isdigit():
+            numbered.append((int(key[len(prefix):]), record))
+    return [record for _, record in sorted(numbered, key=lambda item: item[0])]
+
+
+def property_records(record):
+    """``{name: value record}`` of a ``scripting::CPropertyList``."""
+    properties = {}
+    for prop in _numbered(record.members, "property"):
+        impl = prop.child("value")
+        value = impl.member("value1") if impl is not None else None
+        name = prop.child("name")
+        if value is None or name is None:
+            continue
+        properties[name.value] = value
+    return properties
+
+
+def property_list(record):
+    """``{name: value}`` of a ``scripting::CPropertyList``; object values are returned as ``Record``s."""
+    return {name: value if value.is_object else value.value
+            for name, value in property_records(record).items()}
+
+
+class Command:
+    """A command of the method: a ``scripting::CCmdProxy`` and the command object it holds.
+
+    ``number`` is the 1-based position among its siblings, as in the Felix editor.
+    """
+
+    __slots__ = ("number", "proxy", "data", "_cmd", "_properties")
+
+    def __init__(self, data, proxy=None, number=0):
+        self.number = number
+        self.proxy = proxy
+        self.data = data
+        self._cmd = None
+        self._properties = None
+
+    def __repr__(self):
+        return f"<Command {self.number} {self.kind}>"
+
+    def _proxy_field(self, key):
+        record = self.proxy.member(key) if self.proxy is not None else None
+        return record.value if record is not None else None
+
+    @property
+    def command_type(self):
+        return self._proxy_field("command_type")
+
+    @property
+    def processor_name(self):
+        return self._proxy_field("processor_name")
+
+    @property
+    def processor_type(self):
+        return self._proxy_field("processor_type")
+
+    @property
+    def enabled(self):
+        enabled = self._proxy_field("enabled")
+        if enabled is None:
+            record = self.cmd.member("enabled")
+            enabled = record.value if record is not None else "1"
+        return enabled == "1"
+
+    @property
+    def classes(self):
+        """Class names from the concrete command down to ``scripting::CCmd``."""
+        names = []
+        record = self.data
+        while record is not None and record.is_object:
+            names.append(record.class_name)
+            if record.class_name == _CMD:
+                break
+            record = record.member("unnamed1")
+        return names
+
+    @property
+    def kind(self):
+        """``command_type``, or the class name of a command stored without a proxy."""
+        return self.command_type or self.classes[0]
+
+    @property
+    def is_plugin(self):
+        return "CPlugin2Command" in self.classes
+
+    @property
+    def cmd(self):
+        """The ``scripting::CCmd`` part of the command."""
+        if self._cmd is None:
+            record = self.data
+            while record is not None and record.class_name != _CMD:
+                record = record.member("unnamed1")
+            if record is None:
+                raise MethodFormatError(f"{self.data!r} has no {_CMD} part")
+            self._cmd = record
+        return self._cmd
+
+    @property
+    def subordinates(self):
+        """The ``scripting::CCmdList`` of sub-commands."""
+        return self.cmd.member("subordinates")
+
+    @staticmethod
+    def _wrap(record, number):
+        if record.class_name != "scripting::CCmdProxy":
+            # Some containers (``CCmdLiquidTransferBlock``) are stored without a proxy.
+            return Command(record, number=number)
+        command_data = record.member("command_data")
+        data = command_data.child("data") if command_data is not None else None
+        return Command(data if data is not None else record, record, number)
+
+    @property
+    def subcommands(self):
+        subordinates = self.subordinates
+        if subordinates is None:
+            return []
+        return [self._wrap(record, number)
+                for number, record in enumerate(_numbered(subordinates.members, "command"), 1)]
+
+    def subcommand(self, number):
+        """Sub-command ``number`` (1-based), without opening its siblings; ``None`` if absent."""
+        subordinates = self.subordinates
+        record = subordinates.member(f"command{number}") if subordinates is not None else None
+        return self._wrap(record, number) if record is not None else None
+
+    @property
+    def properties(self):
+        if self._properties is None:
+            record = self.cmd.member("properties")
+            self._properties = property_list(record) if record is not None else {}
+        return self._properties
+
+    def get(self, name, default=None):
+        return self.properties.get(name, default)
+
+    @property
+    def title(self):
+        return self.get("title")
+
+    @property
+    def labware(self):
+        return self.get("labware")
+
+    @property
+    def volume(self):
+        return self.get("volume")
+
+    @property
+    def offset_z(self):
+        return self.get("offset_z")
+
+    @property
+    def mount_slot(self):
+        return self.get("mount_slot")
+
+
+class MethodFile:
+    """A ``.bms`` method, read lazily through a memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            self._buf = b""
+        self._view = memoryview(self._buf)
+        self._keys = {}
+        self._offsets = None
+        self._child_counts = None
+        self._first_child = None
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def guid(self):
+        end = self._buf.find(b"\0")
+        if end < 0:
+            raise MethodFormatError("no method header")
+        return self._buf[:end].decode("ascii")
+
+    # Record index
+
+    def _scan(self):
+        buf = self._buf
+        end = len(buf)
+        pos = buf.find(b"\0") + 1
+        if pos <= 0:
+            raise MethodFormatError("no method header")
+        unpack = _U32.unpack_from
+        offsets = array("Q")
+        counts = array("I")
+        try:
+            while pos < end:
+                offsets.append(pos)
+                key_length = unpack(buf, pos)[0]
+                pos += 4 + key_length
+                pos += 4 + 2 * unpack(buf, pos)[0]
+                counts.append(unpack(buf, pos)[0])
+                pos += 4
+        except struct.error:
+            raise MethodFormatError(f"truncated record at byte {offsets[-1]}") from None
+        if pos != end:
+            raise MethodFormatError(f"truncated record at byte {offsets[-1]}")
+        first = array("Q", bytes(8 * len(counts)))
+        total = 1
+        for index, count in enumerate(counts):
+            first[index] = total
+            total += count
+        if total != len(counts):
+            raise MethodFormatError(
+                f"child counts cover {total} records, the file has {len(counts)}"
+            )
+        self._offsets, self._child_counts, self._first_child = offsets, counts, first
+
+    @property
+    def offsets(self):
+        """``array('Q')`` of record start offsets."""
+        if self._offsets is None:
+            self._scan()
+        return self._offsets
+
+    @property
+    def child_counts(self):
+        if self._child_counts is None:
+            self._scan()
+        return self._child_counts
+
+    @property
+    def first_child(self):
+        """``array('Q')`` prefix sum of the child counts: the index of each record's first child."""
+        if self._first_child is None:
+            self._scan()
+        return self._first_child
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def value_span(self, index):
+        """Byte span of a record's UTF-16LE value; its u32 length field is the 4 bytes before it."""
+        pos = self.offsets[index]
+        pos += 4 + _U32.unpack_from(self._buf, pos)[0]
+        return pos + 4, pos + 4 + 2 * _U32.unpack_from(self._buf, pos)[0]
+
+    def raw(self, start=0, end=None):
+        """A zero-copy ``memoryview`` of the file bytes ``start:end``."""
+        return self._view[start:end]
+
+    def key(self, index):
+        pos = self.offsets[index]
+        raw = self._buf[pos + 4:pos + 4 + _U32.unpack_from(self._buf, pos)[0]]
+        # Keys come from a small vocabulary, so each distinct one is decoded once.
+        key = self._keys.get(raw)
+        if key is None:
+            key = self._keys[raw] = raw.decode("ascii")
+        return key
+
+    def value(self, index):
+        start, end = self.value_span(index)
+        return str(self._view[start:end], "utf-16-le")
+
+    def is_object(self, index):
+        start, end = self.value_span(index)
+        return self._view[start:start + len(_CLASS)] == _CLASS
+
+    def record(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(f"Record index {index} out of range")
+        return Record(self, index)
+
+    def parent(self, index):
+        if index == 0:
+            return None
+        return Record(self, bisect_right(self.first_child, index) - 1)
+
+    def class_counts(self):
+        """``Counter`` of the object classes in the file."""
+        return Counter(self.value(index)[len("class "):] for index in range(len(self))
+                       if self.is_object(index))
+
+    # Method tree
+
+    @property
+    def root(self):
+        return Record(self, 0)
+
+    @property
+    def method(self):
+        method = self.root.child("method")
+        if method is None:
+            raise MethodFormatError("no scripting::CMethod record")
+        return method
+
+    @property
+    def properties(self):
+        record = self.method.member("method_properties")
+        return property_list(record) if record is not None else {}
+
+    @property
+    def root_command(self):
+        return Command(self.method.member("method_root"))
+
+    @property
+    def commands(self):
+        return self.root_command.subcommands
+
+    def walk(self, command=None, depth=0):
+        """Yield ``(depth, command)`` for every command below ``command``, in run order."""
+        for sub in (command or self.root_command).subcommands:
+            yield depth, sub
+            yield from self.walk(sub, depth + 1)
+
+
+SUMMARY_PROPERTIES = ("labware", "volume", "offset_z", "mount_slot")
+
+
+def _format_value(value):
+    if isinstance(value, Record):
+        return f"<{value.class_name}>"
+    return value.replace("\r\n", "\n").replace("\n", "\\n")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Outline CyBio Felix .bms method files.")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--properties", action="store_true", help="print every command property")
+    parser.add_argument("--type", help="only commands whose command_type contains this text")
+    parser.add_argument("--classes", action="store_true", help="count the object classes")
+    args = parser.parse_args(argv)
+
+    status = 0
+    for path in args.paths:
+        try:
+            with MethodFile(path) as method:
+                commands = list(method.walk())
+                print(f"{path}: {len(method)} records, {len(commands)} commands")
+                if args.classes:
+                    for name, count in method.class_counts().most_common():
+                        print(f"  {count:6d} {name}")
+                for depth, command in commands:
+                    if args.type and args.type not in command.kind:
+                        continue
+                    indent = "  " * (depth + 1)
+                    title = f" {command.title!r}" if command.title else ""
+                    disabled = "" if command.enabled else " (disabled)"
+                    shown = command.properties if args.properties else {
+                        name: command.get(name) for name in SUMMARY_PROPERTIES
+                        if command.get(name) not in (None, "")
+                    }
+                    details = " ".join(f"{name}={_format_value(value)}" for name, value in shown.items())
+                    print(f"{indent}{command.number} {command.kind}{title}{disabled} {details}".rstrip())
+        except (OSError, MethodFormatError) as exc:
+            print(f"{path}: error: {exc}", file=sys.stderr)
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1053 @@
+"""Deterministic offline stand-in for the Opentrons Flex Python protocol API.
+
+``run_protocol`` executes a protocol's ``run()`` against ``SimProtocolContext``
+instead of the robot stack and returns every command it issued: tip pick-ups
+and drops, aspirates, dispenses, blow-outs, gantry moves between wells,
+pauses, delays and module commands. Each command carries an estimated
+duration from ``TimeModel``, so a run can be costed without a robot or the
+full ``opentrons`` analysis.
+
+Only the parts of the API used by this repository's protocols are modelled,
+and the timings are planning estimates rather than robot measurements. If the
+real ``opentrons`` package is not installed, a small shim providing the names
+protocols import (``protocol_api``, ``types``) is put in place while the
+protocol module is loaded.
+
+    python -m biof_tools.flex_sim --param number_of_samples=96 --commands
+"""
+
+from collections import Counter
+from dataclasses import dataclass, field
+import importlib.util
+import json
+import math
+import os
+import sys
+import types as _types
+
+from .liquid_classes import volume_table
+
+DEFAULT_PROTOCOL = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "Opentrons Flex",
+    "Semi-automated_E.coli_Transformation_thermoblock.py",
+)
+
+OFF_DECK = "offDeck"
+
+
+class OutOfTipsError(RuntimeError):
+    """Raised when a pipette has no tips left in its assigned racks."""
+
+
+# load name -> (rows, columns, row pitch in mm, well volume or tip volume in uL)
+LABWARE = {
+    "opentrons_flex_96_tiprack_50ul": (8, 12, 9.0, 50),
+    "opentrons_flex_96_tiprack_200ul": (8, 12, 9.0, 200),
+    "opentrons_flex_96_tiprack_1000ul": (8, 12, 9.0, 1000),
+    "opentrons_flex_96_filtertiprack_50ul": (8, 12, 9.0, 50),
+    "opentrons_flex_96_filtertiprack_200ul": (8, 12, 9.0, 200),
+    "opentrons_flex_96_filtertiprack_1000ul": (8, 12, 9.0, 1000),
+    "opentrons_96_aluminumblock_generic_pcr_strip_200ul": (8, 12, 9.0, 200),
+    "biorad_96_wellplate_200ul_pcr": (8, 12, 9.0, 200),
+    "nest_96_wellplate_100ul_pcr_full_skirt": (8, 12, 9.0, 100),
+    "nest_96_wellplate_200ul_flat": (8, 12, 9.0, 200),
+    "appliedbiosystemsmicroamp_384_wellplate_40ul": (16, 24, 4.5, 40),
+    "corning_384_wellplate_112ul_flat": (16, 24, 4.5, 112),
+    "nest_12_reservoir_15ml": (1, 12, 9.0, 15000),
+    "nest_12_reservoir_22ml": (1, 12, 9.0, 22000),
+    "nest_1_reservoir_195ml": (1, 1, 9.0, 195000),
+    "corning_6_wellplate_16.8ml_flat": (2, 3, 39.0, 16800),
+}
+
+
+
+def register_definition(definition):
+    """Add a labware definition (Opentrons JSON schema) to ``LABWARE`` and return its load name.
+
+    Custom labware such as the plates embedded in Protocol Designer files can
+    then be loaded into a simulated run.
+    """
+    load_name = definition["parameters"]["loadName"]
+    ordering = definition["ordering"]
+    wells = definition["wells"]
+    column = ordering[0]
+    row_pitch = abs(wells[column[0]]["y"] - wells[column[1]]["y"]) if len(column) > 1 else 9.0
+    volume = max(well["totalLiquidVolume"] for well in wells.values())
+    LABWARE[load_name] = (len(column), len(ordering), row_pitch, volume)
+    return load_name
+
+
+def register_directory(directory):
+    """Register every labware definition among the ``.json`` files of ``directory``.
+
+    Other JSON files, such as Protocol Designer exports, are skipped.
+    Returns the load names registered.
+    """
+    load_names = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf-8") as fh:
+                definition = json.load(fh)
+            if isinstance(definition, dict) and "ordering" in definition and "parameters" in definition:
+                load_names.append(register_definition(definition))
+    return load_names
+
+
+# pipette load name -> (channels, max volume uL)
+PIPETTES = {
+    "flex_1channel_50": (1, 50),
+    "flex_1channel_1000": (1, 1000),
+    "flex_8channel_50": (8, 50),
+    "flex_8channel_1000": (8, 1000),
+    "flex_96channel_1000": (96, 1000),
+}
+
+# Approximate slot centres of the Flex deck (mm). Column 4 is the staging area.
+SLOT_CENTRES = {
+    f"{row}{col}": (64.0 + 164.0 * (col - 1), 43.0 + 107.0 * (3 - "ABCD".index(row)))
+    for row in "ABCD"
+    for col in (1, 2, 3, 4)
+}
+WASTE_CHUTE_SLOT = "D3"
+TRASH_BIN_SLOT = "A3"
+
+
+@dataclass
+class TimeModel:
+    """Planning estimates for command durations, in seconds."""
+
+    pick_up_tip: float = 4.0
+    drop_tip: float = 3.0
+    liquid_overhead: float = 1.5
+    blow_out: float = 1.0
+    move_overhead: float = 0.8
+    gantry_speed: float = 300.0
+    pause: float = 120.0
+    move_labware_manual: float = 60.0
+    temperature_rate: float = 0.1
+    ambient_temperature: float = 22.0
+    default_flow_rate: float = 50.0
+    well_travel: float = 10.0
+
+    def liquid(self, volume, flow_rate):
+        return self.liquid_overhead + volume / (flow_rate or self.default_flow_rate)
+
+    def travel(self, speed):
+        """Seconds to submerge into or retract from a well at ``speed`` mm/s."""
+        return self.well_travel / speed if speed else 0.0
+
+    def move(self, start, end):
+        if start is None or end is None or start == end:
+            return 0.0
+        (x0, y0), (x1, y1) = start, end
+        return self.move_overhead + math.hypot(x1 - x0, y1 - y0) / self.gantry_speed
+
+    def temperature(self, start, target):
+        return abs(target - start) / self.temperature_rate
+
+
+@dataclass
+class SimCommand:
+    """One recorded command. ``wells`` lists the well under every active channel."""
+
+    kind: str
+    seconds: float = 0.0
+    pipette: str = None
+    labware: str = None
+    slot: str = None
+    well: str = None
+    wells: tuple = ()
+    volume: float = 0.0
+    liquid_class: str = None
+    message: str = None
+
+
+@dataclass
+class SimResult:
+    params: dict
+    commands: list = field(default_factory=list)
+    error: Exception = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def seconds(self):
+        return sum(command.seconds for command in self.commands)
+
+    def counts(self):
+        return Counter(command.kind for command in self.commands)
+
+    def tips_used(self):
+        """Return the number of individual tips picked up, per pipette."""
+        tips = Counter()
+        for command in self.commands:
+            if command.kind == "pick_up_tip":
+                tips[command.pipette] += len(command.wells)
+        return tips
+
+    def segments(self):
+        """Robot time of each stretch between operator pauses, in run order."""
+        segments = [0.0]
+        for command in self.commands:
+            if command.kind == "pause":
+                segments.append(0.0)
+            else:
+                segments[-1] += command.seconds
+        return segments
+
+    def wait_seconds(self):
+        """Estimated time spent waiting for the operator."""
+        return sum(
+            command.seconds for command in self.commands if command.kind in ("pause", "move_labware")
+        )
+
+
+_BOOL_STRINGS = {"true": True, "on": True, "yes": True, "1": True,
+                 "false": False, "off": False, "no": False, "0": False}
+
+
+class SimParameterContext:
+    """Records ``add_parameters`` definitions and supplies their values."""
+
+    def __init__(self):
+        self.definitions = {}
+
+    def _add(self, kind, variable_name, default, **details):
+        self.definitions[variable_name] = dict(kind=kind, default=default, **details)
+
+    def add_int(self, variable_name, display_name, default, minimum=None, maximum=None,
+                choices=None, description=None, unit=None):
+        self._add("int", variable_name, default, minimum=minimum, maximum=maximum, choices=choices)
+
+    def add_float(self, variable_name, display_name, default, minimum=None, maximum=None,
+                  choices=None, description=None, unit=None):
+        self._add("float", variable_name, default, minimum=minimum, maximum=maximum, choices=choices)
+
+    def add_str(self, variable_name, display_name, default, choices=None, description=None):
+        self._add("str", variable_name, default, choices=choices)
+
+    def add_bool(self, variable_name, display_name, default, description=None):
+        self._add("bool", variable_name, default, choices=[
+            {"display_name": "On", "value": True}, {"display_name": "Off", "value": False},
+        ])
+
+    def values(self, name):
+        """Return every value a parameter can take."""
+        definition = self.definitions[name]
+        if definition.get("choices"):
+            return [choice["value"] for choice in definition["choices"]]
+        if definition["kind"] == "int":
+            return list(range(definition["minimum"], definition["maximum"] + 1))
+        return [definition["default"]]
+
+    def coerce(self, name, value):
+        """``value`` converted to the parameter's declared type and checked against its limits.
+
+        Strings from the command line are accepted for every type, so
+        ``partial_tip_pickup=false`` is ``False`` rather than a truthy string.
+        """
+        definition = self.definitions[name]
+        kind = definition["kind"]
+        try:
+            if kind == "bool":
+                if isinstance(value, str):
+                    if value.strip().lower() not in _BOOL_STRINGS:
+                        raise ValueError
+                    value = _BOOL_STRINGS[value.strip().lower()]
+                elif value not in (0, 1):
+                    raise ValueError
+                value = bool(value)
+            elif kind == "int":
+                number = float(value)
+                if isinstance(value, bool) or not number.is_integer():
+                    raise ValueError
+                value = int(number)
+            elif kind == "float":
+                if isinstance(value, bool):
+                    raise ValueError
+                value = float(value)
+            else:
+                value = str(value)
+        except ValueError:
+            raise ValueError(f"{name} expects {kind}, not {value!r}") from None
+        choices = definition.get("choices")
+        if choices and value not in [choice["value"] for choice in choices]:
+            raise ValueError(f"{name}={value!r} is not one of "
+                             + ", ".join(repr(choice["value"]) for choice in choices))
+        if definition.get("minimum") is not None and value < definition["minimum"]:
+            raise ValueError(f"{name}={value} is below its minimum {definition['minimum']}")
+        if definition.get("maximum") is not None and value > definition["maximum"]:
+            raise ValueError(f"{name}={value} is above its maximum {definition['maximum']}")
+        return value
+
+    def resolve(self, overrides=None):
+        """Every parameter's value: the defaults, with ``overrides`` coerced and checked."""
+        values = {name: definition["default"] for name, definition in self.definitions.items()}
+        for name, value in (overrides or {}).items():
+            if name not in values:
+                raise KeyError(f"Protocol has no runtime parameter {name!r}")
+            values[name] = self.coerce(name, value)
+        return values
+
+
+class SimLocation:
+    def __init__(self, well, reference="top", z=0.0):
+        self.well = well
+        self.reference = reference
+        self.z = z
+
+    @property
+    def labware(self):
+        return self.well.parent
+
+
+class SimWell:
+    def __init__(self, parent, name, row, column):
+        self.parent = parent
+        self.well_name = name
+        self.row = row
+        self.column = column
+
+    def top(self, z=0.0):
+        return SimLocation(self, "top", z)
+
+    def bottom(self, z=0.0):
+        return SimLocation(self, "bottom", z)
+
+    def center(self):
+        return SimLocation(self, "center")
+
+    @property
+    def max_volume(self):
+        return self.parent.well_volume
+
+    def load_liquid(self, liquid, volume):
+        self.parent.context._record(
+            "load_liquid", labware=self.parent, wells=(self,), volume=volume, message=liquid.name
+        )
+
+    def __repr__(self):
+        return f"{self.well_name} of {self.parent}"
+
+
+class SimLabware:
+    def __init__(self, context, load_name, slot, label=None, namespace="opentrons", version=1):
+        try:
+            rows, columns, row_pitch, volume = LABWARE[load_name]
+        except KeyError:
+            raise ValueError(f"No simulator definition for labware {load_name!r} "
+                             "(register custom labware, e.g. with -L DIR)") from None
+        self.context = context
+        self.load_name = load_name
+        self.uri = f"{namespace}/{load_name}/{version}"
+        self.slot = slot
+        self.label = label or load_name
+        self.row_pitch = row_pitch
+        self.well_volume = volume
+        self.is_tiprack = "tiprack" in load_name
+        self._rows = [
+            [SimWell(self, f"{chr(65 + row)}{col + 1}", row, col) for col in range(columns)]
+            for row in range(rows)
+        ]
+        self._columns = [list(column) for column in zip(*self._rows)]
+        self._by_name = {well.well_name: well for column in self._columns for well in column}
+        self.tips = {name: True for name in self._by_name} if self.is_tiprack else None
+
+    def __repr__(self):
+        return f"{self.label} on {self.slot}"
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def wells(self):
+        return [well for column in self._columns for well in column]
+
+    def wells_by_name(self):
+        return dict(self._by_name)
+
+    def rows(self):
+        return [list(row) for row in self._rows]
+
+    def columns(self):
+        return [list(column) for column in self._columns]
+
+    def load_liquid(self, wells, liquid, volume):
+        for name in wells:
+            self[name].load_liquid(liquid, volume)
+
+    def reset(self):
+        if self.tips is not None:
+            self.tips = dict.fromkeys(self.tips, True)
+
+    def wells_under(self, well, channels, from_front=False):
+        """Return the wells below each channel of a multi-channel head at ``well``.
+
+        ``well`` is under the primary nozzle; the other active nozzles extend
+        towards the front of the plate, or towards the back with ``from_front``
+        (a partial layout whose primary nozzle is H1).
+        """
+        if channels == 1:
+            return (well,)
+        step = max(1, round(9.0 / self.row_pitch))
+        if len(self._rows) == 1:
+            return (well,) * channels
+        rows = (
+            range(well.row - step * (channels - 1), well.row + 1, step)
+            if from_front
+            else range(well.row, well.row + step * channels, step)
+        )
+        return tuple(self._rows[row][well.column] for row in rows if 0 <= row < len(self._rows))
+
+    @property
+    def position(self):
+        return SLOT_CENTRES.get(self.slot)
+
+
+class SimTrash:
+    def __init__(self, kind, slot):
+        self.kind = kind
+        self.slot = slot
+        self.label = kind
+
+    @property
+    def position(self):
+        return SLOT_CENTRES.get(self.slot)
+
+    def __repr__(self):
+        return f"{self.kind} on {self.slot}"
+
+
+class SimTemperatureModule:
+    def __init__(self, context, slot):
+        self.context = context
+        self.slot = slot
+        self.temperature = context.time_model.ambient_temperature
+        self.target = None
+        self.labware = None
+
+    def load_labware(self, name, label=None, namespace="opentrons", version=1):
+        self.labware = self.context._add_labware(name, self.slot, label, namespace, version)
+        return self.labware
+
+    def set_temperature(self, celsius):
+        seconds = self.context.time_model.temperature(self.temperature, celsius)
+        self.temperature = self.target = celsius
+        self.context._record("set_temperature", seconds=seconds, slot=self.slot, volume=celsius)
+
+    def start_set_temperature(self, celsius):
+        self.target = celsius
+        self.context._record("start_set_temperature", slot=self.slot, volume=celsius)
+
+    def await_temperature(self, celsius=None):
+        target = self.target if celsius is None else celsius
+        seconds = self.context.time_model.temperature(self.temperature, target)
+        # Time already spent on other commands since the ramp started counts towards it.
+        seconds = max(0.0, seconds - self.context._seconds_since("start_set_temperature", self.slot))
+        self.temperature = target
+        self.context._record("await_temperature", seconds=seconds, slot=self.slot, volume=target)
+
+    def deactivate(self):
+        self.target = None
+        self.context._record("deactivate", slot=self.slot)
+
+
+class SimLiquid:
+    def __init__(self, name, description=None, display_color=None):
+        self.name = name
+        self.description = description
+        self.display_color = display_color
+
+
+class SimLiquidClass:
+    def __init__(self, name, properties):
+        self.name = name
+        self.properties = properties
+
+    def settings(self, pipette, tiprack_uri):
+        return self.properties.get(pipette, {}).get(tiprack_uri)
+
+
+def _interpolate(table, volume):
+    return volume_table(table)(volume)
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _well(target):
+    return target.well if isinstance(target, SimLocation) else target
+
+
+class SimPipette:
+    def __init__(self, context, name, mount, tip_racks):
+        try:
+            self.channels, self.max_volume = PIPETTES[name]
+        except KeyError:
+            raise ValueError(f"No simulator definition for pipette {name!r}") from None
+        self.context = context
+        self.name = name
+        self.mount = mount
+        self.tip_racks = list(tip_racks or [])
+        self.active_channels = self.channels
+        self.front_primary = False
+        self.has_tip = False
+        self.tip_volume = None
+        self.tip_rack_uri = None
+        self.current_volume = 0.0
+        self.position = None
+        self.trash_container = None
+
+    def __repr__(self):
+        return f"{self.name} on {self.mount} mount"
+
+    # Movement and tips
+
+    def _move(self, target, labware, well=None):
+        position = target.position if target is not None else None
+        seconds = self.context.time_model.move(self.position, position)
+        if well is not None:
+            key = (labware, well.well_name)
+            if self.position == position and getattr(self, "_last_well", None) != key:
+                seconds = self.context.time_model.move_overhead
+            self._last_well = key
+        else:
+            self._last_well = None
+        if seconds:
+            self.context._record(
+                "move", seconds=seconds, pipette=self, labware=labware,
+                wells=(well,) if well is not None else (),
+            )
+        self.position = position
+
+    def _next_tips(self):
+        for rack in self.tip_racks:
+            for column in rack.columns():
+                available = [well for well in column if rack.tips[well.well_name]]
+                count = self.active_channels
+                if count == len(column):
+                    if len(available) == count:
+                        return rack, tuple(available)
+                elif len(available) >= count:
+                    # Partial layouts pick up at the end of the column the inactive nozzles point to,
+                    # so they hang off the rack: the back rows when H1 is the primary nozzle, the
+                    # front rows when A1 is.
+                    return rack, tuple(available[:count] if self.front_primary else available[-count:])
+        raise OutOfTipsError(f"{self} has no tips left in {self.tip_racks}")
+
+    def pick_up_tip(self, location=None):
+        if self.has_tip:
+            raise RuntimeError(f"{self} already has a tip attached")
+        if location is None:
+            rack, tips = self._next_tips()
+        else:
+            well = _well(location)
+            rack = well.parent
+            tips = rack.wells_under(well, self.active_channels, self.front_primary)
+        for tip in tips:
+            rack.tips[tip.well_name] = False
+        self._move(rack, rack, tips[0])
+        self.has_tip = True
+        self.tip_volume = rack.well_volume
+        self.tip_rack_uri = rack.uri
+        self.current_volume = 0.0
+        self.context._record(
+            "pick_up_tip", seconds=self.context.time_model.pick_up_tip, pipette=self,
+            labware=rack, wells=tips,
+        )
+        return self
+
+    def drop_tip(self, location=None):
+        if not self.has_tip:
+            raise RuntimeError(f"{self} has no tip to drop")
+        trash = location if location is not None else self._trash()
+        self._move(trash, trash)
+        self.has_tip = False
+        self.current_volume = 0.0
+        self.context._record(
+            "drop_tip", seconds=self.context.time_model.drop_tip, pipette=self, labware=trash
+        )
+        return self
+
+    def return_tip(self):
+        return self.drop_tip()
+
+    def reset_tipracks(self):
+        for rack in self.tip_racks:
+            rack.reset()
+
+    def configure_nozzle_layout(self, style, start=None, end=None, tip_racks=None):
+        if self.has_tip:
+            raise RuntimeError(f"{self} cannot change its nozzle layout with a tip attached")
+        self.front_primary = style in (SINGLE, PARTIAL_COLUMN) and start[0] != "A"
+        if style in (ALL, None):
+            self.active_channels = self.channels
+        elif style == SINGLE:
+            self.active_channels = 1
+        elif style == PARTIAL_COLUMN:
+            self.active_channels = abs(ord(end[0]) - ord(start[0])) + 1
+        else:
+            raise ValueError(f"Nozzle layout {style!r} is not simulated")
+        if tip_racks is not None:
+            self.tip_racks = list(tip_racks)
+        self.context._record("configure_nozzle_layout", pipette=self, volume=self.active_channels)
+
+    def _trash(self):
+        trash = self.trash_container or self.context.default_trash
+        if trash is None:
+            raise RuntimeError("No trash bin or waste chute has been loaded")
+        return trash
+
+    # Liquid handling primitives
+
+    def _liquid(self, kind, volume, location, flow_rate, liquid_class=None, message=None, travel=0.0):
+        if not self.has_tip:
+            raise RuntimeError(f"{self} cannot {kind} without a tip")
+        well = _well(location)
+        labware = well.parent
+        self._move(labware, labware, well)
+        if kind == "aspirate":
+            if self.current_volume + volume > min(self.max_volume, self.tip_volume) + 1e-9:
+                raise ValueError(
+                    f"{self} cannot aspirate {volume} uL with {self.current_volume} uL already "
+                    f"in a {self.tip_volume} uL tip"
+                )
+            self.current_volume += volume
+        else:
+            self.current_volume = max(0.0, self.current_volume - volume)
+        self.context._record(
+            kind, seconds=self.context.time_model.liquid(volume, flow_rate) + travel, pipette=self,
+            labware=labware, wells=labware.wells_under(well, self.active_channels, self.front_primary),
+            volume=volume, liquid_class=liquid_class, message=message,
+        )
+
+    def aspirate(self, volume=None, location=None, rate=1.0):
+        volume = min(self.max_volume, self.tip_volume) - self.current_volume if volume is None else volume
+        self._liquid("aspirate", volume, location, self.context.time_model.default_flow_rate * rate)
+        return self
+
+    def dispense(self, volume=None, location=None, rate=1.0, push_out=None):
+        volume = self.current_volume if volume is None else volume
+        self._liquid("dispense", volume, location, self.context.time_model.default_flow_rate * rate)
+        return self
+
+    def mix(self, repetitions=1, volume=None, location=None, rate=1.0):
+        for _ in range(repetitions):
+            self._liquid("aspirate", volume, location, self.context.time_model.default_flow_rate * rate,
+                         message="mix")
+            self._liquid("dispense", volume, location, self.context.time_model.default_flow_rate * rate,
+                         message="mix")
+        return self
+
+    def blow_out(self, location=None):
+        target = self._trash() if location is None else _well(location)
+        labware = target.parent if isinstance(target, SimWell) else target
+        self._move(labware, labware, target if isinstance(target, SimWell) else None)
+        self.current_volume = 0.0
+        self.context._record(
+            "blow_out", seconds=self.context.time_model.blow_out, pipette=self, labware=labware,
+            wells=(target,) if isinstance(target, SimWell) else (),
+        )
+        return self
+
+    def air_gap(self, volume=None, height=None):
+        if not self.has_tip:
+            raise RuntimeError(f"{self} cannot air gap without a tip")
+        volume = min(self.max_volume, self.tip_volume) - self.current_volume if volume is None else volume
+        self.current_volume += volume
+        self.context._record(
+            "air_gap", seconds=self.context.time_model.liquid(volume, self.context.time_model.default_flow_rate),
+            pipette=self, volume=volume,
+        )
+        return self
+
+    def move_to(self, location):
+        well = _well(location)
+        self._move(well.parent, well.parent, well)
+        return self
+
+    # Liquid-class transfers
+
+    def _class_settings(self, liquid_class):
+        settings = liquid_class.settings(self.name, self.tip_rack_uri)
+        if settings is None:
+            raise ValueError(
+                f"Liquid class {liquid_class.name!r} has no settings for {self.name} "
+                f"with {self.tip_rack_uri}"
+            )
+        return settings
+
+    def _class_step(self, kind, liquid_class, settings, volume, well):
+        section = settings[kind]
+        flow_rate = _interpolate(section["flow_rate_by_volume"], volume)
+        mix = section.get("mix", {})
+        primitive = "aspirate" if kind == "aspirate" else "dispense"
+        if kind == "aspirate" and mix.get("enabled"):
+            self._mix(liquid_class.name, mix, flow_rate, well)
+        time_model = self.context.time_model
+        travel = (time_model.travel(section.get("submerge", {}).get("speed"))
+                  + time_model.travel(section.get("retract", {}).get("speed")))
+        self._liquid(primitive, volume, well, flow_rate, liquid_class=liquid_class.name, travel=travel)
+        if kind == "dispense" and mix.get("enabled"):
+            self._mix(liquid_class.name, mix, flow_rate, well)
+        retract = section.get("retract", {})
+        blowout = retract.get("blowout", {})
+        if kind != "aspirate" and blowout.get("enabled"):
+            self.blow_out(None if blowout.get("location") == "trash" else well)
+        air_gap = _interpolate(retract.get("air_gap_by_volume", [(0, 0)]), volume)
+        if air_gap:
+            self.air_gap(air_gap)
+
+    def _mix(self, name, mix, flow_rate, well):
+        for _ in range(mix["repetitions"]):
+            self._liquid("aspirate", mix["volume"], well, flow_rate, liquid_class=name, message="mix")
+            self._liquid("dispense", mix["volume"], well, flow_rate, liquid_class=name, message="mix")
+
+    def _start_tip(self, new_tip, first):
+        if new_tip == "never":
+            if not self.has_tip:
+                raise RuntimeError(f"{self} has no tip and new_tip='never'")
+            return
+        if new_tip == "once" and not first:
+            return
+        if self.has_tip:
+            self.drop_tip()
+        self.pick_up_tip()
+
+    def _finish_tip(self, keep_last_tip, trash_location, new_tip):
+        keep = keep_last_tip if keep_last_tip is not None else new_tip == "never"
+        if self.has_tip and not keep:
+            self.drop_tip(trash_location)
+
+    def transfer_with_liquid_class(self, liquid_class, volume, source, dest, new_tip="once",
+                                   trash_location=None, return_tip=False, group_wells=True,
+                                   keep_last_tip=None, tip_racks=None):
+        sources = [_well(well) for well in _as_list(source)]
+        dests = [_well(well) for well in _as_list(dest)]
+        if len(sources) == 1:
+            sources *= len(dests)
+        if len(sources) != len(dests):
+            raise ValueError("Sources and destinations must be the same length")
+        for index, (src, dst) in enumerate(zip(sources, dests)):
+            self._start_tip(new_tip, index == 0)
+            settings = self._class_settings(liquid_class)
+            capacity = min(self.max_volume, self.tip_volume)
+            chunks = max(1, math.ceil(volume / capacity))
+            for _ in range(chunks):
+                part = volume / chunks
+                self._class_step("aspirate", liquid_class, settings, part, src)
+                self._class_step("dispense", liquid_class, settings, part, dst)
+        self._finish_tip(keep_last_tip, trash_location, new_tip)
+
+    def distribute_with_liquid_class(self, liquid_class, volume, source, dest, new_tip="once",
+                                     trash_location=None, return_tip=False, group_wells=True,
+                                     keep_last_tip=None, tip_racks=None):
+        src = _well(_as_list(source)[0])
+        dests = [_well(well) for well in _as_list(dest)]
+        first = True
+        remaining = list(dests)
+        while remaining:
+            self._start_tip(new_tip, first)
+            first = False
+            settings = self._class_settings(liquid_class)
+            multi = settings.get("multi_dispense")
+            disposal = _interpolate(multi["disposal_by_volume"], volume) if multi else 0
+            capacity = min(self.max_volume, self.tip_volume) - disposal
+            batch_size = max(1, int(capacity // volume)) if multi else 1
+            batch, remaining = remaining[:batch_size], remaining[batch_size:]
+            self._class_step("aspirate", liquid_class, settings, volume * len(batch) + disposal, src)
+            for well in batch:
+                self._class_step("multi_dispense" if multi else "dispense", liquid_class,
+                                 settings, volume, well)
+            if disposal:
+                self.blow_out(trash_location)
+        self._finish_tip(keep_last_tip, trash_location, new_tip)
+
+
+class SimProtocolContext:
+    """Records what a protocol asks the robot to do."""
+
+    def __init__(self, params=None, time_model=None):
+        self.params = _types.SimpleNamespace(**(params or {}))
+        self.time_model = time_model or TimeModel()
+        self.commands = []
+        self.labware = []
+        self.pipettes = {}
+        self.default_trash = None
+        self.liquid_classes = {}
+
+    def is_simulating(self):
+        return True
+
+    def _record(self, kind, seconds=0.0, pipette=None, labware=None, slot=None, wells=(),
+                volume=0.0, liquid_class=None, message=None):
+        self.commands.append(SimCommand(
+            kind=kind,
+            seconds=seconds,
+            pipette=pipette.mount if pipette is not None else None,
+            labware=labware.label if labware is not None else None,
+            slot=slot or (labware.slot if labware is not None else None),
+            well=wells[0].well_name if wells else None,
+            wells=tuple(well.well_name for well in wells),
+            volume=volume,
+            liquid_class=liquid_class,
+            message=message,
+        ))
+
+    def _seconds_since(self, kind, slot):
+        elapsed = 0.0
+        for command in reversed(self.commands):
+            if command.kind == kind and command.slot == slot:
+                return elapsed
+            elapsed += command.seconds
+        return 0.0
+
+    def _add_labware(self, load_name, slot, label=None, namespace="opentrons", version=1):
+        labware = SimLabware(self, load_name, slot, label, namespace or "opentrons", version or 1)
+        self.labware.append(labware)
+        self._record("load_labware", labware=labware, message=load_name)
+        return labware
+
+    def load_labware(self, load_name, location, label=None, namespace=None, version=None,
+                     adapter=None, lid=None):
+        return self._add_labware(load_name, location, label, namespace, version)
+
+    def load_module(self, module_name, location=None, configuration=None):
+        if not module_name.startswith("temperatureModule"):
+            raise ValueError(f"No simulator definition for module {module_name!r}")
+        self._record("load_module", slot=location, message=module_name)
+        return SimTemperatureModule(self, location)
+
+    def load_instrument(self, instrument_name, mount, tip_racks=None, replace=False,
+                        liquid_presence_detection=None):
+        pipette = SimPipette(self, instrument_name, mount, tip_racks)
+        self.pipettes[mount] = pipette
+        self._record("load_instrument", pipette=pipette, message=instrument_name)
+        return pipette
+
+    def load_waste_chute(self):
+        trash = SimTrash("waste chute", WASTE_CHUTE_SLOT)
+        self.default_trash = self.default_trash or trash
+        return trash
+
+    def load_trash_bin(self, location=TRASH_BIN_SLOT):
+        trash = SimTrash("trash bin", location)
+        self.default_trash = self.default_trash or trash
+        return trash
+
+    def define_liquid(self, name, description=None, display_color=None):
+        return SimLiquid(name, description, display_color)
+
+    def define_liquid_class(self, name, properties, base_liquid_class=None, display_name=None):
+        liquid_class = SimLiquidClass(name, properties)
+        self.liquid_classes.setdefault(name, []).append(liquid_class)
+        return liquid_class
+
+    def pause(self, msg=None):
+        self._record("pause", seconds=self.time_model.pause, message=msg)
+
+    def delay(self, seconds=0, minutes=0, msg=None):
+        self._record("delay", seconds=seconds + 60 * minutes, message=msg)
+
+    def comment(self, msg):
+        self._record("comment", message=msg)
+
+    def home(self):
+        self._record("home")
+
+    def move_labware(self, labware, new_location, use_gripper=False, **kwargs):
+        seconds = 0.0 if use_gripper else self.time_model.move_labware_manual
+        new_slot = getattr(new_location, "slot", new_location)
+        self._record("move_labware", seconds=seconds, labware=labware, slot=labware.slot,
+                     message=str(new_slot))
+        labware.slot = new_slot
+
+
+ALL = "ALL"
+SINGLE = "SINGLE"
+COLUMN = "COLUMN"
+ROW = "ROW"
+PARTIAL_COLUMN = "PARTIAL_COLUMN"
+
+
+def _opentrons_shim():
+    protocol_api = _types.ModuleType("opentrons.protocol_api")
+    protocol_api.ProtocolContext = SimProtocolContext
+    protocol_api.ParameterContext = SimParameterContext
+    protocol_api.InstrumentContext = SimPipette
+    protocol_api.Labware = SimLabware
+    protocol_api.Well = SimWell
+    protocol_api.OFF_DECK = OFF_DECK
+    for name in ("ALL", "SINGLE", "COLUMN", "ROW", "PARTIAL_COLUMN"):
+        setattr(protocol_api, name, globals()[name])
+    types = _types.ModuleType("opentrons.types")
+    types.Location = SimLocation
+    types.Point = lambda x=0, y=0, z=0: (x, y, z)
+    opentrons = _types.ModuleType("opentrons")
+    opentrons.protocol_api = protocol_api
+    opentrons.types = types
+    return {"opentrons": opentrons, "opentrons.protocol_api": protocol_api, "opentrons.types": types}
+
+
+def load_protocol(path=DEFAULT_PROTOCOL):
+    """Import a protocol file as a module, shimming ``opentrons`` when it is missing."""
+    module_name = "_biof_protocol_" + os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    shim = {}
+    if importlib.util.find_spec("opentrons") is None:
+        shim = {name: mod for name, mod in _opentrons_shim().items() if name not in sys.modules}
+    sys.modules.update(shim)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        for name in shim:
+            sys.modules.pop(name, None)
+    return module
+
+
+def parameter_definitions(protocol):
+    parameters = SimParameterContext()
+    if hasattr(protocol, "add_parameters"):
+        protocol.add_parameters(parameters)
+    return parameters
+
+
+def run_protocol(protocol=DEFAULT_PROTOCOL, params=None, time_model=None):
+    """Run a protocol (module or path) with parameter overrides and return a ``SimResult``.
+
+    Exceptions raised by the protocol, and overrides that do not fit a
+    parameter's type, choices or range, are captured on the result rather
+    than propagated, so callers can tell invalid parameter sets apart.
+    """
+    if isinstance(protocol, str):
+        protocol = load_protocol(protocol)
+    try:
+        values = parameter_definitions(protocol).resolve(params)
+    except (KeyError, ValueError) as exc:
+        return SimResult(params=dict(params or {}), error=exc)
+    context = SimProtocolContext(values, time_model)
+    result = SimResult(params=values, commands=context.commands)
+    try:
+        protocol.run(context)
+    except Exception as exc:
+        result.error = exc
+    return result
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+def parse_params(items):
+    """``{name: value}`` from ``NAME=VALUE`` strings: numbers, ``true``/``false``, else strings.
+
+    ``SimParameterContext.resolve`` converts each value to its parameter's
+    declared type; this only guesses, for callers without the definitions.
+    """
+    params = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        if value.lower() in ("true", "false"):
+            params[name] = value.lower() == "true"
+            continue
+        try:
+            params[name] = int(value)
+        except ValueError:
+            try:
+                params[name] = float(value)
+            except ValueError:
+                params[name] = value
+    return params
+
+
+def report(result):
+    """Return the summary lines printed for one simulated run."""
+    counts = result.counts()
+    lines = [
+        "parameters: " + ", ".join(f"{k}={v}" for k, v in result.params.items()),
+        "commands: " + ", ".join(f"{kind}={count}" for kind, count in sorted(counts.items())),
+        "tips: " + ", ".join(f"{mount}={count}" for mount, count in sorted(result.tips_used().items())),
+        f"estimated run time: {format_duration(result.seconds)} "
+        f"(operator wait {format_duration(result.wait_seconds())})",
+        "between pauses: " + ", ".join(format_duration(seconds) for seconds in result.segments()),
+    ]
+    if result.error is not None:
+        lines.append(f"error: {type(result.error).__name__}: {result.error}")
+    return lines
+
+
+def compare(baseline, variant):
+    """Return lines comparing the run time of two results.
+
+    The stretches between pauses are compared one by one only when both runs
+    pause the same number of times; otherwise they do not correspond.
+    """
+    saved = baseline.seconds - variant.seconds
+    lines = [f"time {'saved' if saved >= 0 else 'added'}: {format_duration(abs(saved))} "
+             f"({100 * abs(saved) / baseline.seconds:.1f}% of {format_duration(baseline.seconds)})"]
+    pauses = (baseline.counts()["pause"], variant.counts()["pause"])
+    if pauses[0] == pauses[1]:
+        for index, (before, after) in enumerate(zip(baseline.segments(), variant.segments())):
+            if before != after:
+                label = f"after pause {index}" if index else "before the first pause"
+                lines.append(f"  {label}: {format_duration(before)} -> {format_duration(after)}")
+    waits = (baseline.wait_seconds(), variant.wait_seconds())
+    if pauses[0] != pauses[1] or waits[0] != waits[1]:
+        change = pauses[0] - pauses[1]
+        lines.append(f"operator pauses: {pauses[0]} -> {pauses[1]} "
+                     f"({abs(change)} {'removed' if change >= 0 else 'added'}), operator wait "
+                     f"{format_duration(waits[0])} -> {format_duration(waits[1])}")
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate a Flex protocol offline.")
+    parser.add_argument("protocol", nargs="?", default=DEFAULT_PROTOCOL)
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("--commands", action="store_true", help="list every command")
+    parser.add_argument("--compare", action="append", default=[], metavar="NAME=VALUE",
+                        help="also run with these overrides and report the time difference")
+    parser.add_argument("-L", "--custom-labware-path", action="append", default=[], metavar="DIR",
+                        help="directory of custom labware definitions (JSON) the protocol loads; "
+                             "the protocol's own directory is always searched")
+    args = parser.parse_args(argv)
+
+    # pd_compiler writes the definitions a compiled protocol loads next to it.
+    for directory in [os.path.dirname(os.path.abspath(args.protocol))] + args.custom_labware_path:
+        try:
+            register_directory(directory)
+        except (OSError, ValueError) as exc:
+            print(f"{directory}: error: {exc}", file=sys.stderr)
+            sys.exit(1)
+
+    protocol = load_protocol(args.protocol)
+    params = parse_params(args.param)
+    result = run_protocol(protocol, params)
+    if args.commands:
+        for index, command in enumerate(result.commands, start=1):
+            where = f"{command.labware} {command.well or ''}".strip() if command.labware else ""
+            volume = f" {command.volume:g}" if command.volume else ""
+            print(f"{index:5d} {command.seconds:7.1f}s {command.kind:<22}{volume:>8} "
+                  f"{command.pipette or '':<6} {where} {command.message or ''}".rstrip())
+    print("\n".join(report(result)))
+    if args.compare and result.ok:
+        variant = run_protocol(protocol, dict(params, **parse_params(args.compare)))
+        print()
+        print("\n".join(report(variant)))
+        if variant.ok:
+            print("\n".join(compare(result, variant)))
+        result = variant
+    if result.error is not None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
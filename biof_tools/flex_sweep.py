@@ -0,0 +1,152 @@
+"""Sweep a Flex protocol's runtime-parameter space through the offline simulator.
+
+Every combination of the swept parameters is run through
+``biof_tools.flex_sim`` in a process pool. The runner reports command counts,
+tip usage and the estimated run time of each combination, and collects the
+combinations the protocol rejects (for example the plate-boundary
+``ValueError``) before an operator finds them on the robot.
+
+    python -m biof_tools.flex_sweep --csv sweep.csv
+    python -m biof_tools.flex_sweep --vary number_of_samples=8:96:8 --vary start_column_96
+"""
+
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import os
+import sys
+
+from . import flex_sim
+
+# One recovery plate's worth of samples; the declared maximum (384) needs more plates, which
+# --vary recovery_plates or --param recovery_plates=N cover.
+DEFAULT_VARY = ("number_of_samples=8:96", "start_well_384", "start_column_96")
+COUNTED_KINDS = ("pick_up_tip", "aspirate", "dispense", "blow_out", "move", "pause")
+
+_protocol = None
+
+
+def _init_worker(path):
+    global _protocol
+    _protocol = flex_sim.load_protocol(path)
+
+
+def _run_one(params):
+    result = flex_sim.run_protocol(_protocol, params)
+    counts = result.counts()
+    row = dict(result.params)
+    row["status"] = "ok" if result.ok else type(result.error).__name__
+    row["error"] = "" if result.ok else str(result.error)
+    for kind in COUNTED_KINDS:
+        row[kind] = counts.get(kind, 0)
+    row["commands"] = len(result.commands)
+    for mount, tips in sorted(result.tips_used().items()):
+        row[f"tips_{mount}"] = tips
+    row["seconds"] = round(result.seconds, 1)
+    return row
+
+
+def parse_vary(items, parameters):
+    """Return ``{name: values}`` from ``NAME`` or ``NAME=start:stop[:step]`` / ``NAME=a,b``."""
+    space = {}
+    for item in items:
+        name, _, spec = item.partition("=")
+        if name not in parameters.definitions:
+            raise SystemExit(f"Protocol has no runtime parameter {name!r}")
+        if not spec:
+            space[name] = parameters.values(name)
+        elif ":" in spec:
+            start, stop, *step = (int(part) for part in spec.split(":"))
+            space[name] = list(range(start, stop + 1, step[0] if step else 1))
+        else:
+            space[name] = [
+                flex_sim.parse_params([f"{name}={value}"])[name] for value in spec.split(",")
+            ]
+    return space
+
+
+def combinations(space, fixed=None):
+    names = list(space)
+    for values in itertools.product(*(space[name] for name in names)):
+        params = dict(fixed or {})
+        params.update(zip(names, values))
+        yield params
+
+
+def sweep(path=flex_sim.DEFAULT_PROTOCOL, space=None, fixed=None, workers=None, chunksize=64):
+    """Simulate every combination in ``space`` and return one row dict per combination.
+
+    Rows come back in the deterministic order of ``itertools.product`` over
+    ``space`` regardless of how the pool schedules the work.
+    """
+    if space is None:
+        parameters = flex_sim.parameter_definitions(flex_sim.load_protocol(path))
+        space = parse_vary(DEFAULT_VARY, parameters)
+    combos = list(combinations(space, fixed))
+    if workers == 1:
+        _init_worker(path)
+        return [_run_one(params) for params in combos]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as pool:
+        return list(pool.map(_run_one, combos, chunksize=chunksize))
+
+
+def summarise(rows, space):
+    lines = []
+    ok = [row for row in rows if row["status"] == "ok"]
+    failed = [row for row in rows if row["status"] != "ok"]
+    lines.append(f"{len(rows)} combinations: {len(ok)} valid, {len(failed)} rejected")
+    if ok:
+        slowest = max(ok, key=lambda row: row["seconds"])
+        fastest = min(ok, key=lambda row: row["seconds"])
+        for label, row in (("fastest", fastest), ("slowest", slowest)):
+            params = ", ".join(f"{name}={row[name]}" for name in space)
+            lines.append(f"{label}: {flex_sim.format_duration(row['seconds'])} ({params}); "
+                         f"tips " + ", ".join(f"{k[5:]}={v}" for k, v in row.items()
+                                              if k.startswith("tips_")))
+    errors = Counter(row["error"].split(" starting from")[0] for row in failed)
+    for message, count in errors.most_common():
+        lines.append(f"  {count:6d} x {message}")
+    if "number_of_samples" in space and failed:
+        # The first rejected sample count for each start position is the usable limit.
+        limits = defaultdict(lambda: None)
+        for row in ok:
+            key = tuple(row[name] for name in space if name != "number_of_samples")
+            limits[key] = max(limits[key] or 0, row["number_of_samples"])
+        tight = sorted(limits.items(), key=lambda item: item[1])[:5]
+        others = [name for name in space if name != "number_of_samples"]
+        for key, limit in tight:
+            lines.append("  max samples {:3d} at {}".format(
+                limit, ", ".join(f"{name}={value}" for name, value in zip(others, key))))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sweep a Flex protocol's parameters offline.")
+    parser.add_argument("protocol", nargs="?", default=flex_sim.DEFAULT_PROTOCOL)
+    parser.add_argument("--vary", action="append", metavar="NAME[=SPEC]",
+                        help="parameter to sweep; defaults to 8-96 samples and every start position")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="fixed parameter value for every combination")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--csv", help="write one row per combination to this file")
+    args = parser.parse_args(argv)
+
+    parameters = flex_sim.parameter_definitions(flex_sim.load_protocol(args.protocol))
+    space = parse_vary(args.vary or DEFAULT_VARY, parameters)
+    rows = sweep(args.protocol, space, flex_sim.parse_params(args.param), args.workers)
+    if args.csv:
+        fields = list(dict.fromkeys(key for row in rows for key in row))
+        with open(args.csv, "w", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    print(summarise(rows, space))
+    if not any(row["status"] == "ok" for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Fastest flow rates and submerge/retract speeds inside each liquid's accuracy limits.
+
+``data/flow_limits.json`` holds, per liquid and pipette, the highest
+aspirate and dispense flow rate (uL/s) at which that liquid still meets its
+accuracy spec. These are ``(volume, rate)`` tables like the liquid-class
+``flow_rate_by_volume`` settings, with the highest submerge and retract speeds
+(mm/s) alongside. Viscous competent cells get lower ceilings than SOC. Each
+liquid lists the classes that move it and ``measured``, the date of the
+gravimetric check its ceilings come from. Update the limits after every
+check; the tool never goes past them. A liquid whose ``measured`` is
+``null`` holds placeholder ceilings, and its tuned settings are flagged as
+not fit to apply.
+
+``tune`` turns the limits into multi-point ``flow_rate_by_volume`` tables
+and speeds for every class of a protocol's embedded ``LIQUID_CLASSES``.
+``--margin`` keeps them a percentage below the ceilings. The protocol is
+then simulated with ``biof_tools.flex_sim`` with its current classes and
+again with the tuned ones. The report gives the seconds saved per class and
+per 96-well recovery plate, and lists every volume the run uses at which a
+current rate already exceeds its ceiling.
+
+Once the ceilings are measured, paste the printed settings (``--json`` for
+the data file) into ``LIQUID_CLASSES`` and ``data/liquid_classes.json``;
+``liquid_classes check`` confirms that the two agree.
+
+    python -m biof_tools.flow_tuning --param number_of_samples=96
+    python -m biof_tools.flow_tuning --margin 10 --json
+"""
+
+import copy
+import json
+import math
+import os
+import sys
+
+from . import flex_sim
+from .liquid_classes import embedded_tables, volume_table
+
+DEFAULT_LIMITS = os.path.join(os.path.dirname(__file__), "data", "flow_limits.json")
+DEFAULT_SECTIONS = ("aspirate", "dispense")
+SAMPLES_PER_PLATE = 96
+
+# liquid-class section -> key of its flow-rate ceiling in the limits file
+LIMIT_KEYS = {"aspirate": "aspirate", "dispense": "dispense", "multi_dispense": "dispense"}
+SPEEDS = ("submerge", "retract")
+
+
+class LimitsError(ValueError):
+    """Raised for a limits file that does not cover a class consistently."""
+
+
+def load_limits(path=DEFAULT_LIMITS):
+    """``{class name: (liquid, {pipette: limits}, measured)}`` from a limits file."""
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    by_class = {}
+    for liquid, spec in data.items():
+        for name in spec.get("classes", ()):
+            if name in by_class:
+                raise LimitsError(f"class {name!r} is listed for both {by_class[name][0]!r} and {liquid!r}")
+            by_class[name] = (liquid, {key: value for key, value in spec.items()
+                                       if key not in ("classes", "measured")}, spec.get("measured"))
+    return by_class
+
+
+def _current(base, spec, path):
+    """The value of a dotted setting path for a class, from its ``set`` or the base."""
+    if path in spec.get("set", {}):
+        return spec["set"][path]
+    value = base
+    for key in path.split("."):
+        value = value[key]
+    return value
+
+
+def _scaled(value, scale):
+    value = round(value * scale, 1)
+    return int(value) if value == int(value) else value
+
+
+def tune(base, classes, limits, margin=0.0):
+    """``{class name: {dotted path: value}}`` with the fastest settings inside the limits.
+
+    Classes without limits for their pipette are left out.
+    """
+    scale = 1 - margin / 100
+    tuned = {}
+    for name, spec in classes.items():
+        liquid = limits.get(name)
+        ceilings = liquid[1].get(spec["pipette"]) if liquid else None
+        if ceilings is None:
+            continue
+        settings = {}
+        for section in spec.get("sections", DEFAULT_SECTIONS):
+            table = ceilings[LIMIT_KEYS[section]]
+            settings[f"{section}.flow_rate_by_volume"] = [
+                (volume, _scaled(rate, scale)) for volume, rate in table
+            ]
+            for motion in SPEEDS:
+                settings[f"{section}.{motion}.speed"] = _scaled(ceilings[f"{motion}_speed"], scale)
+        tuned[name] = settings
+    return tuned
+
+
+def unmeasured_liquids(limits, tuned):
+    """The liquids of ``tuned`` classes whose ceilings have no gravimetric check."""
+    return sorted({limits[name][0] for name in tuned if not limits[name][2]})
+
+
+def apply(classes, tuned):
+    """A copy of ``classes`` with the tuned settings added to each class's ``set``."""
+    classes = copy.deepcopy(classes)
+    for name, settings in tuned.items():
+        classes[name].setdefault("set", {}).update(settings)
+    return classes
+
+
+def overspeed(base, classes, limits, result):
+    """``(class, section, volume, rate, ceiling)`` for every used volume run faster than its ceiling."""
+    used = {}
+    for command in result.commands:
+        if command.liquid_class and command.kind in ("aspirate", "dispense"):
+            used.setdefault((command.liquid_class, command.kind), set()).add(command.volume)
+    found = []
+    for name, spec in classes.items():
+        ceilings = limits[name][1].get(spec["pipette"]) if name in limits else None
+        if ceilings is None:
+            continue
+        for section in spec.get("sections", DEFAULT_SECTIONS):
+            kind = "aspirate" if section == "aspirate" else "dispense"
+            current = volume_table(_current(base, spec, f"{section}.flow_rate_by_volume"))
+            ceiling = volume_table(ceilings[LIMIT_KEYS[section]])
+            for volume in sorted(used.get((name, kind), ())):
+                if current(volume) > ceiling(volume) + 1e-9:
+                    found.append((name, section, volume, current(volume), ceiling(volume)))
+    return found
+
+
+def class_seconds(result):
+    seconds = {}
+    for command in result.commands:
+        if command.liquid_class:
+            seconds[command.liquid_class] = seconds.get(command.liquid_class, 0.0) + command.seconds
+    return seconds
+
+
+def _format(value):
+    if isinstance(value, list):
+        return "[" + ", ".join(f"({volume:g}, {rate:g})" for volume, rate in value) + "]"
+    return f"{value:g}" if isinstance(value, (int, float)) else json.dumps(value)
+
+
+def to_json(tuned):
+    """The tuned settings as JSON, one setting per line like ``data/liquid_classes.json``."""
+    classes = []
+    for name, settings in tuned.items():
+        entries = ",\n".join(f"    {json.dumps(path)}: {json.dumps(value)}" for path, value in settings.items())
+        classes.append(f"  {json.dumps(name)}: {{\n{entries}\n  }}")
+    return "{\n" + ",\n".join(classes) + "\n}"
+
+
+def report(base, classes, limits, tuned, baseline, variant):
+    """Lines with the tuned settings, the time saved and any rates above their ceilings."""
+    lines = []
+    for name, settings in tuned.items():
+        changes = []
+        for path, value in settings.items():
+            current = _current(base, classes[name], path)
+            if isinstance(current, (list, tuple)):
+                current = [tuple(point) for point in current]
+            if current != value:
+                changes.append(f"  {path}: {_format(current)} -> {_format(value)}")
+        measured = f"measured {limits[name][2]}" if limits[name][2] else "ceilings not measured"
+        lines.append(f"{name} ({limits[name][0]}, {classes[name]['pipette']}, {measured}): "
+                     + (f"{len(changes)} setting(s) to change" if changes else "at its limits"))
+        lines.extend(changes)
+    untuned = sorted(set(classes) - set(tuned))
+    if untuned:
+        lines.append("no limits for: " + ", ".join(untuned))
+    samples = baseline.params.get("number_of_samples", SAMPLES_PER_PLATE)
+    plates = max(1, math.ceil(samples / SAMPLES_PER_PLATE))
+    before, after = class_seconds(baseline), class_seconds(variant)
+    for name in tuned:
+        saved = before.get(name, 0.0) - after.get(name, 0.0)
+        if saved:
+            lines.append(f"{name}: {abs(saved):.1f} s {'saved' if saved > 0 else 'added'} per run, "
+                         f"{abs(saved) / plates:.1f} s per plate")
+    saved = baseline.seconds - variant.seconds
+    lines.append(f"{samples} samples ({plates} plate(s)): {abs(saved):.0f} s "
+                 f"{'saved' if saved >= 0 else 'added'} per run, {abs(saved) / plates:.0f} s per plate "
+                 f"({flex_sim.format_duration(baseline.seconds)} -> {flex_sim.format_duration(variant.seconds)})")
+    for name, section, volume, rate, ceiling in overspeed(base, classes, limits, baseline):
+        lines.append(f"over the limit now: {name} {section} {volume:g} uL at {rate:g} uL/s "
+                     f"(ceiling {ceiling:g})")
+    unmeasured = unmeasured_liquids(limits, tuned)
+    if unmeasured:
+        lines.append("not fit to apply: the ceilings for " + ", ".join(unmeasured)
+                     + " are placeholders until measured gravimetrically")
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tune liquid-class flow rates within accuracy limits.")
+    parser.add_argument("protocol", nargs="?", default=flex_sim.DEFAULT_PROTOCOL)
+    parser.add_argument("--limits", default=DEFAULT_LIMITS, help="per-liquid limits file")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="runtime parameter for the simulated run (default 96 samples)")
+    parser.add_argument("--margin", type=float, default=0.0, metavar="PCT",
+                        help="stay this many percent below the ceilings")
+    parser.add_argument("--json", action="store_true",
+                        help="print the tuned settings as JSON for the liquid-class data file")
+    args = parser.parse_args(argv)
+
+    try:
+        limits = load_limits(args.limits)
+        base, classes = embedded_tables(args.protocol)
+        tuned = tune(base, classes, limits, args.margin)
+    except (OSError, ValueError, KeyError) as exc:
+        print(f"{args.protocol}: error: {exc}", file=sys.stderr)
+        sys.exit(1)
+    if args.json:
+        print(to_json(tuned))
+        unmeasured = unmeasured_liquids(limits, tuned)
+        if unmeasured:
+            print(f"{args.limits}: warning: no measured ceilings for {', '.join(unmeasured)}",
+                  file=sys.stderr)
+        return
+
+    params = dict({"number_of_samples": SAMPLES_PER_PLATE}, **flex_sim.parse_params(args.param))
+    module = flex_sim.load_protocol(args.protocol)
+    baseline = flex_sim.run_protocol(module, params)
+    module.LIQUID_CLASSES = apply(classes, tuned)
+    variant = flex_sim.run_protocol(module, params)
+    for result in (baseline, variant):
+        if result.error is not None:
+            print(f"{args.protocol}: error: {type(result.error).__name__}: {result.error}", file=sys.stderr)
+            sys.exit(1)
+    print("\n".join(report(base, classes, limits, tuned, baseline, variant)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Step index of CyBio Felix methods from their ``.bms.isf`` sidecars.
+
+The Felix editor writes a ``<method>.bms.isf`` next to each method: one
+``depth flags`` pair per command, the method itself first at depth 0, in
+pre-order. Siblings are listed the way the ``.bms`` stores them, last step
+first. Flag 8 marks the nodes the editor shows expanded (the method root
+always has it).
+
+``StepIndex`` keeps the outline as arrays with each node's parent and
+subtree end, so a step path such as ``9.3.2`` (run-order numbers, as in the
+editor) is found by skipping over whole subtrees. The outline, step paths
+and step counts come from the sidecar alone; ``from_method`` regenerates a
+missing or stale sidecar.
+
+The sidecar cannot address the ``.bms`` itself: it numbers commands in
+pre-order, while the ``.bms`` stores every record of its object graph
+breadth-first, commands among them. ``locate`` therefore still needs
+``bms_reader``'s scan of every record's offset, which reads the length
+fields of the whole file. It then decodes only the records along the path.
+
+    python -m biof_tools.isf_index "CyBio Felix protocols/"*.isf
+    python -m biof_tools.isf_index "CyBio Felix protocols/BioF-CYB-0010 AMPure_beads_PCR_cleanup_V14.bms" --step 24.2.1
+    python -m biof_tools.isf_index "CyBio Felix protocols/"*.bms --check --write
+"""
+
+from array import array
+import sys
+
+EXPANDED = 8
+SUFFIX = ".isf"
+
+
+class SidecarFormatError(ValueError):
+    """Raised when a file is not a well-formed ``.isf`` outline."""
+
+
+def sidecar_path(path):
+    """The ``.bms.isf`` sidecar of a ``.bms`` path (or the path itself if it is one)."""
+    return path if path.endswith(SUFFIX) else path + SUFFIX
+
+
+def method_path(path):
+    return path[:-len(SUFFIX)] if path.endswith(SUFFIX) else path
+
+
+def format_path(path):
+    return ".".join(str(number) for number in path) or "method"
+
+
+def parse_path(text):
+    """``"9.3.2"`` -> ``(9, 3, 2)``; ``"method"`` or ``""`` is the method root."""
+    if text in ("", "method"):
+        return ()
+    try:
+        path = tuple(int(part) for part in text.split("."))
+    except ValueError:
+        raise ValueError(f"Invalid step path {text!r}") from None
+    if any(number < 1 for number in path):
+        raise ValueError(f"Invalid step path {text!r}")
+    return path
+
+
+class StepIndex:
+    """The command outline of a method: depths and flags in sidecar order."""
+
+    def __init__(self, depths, flags):
+        if len(depths) != len(flags):
+            raise SidecarFormatError("depths and flags differ in length")
+        if not depths or depths[0] != 0:
+            raise SidecarFormatError("outline does not start with the method at depth 0")
+        self.depths = array("H", depths)
+        self.flags = array("B", flags)
+        n = len(self.depths)
+        self.parents = array("i", [-1]) * n
+        self.ends = array("I", [n]) * n
+        stack = []
+        for index, depth in enumerate(self.depths):
+            if index and not 0 < depth <= len(stack):
+                raise SidecarFormatError(f"entry {index} jumps to depth {depth}")
+            while len(stack) > depth:
+                self.ends[stack.pop()] = index
+            if stack:
+                self.parents[index] = stack[-1]
+            stack.append(index)
+
+    @classmethod
+    def parse(cls, text):
+        tokens = text.split()
+        if len(tokens) % 2:
+            raise SidecarFormatError("odd number of values")
+        try:
+            values = [int(token) for token in tokens]
+        except ValueError as exc:
+            raise SidecarFormatError(str(exc)) from None
+        return cls(values[0::2], values[1::2])
+
+    @classmethod
+    def read(cls, path):
+        with open(sidecar_path(path), encoding="ascii") as handle:
+            return cls.parse(handle.read())
+
+    @classmethod
+    def from_method(cls, method, previous=None):
+        """Outline of an open ``bms_reader.MethodFile``.
+
+        Flags are carried over from ``previous`` for steps that still exist;
+        otherwise only the method root is marked expanded.
+        """
+        depths = array("H")
+        flags = array("B")
+        pending = [(0, (), method.root_command)]
+        while pending:
+            depth, path, command = pending.pop()
+            depths.append(depth)
+            flag = EXPANDED if depth == 0 else 0
+            if previous is not None and depth:
+                index = previous.find(path, default=None)
+                if index is not None:
+                    flag = previous.flags[index]
+            flags.append(flag)
+            # Pushed in run order, so they pop last step first, as the sidecar lists them.
+            pending.extend((depth + 1, path + (sub.number,), sub) for sub in command.subcommands)
+        return cls(depths, flags)
+
+    def dumps(self):
+        return "".join(f"{depth} {flag} " for depth, flag in zip(self.depths, self.flags))
+
+    def write(self, path):
+        with open(sidecar_path(path), "w", encoding="ascii", newline="") as handle:
+            handle.write(self.dumps())
+
+    def __len__(self):
+        return len(self.depths)
+
+    def __eq__(self, other):
+        return (isinstance(other, StepIndex) and self.depths == other.depths
+                and self.flags == other.flags)
+
+    def same_outline(self, other):
+        """True if both describe the same tree, whatever the expanded flags."""
+        return self.depths == other.depths
+
+    # Navigation
+
+    def children(self, index):
+        """Child indexes in run order."""
+        stored = []
+        child = index + 1
+        while child < self.ends[index]:
+            stored.append(child)
+            child = self.ends[child]
+        return stored[::-1]
+
+    def step_count(self, index):
+        """Commands in the subtree of ``index``, not counting ``index`` itself."""
+        return self.ends[index] - index - 1
+
+    def expanded(self, index):
+        return bool(self.flags[index] & EXPANDED)
+
+    def path(self, index):
+        """Run-order step path of ``index``, e.g. ``(9, 3, 2)``."""
+        path = []
+        while self.parents[index] >= 0:
+            parent = self.parents[index]
+            path.append(self.children(parent).index(index) + 1)
+            index = parent
+        return tuple(reversed(path))
+
+    def find(self, path, default=KeyError):
+        """Index of the step at ``path``; subtrees before it are skipped, not walked."""
+        index = 0
+        for number in path:
+            children = self.children(index)
+            if not 1 <= number <= len(children):
+                if default is KeyError:
+                    raise KeyError(f"No step {format_path(path)}")
+                return default
+            index = children[number - 1]
+        return index
+
+    def steps(self, index=0):
+        """Yield ``(path, index)`` for ``index`` and everything below it, in run order."""
+        pending = [(self.path(index), index)]
+        while pending:
+            path, index = pending.pop()
+            yield path, index
+            children = self.children(index)
+            pending.extend((path + (number,), child)
+                           for number, child in reversed(list(enumerate(children, 1))))
+
+
+def locate(method, path):
+    """The ``bms_reader.Command`` at ``path``, decoding only the commands along it.
+
+    The step index does not help here: ``method`` first scans the offsets of
+    all its records, as for any access, and the path is then followed by
+    sub-command number.
+    """
+    command = method.root_command
+    for number in path:
+        command = command.subcommand(number)
+        if command is None:
+            raise KeyError(f"No step {format_path(path)}")
+    return command
+
+
+def check(path, index=None):
+    """Compare a method's sidecar with its ``.bms``: ``(status, regenerated index)``.
+
+    ``status`` is ``"ok"``, ``"missing"`` or ``"stale"``.
+    """
+    from .bms_reader import MethodFile
+
+    try:
+        current = StepIndex.read(path) if index is None else index
+    except FileNotFoundError:
+        current = None
+    except SidecarFormatError:
+        current = False
+    with MethodFile(method_path(path)) as method:
+        fresh = StepIndex.from_method(method, previous=current or None)
+    if current is None:
+        return "missing", fresh
+    if current is False or not current.same_outline(fresh):
+        return "stale", fresh
+    return "ok", current
+
+
+def _steps(count):
+    return f"{count} step" if count == 1 else f"{count} steps"
+
+
+def main(argv=None):
+    import argparse
+
+    from .bms_reader import MethodFile, Record
+
+    parser = argparse.ArgumentParser(description="Outline CyBio Felix methods from their .isf sidecars.")
+    parser.add_argument("paths", nargs="+", help=".bms or .bms.isf files")
+    parser.add_argument("--step", action="append", default=[], metavar="PATH",
+                        help="print step PATH (e.g. 9.3.2) from the .bms with its properties")
+    parser.add_argument("--depth", type=int, default=None, help="outline only this many levels deep")
+    parser.add_argument("--check", action="store_true", help="compare each sidecar with its .bms")
+    parser.add_argument("--write", action="store_true", help="regenerate missing or stale sidecars")
+    args = parser.parse_args(argv)
+
+    status = 0
+    for path in args.paths:
+        try:
+            if args.check or args.write:
+                state, index = check(path)
+                print(f"{sidecar_path(path)}: {state}")
+                if state != "ok":
+                    if args.write:
+                        index.write(path)
+                        print(f"{sidecar_path(path)}: written")
+                    else:
+                        status = 1
+                if not args.step:
+                    continue
+            else:
+                index = StepIndex.read(path)
+            if args.step:
+                with MethodFile(method_path(path)) as method:
+                    for text in args.step:
+                        step = parse_path(text)
+                        count = index.step_count(index.find(step))
+                        command = locate(method, step)
+                        title = f" {command.title!r}" if command.title else ""
+                        print(f"{format_path(step)} {command.kind}{title}: {_steps(count)}")
+                        for name, value in command.properties.items():
+                            shown = f"<{value.class_name}>" if isinstance(value, Record) else value
+                            print(f"  {name} = {shown!r}")
+                continue
+            print(f"{sidecar_path(path)}: {len(index) - 1} commands")
+            for step, position in index.steps():
+                if not step or (args.depth is not None and len(step) > args.depth):
+                    continue
+                count = index.step_count(position)
+                marker = ("-" if index.expanded(position) else "+") if count else " "
+                print(f"{'  ' * (len(step) - 1)}{marker} {format_path(step)}"
+                      + (f" ({_steps(count)})" if count else ""))
+        except KeyError as exc:
+            print(f"{path}: error: {exc.args[0]}", file=sys.stderr)
+            status = 1
+        except (OSError, ValueError) as exc:
+            # SidecarFormatError and MethodFormatError are ValueErrors.
+            print(f"{path}: error: {exc}", file=sys.stderr)
+            status = 1
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
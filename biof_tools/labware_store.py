@@ -0,0 +1,431 @@
+"""Content-addressed store of Opentrons labware definitions, shared by every loader.
+
+Protocol Designer exports embed a full copy of every labware definition
+they use, so the same tip rack or plate appears in file after file. The Flex
+scripts load the same kinds of definitions by namespace and version.
+``LabwareStore`` keeps each distinct definition once, keyed by the SHA-256
+of its canonical JSON (sorted keys, no whitespace); the stored copy keeps
+the key order of the first file it came from.
+
+On disk the store is a directory of packs. A pack is ``<name>.pack``, the
+definitions back to back as compact JSON, memory-mapped when opened, plus
+``<name>.idx.json``, which gives each definition's digest, byte span and
+URI (``namespace/loadName/version``). Each idx file also maps the digest of
+raw embedded bytes, exactly as some file wrote them, to the canonical
+digest, and the digest of a whole ``labwareDefinitions`` object to the
+digests of its members. A definition or a file's set of definitions that
+was seen before in that exact spelling is then found by hashing the bytes
+alone. The bytes are not decoded, or even split into definitions.
+
+Writers never change a pack. New definitions go into a new pack, written
+under a temporary name and renamed into place with its idx file last, so
+processes that load protocols at the same time cannot corrupt the store.
+``compact`` merges the packs into one. A store opened with no directory
+keeps everything in memory and ``flush`` writes nothing; reading a protocol
+uses such a store unless it is given one, so only ``add`` fills the cache.
+
+``get`` decodes a definition once per process. Every caller gets the same
+read-only object, with dicts that refuse changes and lists turned into
+tuples. ``copy.deepcopy`` of it gives an ordinary editable copy.
+
+    python -m biof_tools.labware_store add Hamilton_Robotic_Protocols/*/*.json labware/
+    python -m biof_tools.labware_store list
+    python -m biof_tools.labware_store show opentrons/corning_6_wellplate_16.8ml_flat/2
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+
+STORE_VERSION = 1
+DEFAULT_STORE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "biof_tools", "labware",
+)
+
+
+class LabwareFormatError(ValueError):
+    """Raised for bytes or documents that are not a labware definition."""
+
+
+class ReadOnlyDict(dict):
+    """A ``dict`` that refuses changes; shared definitions are built from these."""
+
+    def _refuse(self, *args, **kwargs):
+        raise TypeError("labware definitions from the store are read-only; deepcopy one to edit it")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _refuse
+    __ior__ = _refuse
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return dict, (thaw(self),)
+
+
+def freeze(value):
+    """``value`` with every dict read-only and every list a tuple."""
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """An editable deep copy of a frozen definition."""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+def canonical(definition):
+    return json.dumps(definition, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _compact(definition):
+    return json.dumps(definition, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def definition_uri(definition):
+    parameters = definition.get("parameters", {})
+    return f"{definition.get('namespace', 'custom_beta')}/{parameters.get('loadName')}/{definition.get('version', 1)}"
+
+
+def is_definition(document):
+    return isinstance(document, dict) and "ordering" in document and "parameters" in document \
+        and "wells" in document
+
+
+class LabwareStore:
+    """Labware definitions deduplicated by content hash, in memory-mapped packs.
+
+    With ``directory=None`` the store is in memory only.
+    """
+
+    def __init__(self, directory=DEFAULT_STORE_DIR):
+        self.directory = directory
+        self._entries = {}   # digest -> (pack name, offset, length, uri)
+        self._aliases = {}   # digest of raw bytes -> canonical digest
+        self._groups = {}    # digest of a raw labwareDefinitions object -> {definition ID: digest}
+        self._uris = {}      # uri -> [digest, ...] in the order they were stored
+        self._maps = {}
+        self._shared = {}
+        self._seen = set()
+        self._pending = {}   # digest -> canonical bytes not yet written
+        self._pending_aliases = {}
+        self._pending_groups = {}
+        self.reload()
+
+    # Reading
+
+    def _packs(self):
+        if self.directory is None:
+            return []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(".idx.json")] for name in names if name.endswith(".idx.json"))
+
+    def reload(self):
+        """Pick up packs that other processes have written since the store was opened."""
+        for pack in self._packs():
+            if pack in self._seen:
+                continue
+            try:
+                with open(os.path.join(self.directory, f"{pack}.idx.json"), encoding="utf-8") as fh:
+                    index = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            if index.get("version") != STORE_VERSION:
+                continue
+            self._seen.add(pack)
+            for digest, offset, length, uri in index.get("definitions", ()):
+                if digest not in self._entries:
+                    self._entries[digest] = (pack, offset, length, uri)
+                    self._uris.setdefault(uri, []).append(digest)
+            self._aliases.update(index.get("aliases", {}))
+            self._groups.update(index.get("groups", {}))
+
+    def __len__(self):
+        return len(self._entries) + len(self._pending)
+
+    def __contains__(self, digest):
+        return digest in self._entries or digest in self._pending
+
+    def __iter__(self):
+        yield from self._entries
+        yield from self._pending
+
+    def uris(self):
+        return dict(self._uris)
+
+    def raw(self, digest):
+        """The stored JSON of a definition, as a view of its pack where it has one."""
+        if digest in self._pending:
+            return memoryview(self._pending[digest])
+        try:
+            pack, offset, length, _ = self._entries[digest]
+        except KeyError:
+            raise KeyError(f"No labware definition {digest}") from None
+        buf = self._maps.get(pack)
+        if buf is None:
+            with open(os.path.join(self.directory, f"{pack}.pack"), "rb") as fh:
+                buf = self._maps[pack] = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(buf)[offset:offset + length]
+
+    def get(self, digest):
+        """The shared, read-only definition for ``digest``; decoded once per store."""
+        definition = self._shared.get(digest)
+        if definition is None:
+            with self.raw(digest) as raw:
+                definition = self._shared[digest] = freeze(json.loads(raw.tobytes()))
+        return definition
+
+    def find(self, uri):
+        """The most recently stored definition with this ``namespace/loadName/version``, or ``None``."""
+        digests = self._uris.get(uri)
+        return self.get(digests[-1]) if digests else None
+
+    # Adding
+
+    def add(self, definition):
+        """Store a decoded definition and return its digest."""
+        if not is_definition(definition):
+            raise LabwareFormatError("not a labware definition (no ordering, parameters and wells)")
+        digest = hashlib.sha256(canonical(definition)).hexdigest()
+        if digest not in self:
+            self._pending[digest] = _compact(definition)
+            self._uris.setdefault(definition_uri(definition), []).append(digest)
+        return digest
+
+    def intern(self, raw):
+        """The digest of a definition given as JSON bytes; known spellings are not decoded."""
+        key = hashlib.sha256(raw).hexdigest()
+        digest = self._aliases.get(key)
+        if digest is not None and digest in self:
+            return digest
+        try:
+            definition = json.loads(bytes(raw))
+        except ValueError as exc:
+            raise LabwareFormatError(f"labware definition is not valid JSON: {exc}") from None
+        digest = self.add(definition)
+        self._aliases[key] = self._pending_aliases[key] = digest
+        return digest
+
+    def intern_object(self, raw, members):
+        """``{definition ID: digest}`` for a JSON object of definitions given as bytes.
+
+        ``members()`` returns each value's ``(start, end)`` within ``raw``; it
+        is only called for an object not seen in this spelling before.
+        """
+        key = hashlib.sha256(raw).hexdigest()
+        group = self._groups.get(key)
+        if group is not None and all(digest in self for digest in group.values()):
+            return group
+        group = {name: self.intern(raw[start:end]) for name, (start, end) in members().items()}
+        self._groups[key] = self._pending_groups[key] = group
+        return group
+
+    def flush(self):
+        """Write what was added since the last flush as a new pack.
+
+        Returns ``False`` when the store directory cannot be written; the
+        additions then stay available in memory, as they always do in a
+        store without a directory.
+        """
+        if self.directory is None:
+            return True
+        if not self._pending and not self._pending_aliases and not self._pending_groups:
+            return True
+        pending = list(self._pending.items())
+        data = b"".join(raw for _, raw in pending)
+        definitions = []
+        offset = 0
+        for digest, raw in pending:
+            definitions.append([digest, offset, len(raw), definition_uri(json.loads(raw))])
+            offset += len(raw)
+        index = {"version": STORE_VERSION, "definitions": definitions, "aliases": self._pending_aliases,
+                 "groups": self._pending_groups}
+        text = json.dumps(index, sort_keys=True, separators=(",", ":"))
+        pack = hashlib.sha256(data + text.encode()).hexdigest()[:16]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for name, content in ((f"{pack}.pack", data), (f"{pack}.idx.json", text.encode())):
+                # Pack before index, each under a temporary name first: a reader never sees half a pack.
+                path = os.path.join(self.directory, name)
+                partial = f"{path}.{os.getpid()}.tmp"
+                with open(partial, "wb") as fh:
+                    fh.write(content)
+                os.replace(partial, path)
+        except OSError:
+            return False
+        self._seen.add(pack)
+        for digest, offset, length, uri in definitions:
+            self._entries[digest] = (pack, offset, length, uri)
+            del self._pending[digest]
+        self._pending_aliases = {}
+        self._pending_groups = {}
+        return True
+
+    def compact(self):
+        """Merge every pack into one; returns the number of packs removed."""
+        self.reload()
+        old = self._packs()
+        if len(old) < 2:
+            return 0
+        for digest in list(self._entries):
+            with self.raw(digest) as raw:
+                self._pending[digest] = raw.tobytes()
+        self._pending_aliases = dict(self._aliases)
+        self._pending_groups = dict(self._groups)
+        self._entries.clear()
+        self.close()
+        if not self.flush():
+            raise OSError(f"cannot write to {self.directory}")
+        kept = set(self._packs()) - set(old)
+        removed = 0
+        for pack in old:
+            if pack in kept:
+                continue
+            for name in (f"{pack}.idx.json", f"{pack}.pack"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+            self._seen.discard(pack)
+            removed += 1
+        return removed
+
+    def close(self):
+        for buf in self._maps.values():
+            buf.close()
+        self._maps.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        packs = self._packs()
+        size = 0
+        for pack in packs:
+            try:
+                size += os.path.getsize(os.path.join(self.directory, f"{pack}.pack"))
+            except FileNotFoundError:
+                pass
+        return {"definitions": len(self), "spellings": len(self._aliases), "uris": len(self._uris),
+                "packs": len(packs), "bytes": size}
+
+
+_default_store = None
+_memory_store = None
+
+
+def default_store():
+    """Return the process-wide store in ``~/.cache/biof_tools/labware``."""
+    global _default_store
+    if _default_store is None:
+        _default_store = LabwareStore()
+    return _default_store
+
+
+def memory_store():
+    """Return the process-wide in-memory store, which never writes to disk."""
+    global _memory_store
+    if _memory_store is None:
+        _memory_store = LabwareStore(None)
+    return _memory_store
+
+
+def definition_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                yield from (os.path.join(root, name) for name in sorted(names) if name.endswith(".json"))
+        else:
+            yield path
+
+
+def add_file(store, path):
+    """Store the definitions of a Protocol Designer file or a definition file; returns ``(found, new)``."""
+    from .pd_reader import ProtocolFile
+
+    before = len(store)
+    with ProtocolFile(path) as pd:
+        if "labwareDefinitions" in pd.sections:
+            found = len(pd.labware_definitions(store))
+        elif {"ordering", "parameters", "wells"} <= set(pd.sections):
+            with open(path, "rb") as fh:
+                store.intern(fh.read())
+            found = 1
+        else:
+            found = 0
+    return found, len(store) - before
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shared, deduplicated labware definitions.")
+    parser.add_argument("--store", default=DEFAULT_STORE_DIR, help="store directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="store the definitions of Protocol Designer files or definition files")
+    add.add_argument("paths", nargs="+", help="files or directories of .json files")
+    sub.add_parser("list", help="list the stored definitions by URI")
+    show = sub.add_parser("show", help="print a definition by URI or digest")
+    show.add_argument("key")
+    sub.add_parser("compact", help="merge the store's packs into one")
+    args = parser.parse_args(argv)
+
+    with LabwareStore(args.store) as store:
+        status = 0
+        if args.command == "add":
+            files = found = new = 0
+            for path in definition_files(args.paths):
+                try:
+                    counts = add_file(store, path)
+                except (OSError, ValueError) as exc:
+                    print(f"{path}: error: {exc}", file=sys.stderr)
+                    status = 1
+                    continue
+                files += bool(counts[0])
+                found += counts[0]
+                new += counts[1]
+            if not store.flush():
+                print(f"{args.store}: error: cannot write the store", file=sys.stderr)
+                status = 1
+            print(f"{found} definition(s) in {files} file(s), {new} new; "
+                  f"{len(store)} distinct in the store")
+        elif args.command == "list":
+            for uri, digests in sorted(store.uris().items()):
+                print(f"{uri}\t" + " ".join(digest[:12] for digest in digests))
+            stats = store.stats()
+            print(f"{stats['definitions']} definition(s), {stats['uris']} URI(s), "
+                  f"{stats['spellings']} known spelling(s), {stats['packs']} pack(s), {stats['bytes']} bytes")
+        elif args.command == "show":
+            digests = [digest for digest in store if digest.startswith(args.key)]
+            definition = store.find(args.key) or (store.get(digests[0]) if len(digests) == 1 else None)
+            if definition is None:
+                print(f"{args.key}: error: no such definition", file=sys.stderr)
+                status = 1
+            else:
+                print(json.dumps(definition, indent=2))
+        else:
+            print(f"{store.compact()} pack(s) merged")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Shared liquid-class library for the Flex protocols.
+
+Liquid classes are stored once in ``data/liquid_classes.json`` as a common
+``base`` set of sections plus, per class, the pipette, tip rack and the handful
+of settings that differ from the base (dotted paths such as
+``"aspirate.flow_rate_by_volume"``). Values of the form ``"$name"`` are filled
+in from keyword parameters when the class is built, which is how run-time
+quantities like a mix volume are kept out of the data file.
+
+Built property dicts and defined liquid-class objects are cached per
+(name, pipette, tip rack, parameters). The cache is dropped whenever the
+content of the data file changes.
+
+Protocols that run on the robot cannot import this package, so they embed the
+same ``LIQUID_CLASS_BASE``/``LIQUID_CLASSES`` tables;
+``python -m biof_tools.liquid_classes check <protocol.py>`` reports any drift
+between an embedded copy and the shared file.
+
+``*_by_volume`` settings are ``(volume, value)`` tables that the robot
+interpolates linearly and holds flat beyond the first and last points;
+``volume_table`` precomputes one for ``bisect`` lookups with the same
+semantics.
+"""
+
+import ast
+from bisect import bisect_right
+import copy
+import functools
+import hashlib
+import json
+import os
+import sys
+import weakref
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "data", "liquid_classes.json")
+DEFAULT_SECTIONS = ("aspirate", "dispense")
+
+
+def _normalise(value):
+    """Return ``value`` with tuples turned into lists, as JSON would store it."""
+    if isinstance(value, dict):
+        return {key: _normalise(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalise(item) for item in value]
+    return value
+
+
+def _resolve(value, params):
+    if isinstance(value, str) and value.startswith("$"):
+        try:
+            return params[value[1:]]
+        except KeyError:
+            raise ValueError(f"Liquid class parameter {value[1:]!r} was not supplied") from None
+    if isinstance(value, dict):
+        return {key: _resolve(item, params) for key, item in value.items()}
+    if isinstance(value, list):
+        # Volume tables are sequences of (volume, value) pairs in the Opentrons API.
+        if all(isinstance(item, list) and len(item) == 2 for item in value) and value:
+            return [tuple(_resolve(part, params) for part in item) for item in value]
+        return [_resolve(item, params) for item in value]
+    return value
+
+
+class VolumeTable:
+    """A ``*_by_volume`` table, sorted once, with the slope of every segment precomputed."""
+
+    __slots__ = ("volumes", "values", "_slopes")
+
+    def __init__(self, points):
+        points = sorted((float(volume), float(value)) for volume, value in points)
+        if not points:
+            raise ValueError("A volume table needs at least one (volume, value) point")
+        self.volumes = tuple(volume for volume, _ in points)
+        self.values = tuple(value for _, value in points)
+        self._slopes = tuple(
+            (v1 - v0) / (x1 - x0) if x1 != x0 else 0.0
+            for (x0, v0), (x1, v1) in zip(points, points[1:])
+        )
+
+    def __call__(self, volume):
+        index = bisect_right(self.volumes, volume)
+        if index == 0:
+            return self.values[0]
+        if index == len(self.volumes):
+            return self.values[-1]
+        return self.values[index - 1] + self._slopes[index - 1] * (volume - self.volumes[index - 1])
+
+    def points(self):
+        return list(zip(self.volumes, self.values))
+
+    def __repr__(self):
+        return f"VolumeTable({self.points()!r})"
+
+
+@functools.lru_cache(maxsize=1024)
+def _volume_table(points):
+    return VolumeTable(points)
+
+
+def volume_table(points):
+    """Return the (shared) ``VolumeTable`` for a list of ``(volume, value)`` pairs."""
+    return _volume_table(tuple(tuple(point) for point in points))
+
+
+def build_properties(base, spec, **params):
+    """Build the ``define_liquid_class`` properties for one class spec."""
+    sections = {
+        name: _normalise(copy.deepcopy(base[name]))
+        for name in spec.get("sections", DEFAULT_SECTIONS)
+    }
+    for path, value in spec.get("set", {}).items():
+        *parents, leaf = path.split(".")
+        target = sections
+        for key in parents:
+            target = target[key]
+        target[leaf] = _normalise(value)
+    return {spec["pipette"]: {spec["tiprack"]: _resolve(sections, params)}}
+
+
+class LiquidClassLibrary:
+    """Liquid classes loaded from a shared JSON data file."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._stat = None
+        self.digest = None
+        self.base = {}
+        self.classes = {}
+        self._properties = {}
+        self._defined = weakref.WeakKeyDictionary()
+        self.reload()
+
+    def reload(self, force=False):
+        """Re-read the data file if it changed on disk, dropping stale cache entries."""
+        stat = os.stat(self.path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if stat_key == self._stat and not force:
+            return False
+        with open(self.path, "rb") as fh:
+            raw = fh.read()
+        self._stat = stat_key
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest == self.digest and not force:
+            return False
+        data = json.loads(raw)
+        self.digest = digest
+        self.base = data["base"]
+        self.classes = data["classes"]
+        self._properties.clear()
+        self._defined = weakref.WeakKeyDictionary()
+        return True
+
+    def _key(self, name, params):
+        try:
+            spec = self.classes[name]
+        except KeyError:
+            raise KeyError(f"Unknown liquid class {name!r}") from None
+        return (name, spec["pipette"], spec["tiprack"], tuple(sorted(params.items())))
+
+    def properties(self, name, **params):
+        """Return the properties for ``name``; the result is shared, do not mutate it."""
+        self.reload()
+        key = self._key(name, params)
+        if key not in self._properties:
+            self._properties[key] = build_properties(self.base, self.classes[name], **params)
+        return self._properties[key]
+
+    def define(self, protocol, name, **params):
+        """Define ``name`` on ``protocol`` once and return the cached liquid class."""
+        self.reload()
+        key = self._key(name, params)
+        defined = self._defined.setdefault(protocol, {})
+        if key not in defined:
+            defined[key] = protocol.define_liquid_class(
+                name=name, properties=self.properties(name, **params)
+            )
+        return defined[key]
+
+
+_default_library = None
+
+
+def default_library():
+    """Return the process-wide library for the shared data file."""
+    global _default_library
+    if _default_library is None:
+        _default_library = LiquidClassLibrary()
+    return _default_library
+
+
+def embedded_tables(protocol_path):
+    """Return the ``(LIQUID_CLASS_BASE, LIQUID_CLASSES)`` literals of a protocol file."""
+    with open(protocol_path, encoding="utf-8") as fh:
+        tree = ast.parse(fh.read(), filename=protocol_path)
+    found = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+            if isinstance(target, ast.Name) and target.id in ("LIQUID_CLASS_BASE", "LIQUID_CLASSES"):
+                found[target.id] = ast.literal_eval(node.value)
+    if len(found) != 2:
+        raise ValueError(f"{protocol_path} does not embed LIQUID_CLASS_BASE and LIQUID_CLASSES")
+    return found["LIQUID_CLASS_BASE"], found["LIQUID_CLASSES"]
+
+
+def drift(protocol_path, library=None):
+    """List the differences between a protocol's embedded tables and the library."""
+    library = library or default_library()
+    base, classes = embedded_tables(protocol_path)
+    problems = []
+    for section, value in base.items():
+        if _normalise(value) != library.base.get(section):
+            problems.append(f"base section {section!r} differs")
+    for name, spec in classes.items():
+        if name not in library.classes:
+            problems.append(f"class {name!r} is not in the library")
+        elif _normalise(spec) != library.classes[name]:
+            problems.append(f"class {name!r} differs")
+    return problems
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect the shared liquid-class library.")
+    parser.add_argument("--library", default=DEFAULT_PATH, help="liquid-class data file")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list the classes in the library")
+    show = sub.add_parser("show", help="print the built properties of a class")
+    show.add_argument("name")
+    show.add_argument("--param", action="append", default=[], metavar="NAME=VALUE")
+    check = sub.add_parser("check", help="compare a protocol's embedded tables with the library")
+    check.add_argument("protocols", nargs="+")
+    args = parser.parse_args(argv)
+
+    library = LiquidClassLibrary(args.library)
+    if args.command == "list":
+        for name, spec in library.classes.items():
+            print(f"{name}\t{spec['pipette']}\t{spec['tiprack']}")
+    elif args.command == "show":
+        params = {}
+        for item in args.param:
+            key, _, value = item.partition("=")
+            params[key] = json.loads(value)
+        print(json.dumps(library.properties(args.name, **params), indent=2))
+    else:
+        status = 0
+        for path in args.protocols:
+            problems = drift(path, library)
+            for problem in problems:
+                print(f"{path}: {problem}")
+            status = status or bool(problems)
+        sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
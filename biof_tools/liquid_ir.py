@@ -0,0 +1,575 @@
+"""Columnar liquid-handling operations from Flex, Protocol Designer and CyBio methods.
+
+The repository describes the same kind of work three ways: Flex Python
+protocols, Protocol Designer ``commands`` arrays and CyBio Felix ``.bms``
+command trees. ``OpTable`` holds all of them as one table. There is one
+typed ``array`` per column, and the text columns (protocol, step, pipette,
+labware, well) are dictionary-encoded into a shared string pool. Queries
+compare integer codes column by column, and tables from different sources
+concatenate with ``extend``.
+
+Columns:
+
+* ``protocol``, ``index`` - source file and command number within it
+* ``op`` - one of ``OPS``; ``mix`` is an aspirate or dispense that mixes
+  in place, and is left out of the liquid moved
+* ``step`` - protocol step the operation belongs to
+* ``pipette``, ``channels`` - pipette or head, and how many channels act
+* ``labware``, ``well`` - where; ``well`` is the first well under the head
+* ``volume`` - uL per channel (aspirate, dispense, mix, air gap)
+* ``tip`` - number of the tip pick-up in use, -1 when no tip is on
+* ``start``, ``seconds`` - estimated start and duration; NaN where unknown
+
+Importers:
+
+* ``from_flex`` runs a Flex protocol through ``biof_tools.flex_sim``.
+* ``from_protocol_designer`` reads the commands with
+  ``biof_tools.pd_reader``. Durations come from the simulator's
+  ``TimeModel``, and steps from the file's saved step forms.
+* ``from_cybio`` walks a ``.bms`` method with ``biof_tools.bms_reader``.
+  ``$(...)`` expressions are evaluated from the method's variable defaults
+  where possible, and labware is taken from the preceding
+  ``MoveLabware``. Only waits have durations.
+
+    table = OpTable()
+    table.extend(from_flex())
+    table.extend(from_cybio("CyBio Felix protocols/BioF-CYB-0010 AMPure_beads_PCR_cleanup_V14.bms"))
+    table.group_sum("labware", table.select(op="aspirate"), liquid=True)
+
+    python -m biof_tools.liquid_ir "Opentrons Flex/Semi-automated_E.coli_Transformation_thermoblock.py" \\
+        "CyBio Felix protocols/"*.bms Hamilton_Robotic_Protocols/*/*.json
+"""
+
+from array import array
+import ast
+from collections import Counter
+import math
+import operator
+import os
+import re
+import sys
+
+OPS = (
+    "other", "aspirate", "dispense", "pick_up_tip", "drop_tip", "blow_out", "air_gap", "move",
+    "pause", "delay", "move_labware", "temperature", "shake", "comment", "load", "mix",
+)
+OP_CODES = {name: code for code, name in enumerate(OPS)}
+TEXT_COLUMNS = ("protocol", "step", "pipette", "labware", "well")
+COLUMNS = {
+    "protocol": "H",
+    "index": "I",
+    "op": "B",
+    "step": "H",
+    "pipette": "H",
+    "channels": "H",
+    "labware": "H",
+    "well": "H",
+    "volume": "d",
+    "tip": "i",
+    "start": "d",
+    "seconds": "d",
+}
+NAN = float("nan")
+
+
+class OpTable:
+    """Liquid-handling operations stored column by column."""
+
+    def __init__(self):
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+        self.strings = [""]
+        self._codes = {"": 0}
+
+    def __len__(self):
+        return len(self.columns["op"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def intern(self, text):
+        """Code of ``text`` in the string pool, adding it if needed."""
+        text = "" if text is None else str(text)
+        code = self._codes.get(text)
+        if code is None:
+            code = self._codes[text] = len(self.strings)
+            self.strings.append(text)
+        return code
+
+    def code(self, text):
+        """Code of ``text``, or ``None`` if no row uses it."""
+        return self._codes.get("" if text is None else str(text))
+
+    def append(self, protocol, index, op, step=None, pipette=None, channels=0, labware=None,
+               well=None, volume=0.0, tip=-1, start=NAN, seconds=NAN):
+        columns = self.columns
+        columns["protocol"].append(self.intern(protocol))
+        columns["index"].append(index)
+        columns["op"].append(OP_CODES[op])
+        columns["step"].append(self.intern(step))
+        columns["pipette"].append(self.intern(pipette))
+        columns["channels"].append(channels)
+        columns["labware"].append(self.intern(labware))
+        columns["well"].append(self.intern(well))
+        columns["volume"].append(volume)
+        columns["tip"].append(tip)
+        columns["start"].append(start)
+        columns["seconds"].append(seconds)
+
+    def extend(self, other):
+        """Append the rows of ``other``, re-coding its strings into this table's pool."""
+        recode = array("H", [self.intern(text) for text in other.strings])
+        for name, column in self.columns.items():
+            if name in TEXT_COLUMNS:
+                column.extend(recode[code] for code in other.columns[name])
+            else:
+                column.extend(other.columns[name])
+        return self
+
+    # Queries
+
+    def value(self, name, row):
+        """Decoded value of column ``name`` at ``row``."""
+        value = self.columns[name][row]
+        if name in TEXT_COLUMNS:
+            return self.strings[value]
+        if name == "op":
+            return OPS[value]
+        return value
+
+    def select(self, rows=None, **conditions):
+        """``array('I')`` of the rows matching every condition.
+
+        A condition is a value, a tuple/list/set of values, or a predicate on
+        the raw column value. Text and ``op`` values are matched by code.
+        """
+        selected = array("I", range(len(self))) if rows is None else array("I", rows)
+        for name, wanted in conditions.items():
+            column = self.columns[name]
+            if callable(wanted):
+                test = wanted
+            else:
+                values = wanted if isinstance(wanted, (tuple, list, set, frozenset)) else (wanted,)
+                if name in TEXT_COLUMNS:
+                    codes = {self.code(value) for value in values} - {None}
+                elif name == "op":
+                    codes = {OP_CODES[value] for value in values}
+                else:
+                    codes = set(values)
+                test = codes.__contains__
+            selected = array("I", [row for row in selected if test(column[row])])
+        return selected
+
+    def sum(self, name, rows=None, liquid=False):
+        """Sum of a numeric column; ``liquid=True`` multiplies by ``channels`` and skips NaN."""
+        column = self.columns[name]
+        channels = self.columns["channels"]
+        rows = range(len(self)) if rows is None else rows
+        if liquid:
+            return math.fsum(column[row] * max(channels[row], 1) for row in rows
+                             if not math.isnan(column[row]))
+        return math.fsum(column[row] for row in rows if not math.isnan(column[row]))
+
+    def group_sum(self, by, rows=None, name="volume", liquid=False):
+        """``{value of by: sum of name}`` over ``rows``."""
+        keys = self.columns[by]
+        column = self.columns[name]
+        channels = self.columns["channels"]
+        sums = {}
+        for row in range(len(self)) if rows is None else rows:
+            value = column[row]
+            if math.isnan(value):
+                continue
+            if liquid:
+                value *= max(channels[row], 1)
+            sums[keys[row]] = sums.get(keys[row], 0.0) + value
+        return {self._decode(by, key): total for key, total in sums.items()}
+
+    def count(self, by, rows=None):
+        keys = self.columns[by]
+        counts = Counter(keys[row] for row in (range(len(self)) if rows is None else rows))
+        return Counter({self._decode(by, key): count for key, count in counts.items()})
+
+    def distinct(self, names, rows=None):
+        """Distinct value tuples of the columns ``names`` over ``rows``."""
+        columns = [self.columns[name] for name in names]
+        return {tuple(column[row] for column in columns)
+                for row in (range(len(self)) if rows is None else rows)}
+
+    def _decode(self, name, value):
+        if name in TEXT_COLUMNS:
+            return self.strings[value]
+        if name == "op":
+            return OPS[value]
+        return value
+
+    def rows(self, rows=None):
+        """Yield rows as dicts of decoded values."""
+        for row in range(len(self)) if rows is None else rows:
+            yield {name: self.value(name, row) for name in self.columns}
+
+    def write_csv(self, handle):
+        import csv
+
+        writer = csv.DictWriter(handle, fieldnames=list(self.columns), lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(self.rows())
+
+
+class _Builder:
+    """Per-import state: the table, a clock and the tip in use on each pipette."""
+
+    def __init__(self, protocol):
+        self.table = OpTable()
+        self.protocol = protocol
+        self.clock = 0.0
+        self.tips = {}
+        self.pickups = 0
+
+    def add(self, index, op, pipette=None, seconds=NAN, **fields):
+        if op == "pick_up_tip":
+            self.tips[pipette] = self.pickups
+            self.pickups += 1
+        tip = self.tips.get(pipette, -1)
+        if op == "drop_tip":
+            self.tips.pop(pipette, None)
+        start = self.clock
+        if not math.isnan(seconds):
+            self.clock += seconds
+        self.table.append(self.protocol, index, op, pipette=pipette, tip=tip, start=start,
+                          seconds=seconds, **fields)
+
+
+# Flex
+
+
+FLEX_OPS = {
+    "aspirate": "aspirate", "dispense": "dispense", "pick_up_tip": "pick_up_tip",
+    "drop_tip": "drop_tip", "blow_out": "blow_out", "air_gap": "air_gap", "move": "move",
+    "pause": "pause", "delay": "delay", "move_labware": "move_labware",
+    "set_temperature": "temperature", "start_set_temperature": "temperature",
+    "await_temperature": "temperature", "deactivate": "temperature", "comment": "comment",
+    "load_labware": "load", "load_module": "load", "load_instrument": "load",
+}
+
+
+def from_flex(protocol=None, params=None, time_model=None):
+    """Operations of a Flex protocol, from a ``flex_sim`` run.
+
+    Aspirates and dispenses the simulator records for ``mix`` are ``mix``
+    operations. Steps follow the protocol's ``Step N:`` comments and pauses: each
+    operation belongs to the last comment or pause message before it.
+    """
+    from . import flex_sim
+
+    protocol = protocol or flex_sim.DEFAULT_PROTOCOL
+    result = flex_sim.run_protocol(protocol, params, time_model)
+    if result.error is not None:
+        raise result.error
+    name = protocol if isinstance(protocol, str) else getattr(protocol, "__file__", "protocol")
+    builder = _Builder(os.path.basename(name))
+    step = "setup"
+    for index, command in enumerate(result.commands):
+        op = FLEX_OPS.get(command.kind, "other")
+        if op in ("aspirate", "dispense") and command.message == "mix":
+            op = "mix"
+        if op in ("comment", "pause") and command.message:
+            step = command.message.splitlines()[0][:80]
+        builder.add(
+            index, op, pipette=command.pipette, seconds=command.seconds, step=step,
+            channels=len(command.wells) or (1 if command.pipette else 0),
+            labware=command.labware, well=command.well,
+            volume=command.volume if op in ("aspirate", "dispense", "mix", "air_gap") else 0.0,
+        )
+    return builder.table
+
+
+# Protocol Designer
+
+
+PD_OPS = {
+    "aspirate": "aspirate", "dispense": "dispense", "pickUpTip": "pick_up_tip",
+    "dropTip": "drop_tip", "dropTipInPlace": "drop_tip", "blowout": "blow_out",
+    "blowOutInPlace": "blow_out", "airGapInPlace": "air_gap", "moveToWell": "move",
+    "moveToAddressableArea": "move", "moveToAddressableAreaForDropTip": "move",
+    "waitForResume": "pause", "waitForDuration": "delay", "moveLabware": "move_labware",
+    "loadPipette": "load", "loadLabware": "load", "loadLiquid": "load", "loadModule": "load",
+    "comment": "comment",
+}
+
+
+def _pd_seconds(time_model, op, params):
+    if op in ("aspirate", "dispense", "mix", "air_gap"):
+        return time_model.liquid(params.get("volume", 0.0), params.get("flowRate"))
+    if op == "pick_up_tip":
+        return time_model.pick_up_tip
+    if op == "drop_tip":
+        return time_model.drop_tip
+    if op == "blow_out":
+        return time_model.blow_out
+    if op == "delay":
+        return params.get("seconds", 0.0)
+    if op == "pause":
+        return time_model.pause
+    if op == "move":
+        return time_model.move_overhead
+    return 0.0
+
+
+def from_protocol_designer(path, time_model=None):
+    """Operations of a Protocol Designer file.
+
+    An aspirate starts the first remaining ``moveLiquid``/``mix`` form that
+    draws from its labware and well; pauses start the next pause form. An
+    aspirate that the same pipette dispenses straight back into the same
+    well is mixing, and both become ``mix`` operations.
+    """
+    from .flex_sim import TimeModel
+    from .pd_reader import ProtocolFile
+
+    time_model = time_model or TimeModel()
+    builder = _Builder(os.path.basename(path))
+    with ProtocolFile(path) as pd:
+        labware = {key: value.get("displayName", key) for key, value in pd.section("labware", {}).items()}
+        pipettes = pd.section("pipettes", {})
+        design = pd.section("designerApplication", {}).get("data", {})
+        forms = [design["savedStepForms"][step] for step in design.get("orderedStepIds", ())
+                 if step in design.get("savedStepForms", {})]
+        channels = {key: 8 if "multi" in value.get("name", "") else 1 for key, value in pipettes.items()}
+        position = 0
+        step = "setup"
+        aspirates = {}  # pipette -> (row, labware, well) of its last aspirate
+        ops = builder.table.columns["op"]
+        for index, command in enumerate(pd.commands()):
+            kind, params = command["commandType"], command.get("params", {})
+            op = PD_OPS.get(kind, "other")
+            if kind == "delay":
+                op = "pause" if params.get("wait") is True or params.get("waitForResume") else "delay"
+            if kind == "aspirate" and command.get("meta", {}).get("isAirGap"):
+                op = "air_gap"
+            if op in ("aspirate", "pause"):
+                for offset, form in enumerate(forms[position:]):
+                    if op == "pause" and form.get("stepType") == "pause" or (
+                            op == "aspirate" and form.get("stepType") in ("moveLiquid", "mix")
+                            and form.get("aspirate_labware", form.get("labware")) == params.get("labwareId")
+                            and params.get("wellName") in form.get("aspirate_wells", form.get("wells", ()))):
+                        position += offset
+                        step = form.get("stepName") or step
+                        if op == "pause":
+                            position += 1
+                        break
+            pipette = params.get("pipetteId")
+            if op == "aspirate":
+                aspirates[pipette] = (len(builder.table), params.get("labwareId"), params.get("wellName"))
+            elif op == "dispense":
+                previous = aspirates.pop(pipette, None)
+                if previous is not None and previous[1:] == (params.get("labwareId"), params.get("wellName")):
+                    ops[previous[0]] = OP_CODES["mix"]
+                    op = "mix"
+            elif op in ("pick_up_tip", "drop_tip", "blow_out"):
+                aspirates.pop(pipette, None)
+            builder.add(
+                index, op, pipette=pipettes.get(pipette, {}).get("name", pipette),
+                seconds=_pd_seconds(time_model, op, params), step=step,
+                channels=channels.get(pipette, 0) if pipette else 0,
+                labware=labware.get(params.get("labwareId"), params.get("labwareId")),
+                well=params.get("wellName"),
+                volume=params.get("volume", 0.0) if op in ("aspirate", "dispense", "mix", "air_gap") else 0.0,
+            )
+    return builder.table
+
+
+# CyBio
+
+
+CYBIO_OPS = {
+    "plugin:felix:aspirate": "aspirate", "plugin:felix:dispense": "dispense",
+    "plugin:felix:mount": "pick_up_tip", "plugin:felix:unmount": "drop_tip",
+    "plugin:felix:emptypistons": "blow_out", "plugin:felix:MoveLabware": "move",
+    "plugin:felix:MovePlace": "move", "plugin:felix:posz": "move",
+    "scripting:cmd:msgbox": "pause", "scripting:cmd:wait": "delay",
+    "Plugin:PluginBioshake:CmdShake": "shake", "Plugin:PluginBioShake:CmdTemp": "temperature",
+    "scripting:cmd:info": "comment",
+}
+# Steps that only group others.
+CYBIO_CONTAINERS = {
+    "scripting:cmd:combine", "scripting:cmd:condition", "scripting:cmd:repeat",
+    "scripting:cmd:parallel", "CCmdLiquidTransferBlock", "plugin:liquid_transfer:transfer_cmd",
+}
+_REFERENCE = re.compile(r"\$\(([^()]*)\)")
+_ARITHMETIC = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.USub: operator.neg, ast.UAdd: operator.pos,
+}
+
+
+def _arithmetic(node):
+    if isinstance(node, ast.Expression):
+        return _arithmetic(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return float(node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+        return _ARITHMETIC[type(node.op)](_arithmetic(node.left), _arithmetic(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _ARITHMETIC:
+        return _ARITHMETIC[type(node.op)](_arithmetic(node.operand))
+    raise ValueError("not arithmetic")
+
+
+def evaluate(text, values, depth=8):
+    """Number for a Felix expression such as ``$(BEADSVOL)*2``, or NaN if it cannot be resolved.
+
+    ``values`` maps lower-case variable names to their (possibly expression) values.
+    """
+    for _ in range(depth):
+        if "$(" not in text:
+            break
+        text = _REFERENCE.sub(lambda match: f"({values.get(match.group(1).lower(), 'nan')})", text)
+    try:
+        return _arithmetic(ast.parse(text.strip(), mode="eval"))
+    except (SyntaxError, ValueError, ZeroDivisionError, RecursionError):
+        return NAN
+
+
+def _substitute(text, values, depth=8):
+    """``text`` with the ``$(...)`` references it can resolve replaced by their values."""
+    for _ in range(depth):
+        if not text or "$(" not in text:
+            break
+        replaced = _REFERENCE.sub(lambda match: values.get(match.group(1).lower(), match.group(0)), text)
+        if replaced == text:
+            break
+        text = replaced
+    return text
+
+
+def _head_channels(tool):
+    """Channels of a Felix head configuration such as ``column_8_90`` or ``tip_tray_mount_96_robotic``."""
+    match = re.search(r"(?:column_|_)(8|96|384)(?:_|$)", tool or "")
+    return int(match.group(1)) if match else None
+
+
+def _anchor(selection):
+    """The Felix anchor well ``1A`` as ``A1``; other selections are kept as written."""
+    match = re.fullmatch(r"(\d+)([A-P])", selection or "")
+    return f"{match.group(2)}{match.group(1)}" if match else selection or None
+
+
+def from_cybio(path):
+    """Operations of a CyBio Felix method, in the order its steps are listed.
+
+    Disabled steps are skipped. Branches of conditions and loop bodies are
+    listed once each, as the method is read rather than run.
+    """
+    from .bms_patch import variables
+    from .bms_reader import MethodFile
+
+    builder = _Builder(os.path.basename(path))
+    with MethodFile(path) as method:
+        values = {variable.name.lower(): variable.value for variable in variables(method)}
+        # Set by the last MoveLabware or tip (un)mount: the head stays there with that tool.
+        where = {"labware": None, "well": None, "channels": 0}
+        index = 0
+
+        def visit(command, step):
+            nonlocal index
+            for sub in command.subcommands:
+                if not sub.enabled:
+                    continue
+                kind = sub.kind
+                label = step or f"{sub.number} {sub.title or kind}"
+                if kind in CYBIO_CONTAINERS:
+                    visit(sub, label)
+                    continue
+                op = CYBIO_OPS.get(kind, "other")
+                properties = sub.properties
+                if kind in ("plugin:felix:MoveLabware", "plugin:felix:mount", "plugin:felix:unmount"):
+                    labware = _substitute(properties.get("labware"), values)
+                    place = _substitute(properties.get("place"), values)
+                    channels = _head_channels(properties.get("tool") or properties.get("mount_slot"))
+                    where.update(labware=f"{labware} @ {place}" if place else labware,
+                                 well=_anchor(_substitute(properties.get("selection"), values)),
+                                 channels=channels or where["channels"])
+                volume = 0.0
+                if op in ("aspirate", "dispense"):
+                    volume = evaluate(properties.get("volume", ""), values)
+                seconds = evaluate(properties.get("wait", ""), values) if op == "delay" else NAN
+                builder.add(
+                    index, op, pipette="felix", seconds=seconds, step=label,
+                    channels=where["channels"], labware=where["labware"], well=where["well"],
+                    volume=volume,
+                )
+                index += 1
+                visit(sub, label)
+
+        visit(method.root_command, None)
+    return builder.table
+
+
+def load(path, params=None):
+    """Import ``path`` by its extension: ``.py`` Flex, ``.json`` Protocol Designer, ``.bms`` CyBio."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".py":
+        return from_flex(path, params)
+    if extension == ".json":
+        return from_protocol_designer(path)
+    if extension == ".bms":
+        return from_cybio(path)
+    raise ValueError(f"{path}: unknown format {extension!r}")
+
+
+def summary(table):
+    """Lines answering the fleet questions: liquid moved, tips per sample, time per step."""
+    lines = []
+    for protocol in sorted(table.count("protocol")):
+        rows = table.select(protocol=protocol)
+        aspirated = table.select(rows, op="aspirate")
+        dispensed = table.select(rows, op="dispense")
+        pickups = table.select(rows, op="pick_up_tip")
+        tips = sum(max(table["channels"][row], 1) for row in pickups)
+        # Wells reached by dispenses; a multi-channel dispense reaches ``channels`` wells.
+        reached = {}
+        for labware, well, channels in table.distinct(("labware", "well", "channels"), dispensed):
+            reached[labware, well] = max(reached.get((labware, well), 0), channels, 1)
+        samples = sum(reached.values())
+        lines.append(f"{protocol}: {len(rows)} operations, "
+                     f"{table.sum('volume', aspirated, liquid=True):.0f} uL aspirated, {tips} tips"
+                     + (f", {tips / samples:.2f} tips per dispense well" if samples else ""))
+        by_labware = table.group_sum("labware", aspirated, liquid=True)
+        for labware, volume in sorted(by_labware.items(), key=lambda item: -item[1]):
+            lines.append(f"  from {labware or '?'}: {volume:.0f} uL")
+        seconds = table.group_sum("step", rows, name="seconds")
+        if any(seconds.values()):
+            for step, total in seconds.items():
+                if total:
+                    lines.append(f"  {total / 60:7.1f} min  {step}")
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    from .flex_sim import parse_params
+
+    parser = argparse.ArgumentParser(description="Load protocols into one operation table and summarise it.")
+    parser.add_argument("paths", nargs="+", help=".py (Flex), .json (Protocol Designer) or .bms (CyBio)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="runtime parameter for Flex protocols")
+    parser.add_argument("--csv", help="write every operation to this CSV file")
+    args = parser.parse_args(argv)
+
+    table = OpTable()
+    status = 0
+    for path in args.paths:
+        try:
+            table.extend(load(path, parse_params(args.param)))
+        except Exception as exc:
+            print(f"{path}: error: {type(exc).__name__}: {exc}", file=sys.stderr)
+            status = 1
+    print("\n".join(summary(table)))
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as handle:
+            table.write_csv(handle)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
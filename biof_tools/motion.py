@@ -0,0 +1,397 @@
+"""Gantry travel of a simulated Flex run, and a travel-minimizing reordering.
+
+``biof_tools.flex_sim`` costs moves between slot centres. ``Deck`` places
+each command at its well instead. It uses the slot centres and the grid of
+the loaded labware (rows, columns and pitch from ``flex_sim.LABWARE``, so
+registered custom definitions are included). ``moves`` then prices every
+located command with the run's ``TimeModel``: aspirates, dispenses, tip
+pick-ups and drops, blow-outs. The primary nozzle is taken as the gantry
+position and the offset between the two mounts is ignored.
+
+``optimize`` reorders what the protocol leaves free, and keeps everything
+else in place:
+
+* dispense targets in a run of trips from one source with one tip, such as
+  the step 3 distribute across the 384-well plate. Destinations are
+  permuted across the run (nearest neighbour, then pairwise swaps and
+  reversals), so each trip still aspirates and dispenses the same volumes.
+* tip pick-ups: each pick-up takes the rack column, among those the run
+  uses for that pipette, that is cheapest to reach between the commands
+  before and after it.
+
+``report`` prices the original and the reordered command streams.
+
+    python -m biof_tools.motion --param number_of_samples=96
+    python -m biof_tools.motion --param number_of_samples=384 --param recovery_plates=4 --moves
+"""
+
+from dataclasses import dataclass, replace
+
+from .flex_sim import LABWARE, SLOT_CENTRES, TimeModel, format_duration
+
+LOCATED = ("aspirate", "dispense", "pick_up_tip", "drop_tip", "blow_out")
+
+
+def well_offset(load_name, well):
+    """Offset (mm) of ``well`` from the centre of its labware, or ``None`` if unknown."""
+    try:
+        rows, columns, pitch, _ = LABWARE[load_name]
+    except KeyError:
+        return None
+    row = ord(well[0]) - ord("A")
+    column = int(well[1:]) - 1
+    # Rows run from the back of the deck (A) to the front; columns from left to right.
+    return (column - (columns - 1) / 2) * pitch, ((rows - 1) / 2 - row) * pitch
+
+
+class Deck:
+    """Labware positions as a run loads and moves it."""
+
+    def __init__(self):
+        self.load_names = {}  # slot -> load name
+
+    def update(self, command):
+        if command.kind == "load_labware":
+            self.load_names[command.slot] = command.message
+        elif command.kind == "move_labware":
+            load_name = self.load_names.pop(command.slot, None)
+            if load_name is not None:
+                self.load_names[command.message] = load_name
+
+    def position(self, command):
+        """Deck coordinates of the well a command works at (the slot centre without one)."""
+        centre = SLOT_CENTRES.get(command.slot)
+        if centre is None or command.well is None:
+            return centre
+        offset = well_offset(self.load_names.get(command.slot), command.well)
+        if offset is None:
+            return centre
+        return centre[0] + offset[0], centre[1] + offset[1]
+
+
+@dataclass(frozen=True)
+class Move:
+    index: int  # of the command in the run
+    kind: str
+    start: tuple
+    end: tuple
+    distance: float  # mm
+    seconds: float
+
+
+def _distance(start, end):
+    if start is None or end is None:
+        return 0.0
+    return ((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2) ** 0.5
+
+
+def positions(commands):
+    """``(index, position)`` of every located command, in run order."""
+    deck = Deck()
+    located = []
+    for index, command in enumerate(commands):
+        deck.update(command)
+        if command.kind in LOCATED:
+            located.append((index, deck.position(command)))
+    return located
+
+
+def moves(commands, time_model=None):
+    """The gantry move to each located command, priced with ``time_model``."""
+    time_model = time_model or TimeModel()
+    found = []
+    position = None
+    for index, end in positions(commands):
+        found.append(Move(index, commands[index].kind, position, end, _distance(position, end),
+                          time_model.move(position, end)))
+        position = end if end is not None else position
+    return found
+
+
+def travel(commands, time_model=None):
+    """``(distance in mm, seconds)`` of all gantry moves in ``commands``."""
+    found = moves(commands, time_model)
+    return sum(move.distance for move in found), sum(move.seconds for move in found)
+
+
+def segments(commands, time_model=None):
+    """``(distance, seconds)`` of the moves between operator pauses, in run order."""
+    found = {move.index: move for move in moves(commands, time_model)}
+    totals = [[0.0, 0.0]]
+    for index, command in enumerate(commands):
+        if command.kind == "pause":
+            totals.append([0.0, 0.0])
+        elif index in found:
+            totals[-1][0] += found[index].distance
+            totals[-1][1] += found[index].seconds
+    return [tuple(total) for total in totals]
+
+
+# Reordering
+
+
+@dataclass
+class DispenseRun:
+    """Trips from one source well with one tip; the dispense targets may be permuted."""
+
+    source: tuple  # (slot, well)
+    signature: tuple  # (volume, liquid class) shared by every dispense
+    commands: list  # indexes of the run's aspirates and dispenses, in order
+
+    def dispenses(self, commands):
+        return [index for index in self.commands if commands[index].kind == "dispense"]
+
+
+def dispense_runs(commands):
+    """Runs of two or more dispenses whose order is free.
+
+    A run is broken by a pause, a labware move, a tip change, a mix, a
+    blow-out or an air gap, and by any aspirate from another well.
+    """
+    runs = []
+    current = None
+
+    def close():
+        nonlocal current
+        if current is not None and len(current.dispenses(commands)) > 1:
+            runs.append(current)
+        current = None
+
+    for index, command in enumerate(commands):
+        if command.kind == "move" or command.kind not in LOCATED + ("pause", "move_labware", "air_gap"):
+            continue
+        mix = command.message == "mix"
+        if command.kind == "aspirate" and not mix:
+            source = (command.slot, command.well)
+            if current is not None and (current.source != source
+                                        or commands[current.commands[-1]].pipette != command.pipette):
+                close()
+            if current is None:
+                current = DispenseRun(source, None, [])
+            current.commands.append(index)
+        elif command.kind == "dispense" and not mix and current is not None:
+            signature = (command.volume, command.liquid_class)
+            if current.signature is None:
+                current.signature = signature
+            if (signature != current.signature
+                    or commands[current.commands[-1]].pipette != command.pipette):
+                close()
+                continue
+            current.commands.append(index)
+        else:
+            close()
+    close()
+    return runs
+
+
+def _target(command):
+    return command.labware, command.slot, command.well, command.wells
+
+
+def _retarget(command, target):
+    labware, slot, well, wells = target
+    return replace(command, labware=labware, slot=slot, well=well, wells=wells)
+
+
+def _neighbours(located, first, last):
+    """Positions of the located commands just before ``first`` and just after ``last``."""
+    before = after = None
+    for index, position in located:
+        if index < first:
+            before = position
+        elif index > last:
+            after = position
+            break
+    return before, after
+
+
+def _order(path, free, targets, cost):
+    """Indexes into ``targets`` for the ``free`` entries of ``path``, minimizing the path cost.
+
+    ``path`` is the run's position sequence with its fixed positions (the
+    sources, and the neighbours at either end) filled in.
+    """
+    remaining = list(range(len(targets)))
+    greedy = []
+    previous = None
+    for i, position in enumerate(path):
+        if i not in free:
+            previous = position
+            continue
+        choice = min(remaining, key=lambda t: cost(previous, targets[t]))
+        remaining.remove(choice)
+        greedy.append(choice)
+        previous = targets[choice]
+
+    best_cost, best = None, None
+    for start in (list(range(len(targets))), greedy):
+        filled = list(path)
+        assignment = _improve(filled, free, targets, start, cost)
+        value = sum(cost(a, b) for a, b in zip(filled, filled[1:]))
+        if best_cost is None or value < best_cost - 1e-9:
+            best_cost, best = value, assignment
+    return best
+
+
+def _improve(path, free, targets, assignment, cost):
+    """Pairwise swaps and reversals of consecutive free entries until neither helps.
+
+    ``path`` is filled in place with the final assignment.
+    """
+    free = sorted(free)
+    assignment = list(assignment)
+    for i, target in zip(free, assignment):
+        path[i] = targets[target]
+
+    def edges(starts):
+        return sum(cost(path[i], path[i + 1]) for i in set(starts) if 0 <= i < len(path) - 1)
+
+    improved = True
+    while improved:
+        improved = False
+        for a in range(len(free)):
+            for b in range(a + 1, len(free)):
+                i, j = free[a], free[b]
+                touched = (i - 1, i, j - 1, j)
+                before = edges(touched)
+                path[i], path[j] = path[j], path[i]
+                if edges(touched) < before - 1e-9:
+                    assignment[a], assignment[b] = assignment[b], assignment[a]
+                    improved = True
+                    continue
+                path[i], path[j] = path[j], path[i]
+                if j - i != b - a:
+                    continue  # not one stretch of consecutive dispenses
+                before = edges((i - 1, j))
+                path[i:j + 1] = path[i:j + 1][::-1]
+                if edges((i - 1, j)) < before - 1e-9:
+                    assignment[a:b + 1] = assignment[a:b + 1][::-1]
+                    improved = True
+                else:
+                    path[i:j + 1] = path[i:j + 1][::-1]
+    return assignment
+
+
+def optimize_dispenses(commands, time_model=None):
+    """Copy of ``commands`` with the dispense targets of each ``dispense_runs`` run reordered."""
+    time_model = time_model or TimeModel()
+    commands = list(commands)
+    located = positions(commands)
+    position_of = dict(located)
+    for run in dispense_runs(commands):
+        dispenses = run.dispenses(commands)
+        before, after = _neighbours(located, run.commands[0], run.commands[-1])
+        path = [before] + [position_of[index] for index in run.commands] + [after]
+        free = {k for k, index in enumerate(run.commands, 1) if index in dispenses}
+        targets = [position_of[index] for index in dispenses]
+        order = _order(path, free, targets, time_model.move)
+        originals = [_target(commands[index]) for index in dispenses]
+        for index, target in zip(dispenses, order):
+            commands[index] = _retarget(commands[index], originals[target])
+    return commands
+
+
+def optimize_tips(commands, time_model=None):
+    """Copy of ``commands`` with each pick-up taking the cheapest rack column left.
+
+    Pick-ups only trade columns with pick-ups of the same pipette and tip
+    count, so the run uses the same tips in a different order. The original
+    order is kept unless the new one is faster.
+    """
+    time_model = time_model or TimeModel()
+    original = commands
+    commands = list(commands)
+    located = positions(commands)
+    position_of = dict(located)
+    deck = Deck()
+    pools = {}
+    for index, command in enumerate(commands):
+        deck.update(command)
+        if command.kind == "pick_up_tip":
+            key = (command.pipette, len(command.wells))
+            pools.setdefault(key, []).append((_target(command), deck.position(command)))
+    for index, command in enumerate(commands):
+        if command.kind != "pick_up_tip":
+            continue
+        pool = pools[(command.pipette, len(command.wells))]
+        before, after = _neighbours(located, index, index)
+        # The pool is in original order, so ties keep the original column.
+        choice = min(range(len(pool)), key=lambda k: time_model.move(before, pool[k][1])
+                     + time_model.move(pool[k][1], after))
+        target, position = pool.pop(choice)
+        commands[index] = _retarget(command, target)
+        position_of[index] = position
+        located = [(i, position_of[i]) for i, _ in located]
+    # Greedy choices can trade a cheap pick-up now for a dear one later.
+    if travel(commands, time_model)[1] < travel(original, time_model)[1] - 1e-9:
+        return commands
+    return list(original)
+
+
+def optimize(commands, time_model=None):
+    """Dispense order, then tip pick-ups, reordered to minimize gantry time."""
+    return optimize_tips(optimize_dispenses(commands, time_model), time_model)
+
+
+def report(commands, time_model=None):
+    """Lines comparing the travel of the original and the reordered run."""
+    time_model = time_model or TimeModel()
+    lines = []
+    original = travel(commands, time_model)
+    lines.append(f"gantry travel: {original[0] / 1000:.2f} m, {format_duration(original[1])} moving "
+                 f"({len(moves(commands, time_model))} located commands)")
+    runs = dispense_runs(commands)
+    dispensed = optimize_dispenses(commands, time_model)
+    optimized = optimize_tips(dispensed, time_model)
+    stages = [
+        (f"dispense order ({len(runs)} run(s), "
+         f"{sum(len(run.dispenses(commands)) for run in runs)} dispenses)", commands, dispensed),
+        (f"tip pick-ups ({sum(command.kind == 'pick_up_tip' for command in commands)})",
+         dispensed, optimized),
+    ]
+    for label, before, after in stages:
+        (d0, s0), (d1, s1) = travel(before, time_model), travel(after, time_model)
+        lines.append(f"{label}: {d0 - d1:.0f} mm, {s0 - s1:.1f} s saved")
+    final = travel(optimized, time_model)
+    saved = original[1] - final[1]
+    lines.append(f"reordered: {final[0] / 1000:.2f} m, {format_duration(final[1])} moving; "
+                 f"{saved:.1f} s ({100 * saved / original[1] if original[1] else 0:.1f}%) saved")
+    for number, ((d0, s0), (d1, s1)) in enumerate(
+            zip(segments(commands, time_model), segments(optimized, time_model))):
+        label = f"after pause {number}" if number else "before the first pause"
+        lines.append(f"  {label}: {d0:.0f} -> {d1:.0f} mm, {s0:.1f} -> {s1:.1f} s")
+    return lines
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    from .flex_sim import DEFAULT_PROTOCOL, load_protocol, parse_params, run_protocol
+
+    parser = argparse.ArgumentParser(description="Gantry travel of a Flex protocol, and a shorter order.")
+    parser.add_argument("protocol", nargs="?", default=DEFAULT_PROTOCOL)
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE")
+    parser.add_argument("--moves", action="store_true",
+                        help="list every move of the reordered run next to the original")
+    args = parser.parse_args(argv)
+
+    result = run_protocol(load_protocol(args.protocol), parse_params(args.param))
+    if result.error is not None:
+        print(f"{args.protocol}: error: {type(result.error).__name__}: {result.error}", file=sys.stderr)
+        sys.exit(1)
+    commands = result.commands
+    if args.moves:
+        optimized = optimize(commands)
+        for before, after in zip(moves(commands), moves(optimized)):
+            old, new = commands[before.index], optimized[after.index]
+            changed = " *" if (old.slot, old.well) != (new.slot, new.well) else ""
+            print(f"{before.index + 1:5d} {old.kind:<12} {old.pipette or '':<6} "
+                  f"{old.slot} {old.well or '':<4} {before.distance:6.0f} mm {before.seconds:5.2f}s"
+                  f" -> {new.slot} {new.well or '':<4} {after.distance:6.0f} mm "
+                  f"{after.seconds:5.2f}s{changed}")
+    print("\n".join(report(commands)))
+
+
+if __name__ == "__main__":
+    main()
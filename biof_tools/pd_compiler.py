@@ -0,0 +1,1090 @@
+"""Compile Protocol Designer command streams into Flex Python protocols.
+
+``lift`` reads an OT-2 Protocol Designer JSON file (through
+``biof_tools.pd_reader``) into a program of transfers and pauses. Explicit
+moves are collapsed on the way in, since the Flex API moves to each well
+itself, and each transfer's blowout and air gaps become settings of its
+liquid class. ``optimise`` then runs the passes:
+
+* ``merge-pauses``: back-to-back operator pauses become one.
+* ``share-tips``: consecutive transfers from the same source well keep one
+  tip, as long as every dispense stays above the liquid already in the
+  destination well, so the tip never carries anything back to the source.
+* ``multi-dispense``: such a tip group, with equal volumes and air gaps that
+  fit the pipette's largest tip at least twice, becomes
+  aspirate-once/dispense-many with a disposal volume. Air gaps are kept, and
+  tips are sized after merging, so the group may move to a larger tip.
+
+``emit`` writes the program as a Flex script laid out like
+``Semi-automated_E.coli_Transformation_thermoblock.py``. Runs of transfers
+with the same settings become one ``transfer_with_liquid_class`` call.
+``compile_file`` also replays the original commands and runs the compiled
+script through ``biof_tools.flex_sim`` for the before/after report.
+
+OT-2 slots map to the Flex slot in the same place (1 -> D1 ... 11 -> A2).
+The fixed trash becomes a trash bin in A3. GEN2 pipettes become the Flex
+pipette with the same channel count, with the smallest Flex tip that holds
+each transfer.
+
+    python -m biof_tools.pd_compiler "Hamilton_Robotic_Protocols/Transformation_Spreading_Protocol_Hamilton/Transformation Spread to 6 Well Plates.json" -o spread_flex.py
+"""
+
+from collections import Counter
+from dataclasses import dataclass, field, replace
+import datetime
+import itertools
+import json
+import math
+import os
+import re
+import tempfile
+
+from . import flex_sim
+from .liquid_classes import default_library
+from .pd_reader import ProtocolFile
+
+OT2_TO_FLEX_SLOT = {
+    "1": "D1", "2": "D2", "3": "D3",
+    "4": "C1", "5": "C2", "6": "C3",
+    "7": "B1", "8": "B2", "9": "B3",
+    "10": "A1", "11": "A2", "12": "A3",
+}
+FLEX_TRASH_SLOT = "A3"
+
+# OT-2 pipette -> Flex pipette with the same channel count.
+FLEX_PIPETTES = {
+    "p20_single_gen2": "flex_1channel_50",
+    "p300_single_gen2": "flex_1channel_1000",
+    "p1000_single_gen2": "flex_1channel_1000",
+    "p20_multi_gen2": "flex_8channel_50",
+    "p300_multi_gen2": "flex_8channel_1000",
+}
+# Flex tip racks by tip volume, smallest first.
+FLEX_TIPRACKS = (
+    (50, "opentrons_flex_96_tiprack_50ul"),
+    (200, "opentrons_flex_96_tiprack_200ul"),
+    (1000, "opentrons_flex_96_tiprack_1000ul"),
+)
+
+PASSES = ("merge-pauses", "share-tips", "multi-dispense")
+MULTI_DISPENSE_DISPOSAL = 5
+# A dispense counts as non-contact when it is at least this far (mm) above the liquid surface.
+CONTACT_MARGIN = 1.0
+
+_POSITION_REFERENCES = {"bottom": "well-bottom", "top": "well-top", "center": "well-center"}
+_SLOT_REFERENCE = re.compile(r"\b(position|slot)(\s+)(1[0-2]|[1-9])\b", re.IGNORECASE)
+_TIP_REFERENCE = re.compile(r"\b(\d+)(\s*[u\u00b5]l\s+(?:filter\s+)?tip)", re.IGNORECASE)
+
+
+class CompileError(ValueError):
+    """Raised for Protocol Designer content the compiler cannot translate."""
+
+
+@dataclass(frozen=True)
+class Motion:
+    """Where and how fast a liquid-handling command runs (``origin`` is the PD well origin)."""
+
+    flow_rate: float
+    origin: str = "bottom"
+    z: float = 0.0
+
+
+@dataclass
+class Op:
+    """One Protocol Designer command, reduced to what the compiler needs."""
+
+    kind: str
+    index: int
+    pipette: str = None
+    labware: str = None
+    well: str = None
+    volume: float = 0.0
+    motion: Motion = None
+    message: str = None
+
+
+@dataclass
+class Transfer:
+    """One aspirate and its dispenses; a single dest unless it is a multi-dispense."""
+
+    pipette: str
+    tip: int
+    source: tuple
+    aspirate: Motion
+    volume: float = 0.0
+    dests: list = field(default_factory=list)
+    dispense: Motion = None
+    blowout: tuple = None  # (location, Motion)
+    aspirate_air_gap: float = 0.0
+    dispense_air_gap: float = 0.0
+    disposal: float = 0.0
+
+    @property
+    def multi(self):
+        return len(self.dests) > 1
+
+    def settings(self):
+        return (self.aspirate, self.dispense, self.blowout, self.aspirate_air_gap,
+                self.dispense_air_gap, self.disposal, self.multi)
+
+
+@dataclass
+class Pause:
+    message: str
+    seconds: float = None  # a timed delay rather than a wait for the operator
+
+
+@dataclass
+class Labware:
+    key: str
+    uri: str
+    label: str
+    ot2_slot: str
+    definition: dict
+
+    @property
+    def namespace(self):
+        return self.uri.split("/")[0]
+
+    @property
+    def load_name(self):
+        return self.uri.split("/")[1]
+
+    @property
+    def version(self):
+        return int(self.uri.split("/")[2])
+
+    @property
+    def is_trash(self):
+        return self.definition["metadata"].get("displayCategory") == "trash"
+
+    @property
+    def is_tiprack(self):
+        return self.definition["parameters"].get("isTiprack", False)
+
+    @property
+    def slot(self):
+        return FLEX_TRASH_SLOT if self.is_trash else OT2_TO_FLEX_SLOT[self.ot2_slot]
+
+
+@dataclass
+class Program:
+    path: str
+    metadata: dict
+    pipettes: dict  # id -> {"name": ..., "mount": ...}
+    labware: dict  # key -> Labware, in load order
+    liquids: dict
+    liquid_loads: list  # (liquid id, labware key, {well: volume})
+    ops: list
+    forms: list
+    steps: list = field(default_factory=list)
+    log: Counter = field(default_factory=Counter)
+    source_commands: int = 0
+
+    def well(self, labware, well):
+        return self.labware[labware].definition["wells"][well]
+
+
+# Reading Protocol Designer files
+
+
+def _motion(params):
+    location = params.get("wellLocation", {})
+    return Motion(params.get("flowRate"), location.get("origin", "bottom"),
+                  location.get("offset", {}).get("z", 0.0))
+
+
+def lift(path):
+    """Read a Protocol Designer file into a ``Program`` of liquid-handling ops."""
+    with ProtocolFile(path) as pd:
+        if pd.section("modules"):
+            raise CompileError(f"{path}: modules are not supported")
+        definitions = pd.labware_definitions()
+        labware_names = pd.section("labware", {})
+        pipette_names = pd.section("pipettes", {})
+        design = pd.section("designerApplication", {}).get("data", {})
+        forms = [design["savedStepForms"][step] for step in design.get("orderedStepIds", ())
+                 if step in design.get("savedStepForms", {})]
+        program = Program(path=path, metadata=pd.section("metadata", {}), pipettes={},
+                          labware={}, liquids=pd.section("liquids", {}), liquid_loads=[],
+                          ops=[], forms=forms, source_commands=len(pd))
+        for index, command in enumerate(pd.commands()):
+            kind, params = command["commandType"], command.get("params", {})
+            pipette, labware, well = params.get("pipetteId"), params.get("labwareId"), params.get("wellName")
+            if kind == "loadPipette":
+                program.pipettes[pipette] = {
+                    "name": params.get("pipetteName") or pipette_names[pipette]["name"],
+                    "mount": params["mount"],
+                }
+            elif kind == "loadLabware":
+                location = params["location"]
+                if "slotName" not in location:
+                    raise CompileError(f"{path}: command {index} loads labware off the deck slots")
+                uri = labware_names[labware]["definitionId"]
+                program.labware[labware] = Labware(
+                    key=labware, uri=uri, label=labware_names[labware].get("displayName", uri),
+                    ot2_slot=location["slotName"], definition=definitions[uri],
+                )
+            elif kind == "loadLiquid":
+                program.liquid_loads.append((params["liquidId"], labware, params["volumeByWell"]))
+            elif kind in ("delay", "waitForResume", "waitForDuration"):
+                wait = kind == "waitForResume" or params.get("waitForResume")
+                program.ops.append(Op("pause" if wait else "delay", index,
+                                      message=params.get("message"),
+                                      volume=0.0 if wait else params.get("seconds", 0.0)))
+            elif kind == "pickUpTip":
+                program.ops.append(Op("pick_up_tip", index, pipette, labware, well))
+            elif kind == "aspirate":
+                air_gap = command.get("meta", {}).get("isAirGap")
+                program.ops.append(Op("air_gap" if air_gap else "aspirate", index, pipette, labware,
+                                      well, params["volume"], _motion(params)))
+            elif kind == "dispense":
+                program.ops.append(Op("dispense", index, pipette, labware, well, params["volume"],
+                                      _motion(params)))
+            elif kind in ("blowout", "blowOutInPlace"):
+                program.ops.append(Op("blow_out", index, pipette, labware, well, motion=_motion(params)))
+            elif kind in ("dropTip", "dropTipInPlace"):
+                program.ops.append(Op("drop_tip", index, pipette, labware, well))
+            elif kind in ("moveToWell", "moveToAddressableArea", "moveToAddressableAreaForDropTip"):
+                program.ops.append(Op("move", index, pipette, labware, well))
+            else:
+                raise CompileError(f"{path}: command {index} ({kind}) is not supported")
+    return program
+
+
+# Lowering ops to transfers
+
+
+def _location(program, transfer, labware, well):
+    if labware is None or program.labware[labware].is_trash:
+        return "trash"
+    return "source" if (labware, well) == transfer.source else "destination"
+
+
+def lower(program):
+    """Group ``program.ops`` into ``Transfer`` and ``Pause`` steps."""
+    steps = []
+    tips = itertools.count(1)
+    tip = None
+    transfer = None
+    aspirated = 0.0
+    for op in program.ops:
+        if op.kind == "move":
+            # The Flex API moves to every well it uses, so explicit moves add nothing.
+            program.log["moves collapsed"] += 1
+        elif op.kind in ("pause", "delay"):
+            steps.append(Pause(op.message, op.volume if op.kind == "delay" else None))
+        elif op.kind == "pick_up_tip":
+            tip = next(tips)
+        elif op.kind == "drop_tip":
+            tip = transfer = None
+        elif tip is None:
+            raise CompileError(f"{program.path}: command {op.index} ({op.kind}) runs without a tip")
+        elif op.kind == "aspirate":
+            transfer = Transfer(op.pipette, tip, (op.labware, op.well), op.motion)
+            aspirated = op.volume
+            steps.append(transfer)
+        elif transfer is None:
+            raise CompileError(f"{program.path}: command {op.index} ({op.kind}) has no aspirate before it")
+        elif op.kind == "air_gap":
+            if transfer.dests:
+                transfer.dispense_air_gap = op.volume
+            else:
+                transfer.aspirate_air_gap = op.volume
+            program.log["air gaps folded"] += 1
+        elif op.kind == "dispense":
+            if transfer.dests and op.volume != transfer.volume:
+                raise CompileError(f"{program.path}: command {op.index} dispenses unequal volumes")
+            transfer.dests.append((op.labware, op.well))
+            transfer.volume = op.volume
+            transfer.dispense = op.motion
+        elif op.kind == "blow_out":
+            transfer.blowout = (_location(program, transfer, op.labware, op.well), op.motion)
+            transfer.disposal = max(0.0, aspirated - transfer.volume * len(transfer.dests))
+            program.log["blowouts folded"] += 1
+    program.steps = steps
+    return program
+
+
+# Passes
+
+
+def merge_pauses(program):
+    steps = []
+    for step in program.steps:
+        previous = steps[-1] if steps else None
+        if (isinstance(step, Pause) and isinstance(previous, Pause)
+                and step.seconds is None and previous.seconds is None):
+            steps[-1] = Pause("\n".join(part for part in (previous.message, step.message) if part))
+            program.log["pauses merged"] += 1
+        else:
+            steps.append(step)
+    program.steps = steps
+
+
+def _liquid_height(well, volume):
+    """Liquid height (mm) of ``volume`` uL in a well, treating it as a straight-sided cylinder or box."""
+    if well.get("shape") == "circular":
+        area = math.pi * (well["diameter"] / 2) ** 2
+    else:
+        area = well["xDimension"] * well["yDimension"]
+    return volume / area
+
+
+def _dispense_height(well, motion):
+    offset = {"bottom": 0.0, "center": well["depth"] / 2, "top": well["depth"]}[motion.origin]
+    return offset + motion.z
+
+
+def _non_contact(program):
+    """Return the ids of single-dest transfers whose dispense stays clear of the destination liquid."""
+    volumes = Counter()
+    for liquid, labware, wells in program.liquid_loads:
+        for well, volume in wells.items():
+            volumes[labware, well] += volume
+    clear = set()
+    for step in program.steps:
+        if not isinstance(step, Transfer):
+            continue
+        dest = step.dests[0]
+        well = program.well(*dest)
+        volumes[dest] += step.volume * len(step.dests)
+        if not step.multi and (_dispense_height(well, step.dispense)
+                               >= _liquid_height(well, volumes[dest]) + CONTACT_MARGIN):
+            clear.add(id(step))
+    return clear
+
+
+def share_tips(program):
+    clear = _non_contact(program)
+    tip_counts = Counter(step.tip for step in program.steps if isinstance(step, Transfer))
+    previous = None
+    for step in program.steps:
+        own_tip = isinstance(step, Transfer) and tip_counts[step.tip] == 1 and id(step) in clear
+        if (own_tip and previous is not None and previous.pipette == step.pipette
+                and previous.source == step.source):
+            step.tip = previous.tip
+            program.log["tips saved"] += 1
+        previous = step if own_tip else None
+
+
+def multi_dispense(program):
+    steps = []
+    for step in program.steps:
+        previous = steps[-1] if steps else None
+        if (isinstance(previous, Transfer) and isinstance(step, Transfer) and not step.multi
+                and previous.tip == step.tip and previous.source == step.source
+                and previous.volume == step.volume and previous.aspirate == step.aspirate
+                and previous.dispense == step.dispense
+                and previous.aspirate_air_gap == step.aspirate_air_gap
+                and previous.dispense_air_gap == step.dispense_air_gap
+                and 2 * step.volume + MULTI_DISPENSE_DISPOSAL + step.aspirate_air_gap
+                + step.dispense_air_gap <= largest_tip_volume(program, step.pipette)):
+            if not previous.multi:
+                # The disposal volume, blown out after the last dispense, replaces each blowout.
+                previous = steps[-1] = replace(
+                    previous, dests=list(previous.dests), blowout=None,
+                    disposal=MULTI_DISPENSE_DISPOSAL,
+                )
+            previous.dests.extend(step.dests)
+            program.log["aspirates saved"] += 1
+        else:
+            steps.append(step)
+    program.steps = steps
+
+
+_PASS_FUNCTIONS = {
+    "merge-pauses": merge_pauses,
+    "share-tips": share_tips,
+    "multi-dispense": multi_dispense,
+}
+
+
+def optimise(program, passes=PASSES):
+    for name in passes:
+        _PASS_FUNCTIONS[name](program)
+    return program
+
+
+# Deck and pipette mapping
+
+
+def flex_pipette(program, pipette):
+    name = program.pipettes[pipette]["name"]
+    try:
+        return FLEX_PIPETTES[name]
+    except KeyError:
+        raise CompileError(f"No Flex equivalent for pipette {name!r}") from None
+
+
+def _tip_volume_needed(step):
+    # A multi-dispense is split into tip-sized batches, so it needs room for two dispenses.
+    dispenses = min(len(step.dests), 2)
+    return step.volume * dispenses + step.disposal + step.aspirate_air_gap + step.dispense_air_gap
+
+
+def largest_tip_volume(program, pipette):
+    """Largest Flex tip that ``pipette`` can take."""
+    max_volume = flex_sim.PIPETTES[flex_pipette(program, pipette)][1]
+    return max(volume for volume, _ in FLEX_TIPRACKS if volume <= max_volume)
+
+
+def flex_tip_volume(program, pipette):
+    """Smallest Flex tip that holds every transfer of ``pipette``."""
+    needed = max(
+        (_tip_volume_needed(step) for step in program.steps
+         if isinstance(step, Transfer) and step.pipette == pipette),
+        default=0,
+    )
+    for volume, load_name in FLEX_TIPRACKS:
+        if needed <= volume <= largest_tip_volume(program, pipette):
+            return volume
+    raise CompileError(f"No Flex tip holds {needed} uL for {flex_pipette(program, pipette)}")
+
+
+def flex_tiprack(program, pipette):
+    volume = flex_tip_volume(program, pipette)
+    return dict(FLEX_TIPRACKS)[volume]
+
+
+def _tip_rack_pipettes(program):
+    """``{tip rack labware key: pipette id}`` from the pick-ups in the command stream."""
+    return {op.labware: op.pipette for op in program.ops if op.kind == "pick_up_tip"}
+
+
+def _tip_volumes(program):
+    """``{OT-2 tip volume: Flex tip volume}`` for the tip racks the compiled script loads."""
+    volumes = {}
+    for key, pipette in _tip_rack_pipettes(program).items():
+        ot2 = max(well["totalLiquidVolume"] for well in program.labware[key].definition["wells"].values())
+        volumes.setdefault(_number(ot2), set()).add(flex_tip_volume(program, pipette))
+    return volumes
+
+
+def rewrite_message(program, message):
+    """Replace OT-2 deck slots and tip sizes in an operator message with the Flex ones.
+
+    A tip size is rewritten (``300 ul tip rack`` -> ``200 ul tip rack``) when
+    the racks of that size all become one Flex size; otherwise the message
+    keeps it and the mismatch is counted in ``program.log``.
+    """
+    def flex_slot(match):
+        program.log["slot references rewritten"] += 1
+        return match.group(1) + match.group(2) + OT2_TO_FLEX_SLOT[match.group(3)]
+
+    def flex_tip(match):
+        flex = volumes.get(int(match.group(1)), ())
+        if len(flex) != 1:
+            program.log["tip sizes left unrewritten"] += 1
+            return match.group(0)
+        program.log["tip sizes rewritten"] += 1
+        return f"{next(iter(flex))}{match.group(2)}"
+
+    volumes = _tip_volumes(program)
+    return _TIP_REFERENCE.sub(flex_tip, _SLOT_REFERENCE.sub(flex_slot, message or ""))
+
+
+# Emitting the Flex script
+
+
+def _names(program):
+    """Python variable names for the labware, liquids and pipettes."""
+    names = {}
+    used = set()
+
+    def unique(name):
+        candidate, number = name, 2
+        while candidate in used:
+            candidate, number = f"{name}_{number}", number + 1
+        used.add(candidate)
+        return candidate
+
+    racks = itertools.count(1)
+    for key, labware in program.labware.items():
+        if labware.is_trash:
+            names[key] = unique("trash_bin")
+        elif labware.is_tiprack:
+            names[key] = unique(f"tip_rack_{next(racks)}")
+        else:
+            name = re.sub(r"\W+", "_", labware.label.lower()).strip("_")
+            names[key] = unique(f"_{name}" if name[:1].isdigit() else name or "labware")
+    for liquid, details in program.liquids.items():
+        names["liquid", liquid] = unique(
+            "liq_" + re.sub(r"\W+", "_", details.get("displayName", liquid).lower()).strip("_")
+        )
+    for pipette, details in program.pipettes.items():
+        names[pipette] = unique(f"pipette_{details['mount']}")
+    return names
+
+
+def _tuples(value):
+    """Turn the JSON pairs of volume tables back into tuples, as the protocols write them."""
+    if isinstance(value, dict):
+        return {key: _tuples(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, list) and len(item) == 2 for item in value):
+            return [tuple(item) for item in value]
+        return [_tuples(item) for item in value]
+    return value
+
+
+def _number(value):
+    return int(value) if isinstance(value, float) and value.is_integer() else value
+
+
+
+
+class _Raw(str):
+    """Source text placed in a literal as is."""
+
+
+def _literal(value, indent=0, width=96, used=0):
+    """Format a Python literal the way the protocols lay out their tables.
+
+    ``indent`` is the indentation of the line the literal starts on and ``used``
+    how much of that line is already taken (a dict key, for example).
+    """
+    if isinstance(value, _Raw):
+        return str(value)
+    if isinstance(value, str):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, (bool, type(None))):
+        return repr(value)
+    if isinstance(value, (int, float)):
+        return repr(_number(value))
+    if isinstance(value, tuple):
+        return "(" + ", ".join(_literal(item) for item in value) + ")"
+    if isinstance(value, dict):
+        items = []
+        for key, item in value.items():
+            key = _literal(key)
+            items.append(f"{key}: {_literal(item, indent + 4, width, len(key) + 2)}")
+        open_, close = "{", "}"
+    else:
+        items = [_literal(item, indent + 4, width) for item in value]
+        open_, close = "[", "]"
+    inline = open_ + ", ".join(items) + close
+    if len(inline) + indent + used <= width and "\n" not in inline:
+        return inline
+    pad = " " * (indent + 4)
+    if open_ == "[" and not any(isinstance(item, (dict, list)) for item in value):
+        # Lists of plain values (well names) are filled line by line.
+        lines = [""]
+        for item in items:
+            if lines[-1] and len(pad) + len(lines[-1]) + len(item) + 2 > width:
+                lines.append("")
+            lines[-1] += f"{item}, "
+        return "[\n" + "".join(f"{pad}{line.rstrip()}\n" for line in lines) + " " * indent + "]"
+    return open_ + "\n" + "".join(f"{pad}{item},\n" for item in items) + " " * indent + close
+
+
+def _message(text, indent=4, width=96, used=0):
+    """A string literal, split into adjacent literals at its line breaks when it is long.
+
+    The split form starts and ends with a line break, to sit inside a call's brackets.
+    """
+    text = (text or "").rstrip()
+    literal = _literal(text)
+    lines = text.split("\n")
+    if len(literal) + indent + used <= width or len(lines) == 1:
+        return literal
+    pad = " " * (indent + 4)
+    parts = [line + "\n" for line in lines[:-1]] + lines[-1:]
+    return "\n" + "".join(f"{pad}{_literal(part)}\n" for part in parts) + " " * indent
+
+
+def _position(motion):
+    return {"offset": {"x": 0, "y": 0, "z": _number(motion.z)},
+            "position_reference": _POSITION_REFERENCES[motion.origin]}
+
+
+def _set_position(settings, base, path, motion):
+    section, key = path.split(".")
+    position = _position(motion)
+    if position == base[section][key]:
+        return
+    if position["position_reference"] == base[section][key]["position_reference"]:
+        settings[f"{path}.offset.z"] = position["offset"]["z"]
+    else:
+        settings[path] = position
+
+
+def class_spec(program, transfer):
+    """The ``LIQUID_CLASSES`` entry for a transfer's settings, relative to the shared base."""
+    base = _tuples(default_library().base)
+    spec = {
+        "pipette": flex_pipette(program, transfer.pipette),
+        "tiprack": f"opentrons/{flex_tiprack(program, transfer.pipette)}/1",
+    }
+    dispense = "multi_dispense" if transfer.multi else "dispense"
+    if transfer.multi:
+        spec["sections"] = ["aspirate", "dispense", "multi_dispense"]
+    settings = spec["set"] = {}
+    _set_position(settings, base, "aspirate.aspirate_position", transfer.aspirate)
+    if transfer.aspirate.flow_rate:
+        settings["aspirate.flow_rate_by_volume"] = [(0, _number(transfer.aspirate.flow_rate))]
+    if transfer.aspirate_air_gap:
+        settings["aspirate.retract.air_gap_by_volume"] = [(0, _number(transfer.aspirate_air_gap))]
+    _set_position(settings, base, f"{dispense}.dispense_position", transfer.dispense)
+    if transfer.dispense.flow_rate:
+        settings[f"{dispense}.flow_rate_by_volume"] = [(0, _number(transfer.dispense.flow_rate))]
+    if transfer.multi:
+        settings["multi_dispense.disposal_by_volume"] = [(0, _number(transfer.disposal))]
+        if transfer.dispense_air_gap:
+            settings["multi_dispense.retract.air_gap_by_volume"] = [(0, _number(transfer.dispense_air_gap))]
+        return spec
+    # Protocol Designer has no push-out; its blowout does that job.
+    settings["dispense.push_out_by_volume"] = [(0, 0)]
+    if transfer.blowout is not None:
+        location, motion = transfer.blowout
+        if location != "trash":
+            settings["dispense.retract.end_position"] = _position(motion)
+        settings["dispense.retract.blowout"] = {
+            "enabled": True, "location": location, "flow_rate": _number(motion.flow_rate),
+        }
+    if transfer.dispense_air_gap:
+        settings["dispense.retract.air_gap_by_volume"] = [(0, _number(transfer.dispense_air_gap))]
+    return spec
+
+
+def calls(program):
+    """Group the steps into API calls: ``("pause", [Pause])`` or ``("transfer", [Transfer, ...])``."""
+    tip_counts = Counter(step.tip for step in program.steps if isinstance(step, Transfer))
+
+    def key(step):
+        if isinstance(step, Pause) or step.multi:
+            # A distribute call takes a single source, so each multi-dispense is its own call.
+            return ("pause" if isinstance(step, Pause) else "distribute", id(step))
+        tip = step.tip if tip_counts[step.tip] > 1 else "own"
+        return ("transfer", step.pipette, step.source[0], step.dests[0][0], step.volume,
+                step.settings(), tip)
+
+    return [(group[0], list(steps)) for group, steps in itertools.groupby(program.steps, key)]
+
+
+def _step_name(program, kind, steps):
+    if kind == "pause":
+        names = [form["stepName"] for form in program.forms
+                 if form.get("stepType") == "pause" and form.get("pauseMessage")
+                 and form["pauseMessage"] in (steps[0].message or "")]
+        return " + ".join(names) or "pause"
+    sources = {step.source[1] for step in steps}
+    for form in program.forms:
+        if (form.get("stepType") == "moveLiquid"
+                and form.get("aspirate_labware") == steps[0].source[0]
+                and form.get("dispense_labware") == steps[0].dests[0][0]
+                and sources <= set(form.get("aspirate_wells", ()))):
+            return form.get("stepName")
+    return (f"{program.labware[steps[0].source[0]].label} to "
+            f"{program.labware[steps[0].dests[0][0]].label}")
+
+
+def _wells(names, locations):
+    if len(locations) == 1:
+        return f'{names[locations[0][0]]}["{locations[0][1]}"]'
+    if len({labware for labware, _ in locations}) == 1:
+        wells = _literal([well for _, well in locations], 8)
+        return f"[{names[locations[0][0]]}[well] for well in {wells}]"
+    return _literal([_Raw(f'{names[labware]}["{well}"]') for labware, well in locations], 8)
+
+
+def _timestamp(value):
+    if isinstance(value, (int, float)):
+        moment = datetime.datetime.fromtimestamp(value / 1000, tz=datetime.timezone.utc)
+        return moment.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    return value
+
+
+_HELPERS = '''
+
+def _liquid_class_properties(name, **params):
+    spec = LIQUID_CLASSES[name]
+    sections = {
+        section: copy.deepcopy(LIQUID_CLASS_BASE[section])
+        for section in spec.get("sections", ("aspirate", "dispense"))
+    }
+    for path, value in spec["set"].items():
+        *parents, leaf = path.split(".")
+        target = sections
+        for key in parents:
+            target = target[key]
+        target[leaf] = copy.deepcopy(value)
+    for section in sections.values():
+        _fill_params(section, params)
+    return {spec["pipette"]: {spec["tiprack"]: sections}}
+
+
+def _fill_params(properties, params):
+    for key, value in properties.items():
+        if isinstance(value, dict):
+            _fill_params(value, params)
+        elif isinstance(value, str) and value.startswith("$"):
+            properties[key] = params[value[1:]]
+
+'''
+
+
+def emit(program):
+    """Return the Flex protocol source for ``program``."""
+    names = _names(program)
+    racks = _tip_rack_pipettes(program)
+    custom = sorted({item.uri for item in program.labware.values() if item.namespace != "opentrons"})
+    grouped = calls(program)
+
+    classes = {}
+    call_classes = []
+    for number, (kind, steps) in enumerate(grouped, start=1):
+        if kind == "pause":
+            call_classes.append(None)
+            continue
+        spec = class_spec(program, steps[0])
+        for name, existing in classes.items():
+            if existing == spec:
+                break
+        else:
+            name = f"{kind}_step_{number}"
+            classes[name] = spec
+        call_classes.append(name)
+
+    metadata = {
+        "protocolName": program.metadata.get("protocolName") or os.path.basename(program.path),
+        "author": program.metadata.get("author"),
+        "description": program.metadata.get("description"),
+        "created": _timestamp(program.metadata.get("created")),
+        "lastModified": _timestamp(program.metadata.get("lastModified")),
+        "source": "biof_tools.pd_compiler",
+    }
+    out = [
+        "# -*- coding: utf-8 -*-",
+        '"""',
+        f"Compiled from {os.path.basename(program.path)} by biof_tools.pd_compiler.",
+    ]
+    if custom:
+        out += ["", "Import these custom labware definitions into the Opentrons App first:"]
+        out += [f"    {uri}" for uri in custom]
+    out += [
+        '"""',
+        "",
+        "import copy",
+        "from opentrons import protocol_api",
+        "",
+        "metadata = " + _literal({key: value for key, value in metadata.items() if value}),
+        "",
+        'requirements = {"robotType": "Flex", "apiLevel": "2.24"}',
+        "",
+        "# Liquid classes: shared base sections plus the settings each class changes (dotted paths).",
+        "# The base is the one in biof_tools/data/liquid_classes.json; each class carries the",
+        "# aspirate, dispense, blowout and air gap settings of its Protocol Designer step.",
+        "LIQUID_CLASS_BASE = " + _literal(_tuples(default_library().base)),
+        "",
+        "LIQUID_CLASSES = " + _literal(classes),
+        _HELPERS,
+        "def run(protocol: protocol_api.ProtocolContext) -> None:",
+        "    # Load Labware:",
+    ]
+    for key, item in program.labware.items():
+        if item.is_trash:
+            continue
+        if item.is_tiprack:
+            if key not in racks:
+                continue
+            load = [f'"{flex_tiprack(program, racks[key])}"', f'location="{item.slot}"',
+                    'namespace="opentrons"', "version=1"]
+        else:
+            load = [_literal(item.load_name), f'location="{item.slot}"', f"label={_literal(item.label)}",
+                    f"namespace={_literal(item.namespace)}", f"version={item.version}"]
+        out.append(f"    {names[key]} = protocol.load_labware(")
+        out += [f"        {argument}," for argument in load]
+        out.append("    )")
+
+    out += ["", "    # Load Pipettes:"]
+    for pipette, details in program.pipettes.items():
+        tip_racks = ", ".join(names[key] for key, owner in racks.items() if owner == pipette)
+        out += [
+            f"    {names[pipette]} = protocol.load_instrument(",
+            f'        "{flex_pipette(program, pipette)}", "{details["mount"]}", tip_racks=[{tip_racks}],',
+            "    )",
+        ]
+    trash = next((names[key] for key, item in program.labware.items() if item.is_trash), "trash_bin")
+    out += [
+        "",
+        "    # Load Trash Bin:",
+        f'    {trash} = protocol.load_trash_bin("{FLEX_TRASH_SLOT}")',
+        "",
+        "    # Define Liquid Classes: each (class, parameters) pair is defined once per run and reused.",
+        "    liquid_classes = {}",
+        "",
+        "    def get_liquid_class(name, **params):",
+        "        key = (name, tuple(sorted(params.items())))",
+        "        if key not in liquid_classes:",
+        "            liquid_classes[key] = protocol.define_liquid_class(",
+        "                name=name, properties=_liquid_class_properties(name, **params)",
+        "            )",
+        "        return liquid_classes[key]",
+    ]
+
+    if program.liquids:
+        out += ["", "    # Define Liquids:"]
+        for liquid, details in program.liquids.items():
+            out.append(f"    {names['liquid', liquid]} = protocol.define_liquid(")
+            out.append(f"        {_literal(details.get('displayName', liquid))},")
+            if details.get("description"):
+                out.append(f"        description={_literal(details['description'])},")
+            if details.get("displayColor"):
+                out.append(f"        display_color={_literal(details['displayColor'])},")
+            out.append("    )")
+    if program.liquid_loads:
+        out += ["", "    # Load Liquids:"]
+        for liquid, labware, wells in program.liquid_loads:
+            by_volume = {}
+            for well, volume in wells.items():
+                by_volume.setdefault(volume, []).append(well)
+            for volume, volume_wells in by_volume.items():
+                out += [
+                    f"    {names[labware]}.load_liquid(",
+                    f"        wells={_literal(volume_wells, 8)},",
+                    f"        liquid={names['liquid', liquid]},",
+                    f"        volume={_literal(volume)},",
+                    "    )",
+                ]
+
+    out += ["", "    # PROTOCOL STEPS"]
+    previous_tip = None
+    for number, ((kind, steps), class_name) in enumerate(zip(grouped, call_classes), start=1):
+        out.append(f"    # Step {number}: {_step_name(program, kind, steps)}")
+        if kind == "pause":
+            pause = steps[0]
+            message = rewrite_message(program, pause.message)
+            if pause.seconds is None:
+                out += [f"    protocol.pause({_message(message, used=len('protocol.pause()'))})", ""]
+            else:
+                out += [
+                    "    protocol.delay(",
+                    f"        seconds={_literal(pause.seconds)},",
+                    f"        msg={_message(message, 8, used=len('msg=,'))},",
+                    "    )",
+                    "",
+                ]
+            previous_tip = None
+            continue
+        first = steps[0]
+        following = grouped[number][1][0] if number < len(grouped) else None
+        shared = len({step.tip for step in steps}) == 1
+        if shared:
+            new_tip = "never" if first.tip == previous_tip else "once"
+        else:
+            new_tip = "always"
+        keep = isinstance(following, Transfer) and following.tip == steps[-1].tip
+        previous_tip = steps[-1].tip
+        if kind == "distribute":
+            method = "distribute_with_liquid_class"
+            source = _wells(names, [first.source])
+            dests = _wells(names, first.dests)
+        else:
+            method = "transfer_with_liquid_class"
+            sources = [step.source for step in steps]
+            source = _wells(names, sources[:1] if len(set(sources)) == 1 else sources)
+            dests = _wells(names, [step.dests[0] for step in steps])
+        out += [
+            f"    {names[first.pipette]}.{method}(",
+            f"        volume={_literal(first.volume)},",
+            f"        source={source},",
+            f"        dest={dests},",
+            f'        new_tip="{new_tip}",',
+            f"        trash_location={trash},",
+        ]
+        if kind == "transfer":
+            out.append("        group_wells=False,")
+        out += [
+            f"        keep_last_tip={keep},",
+            f'        liquid_class=get_liquid_class("{class_name}"),',
+            "    )",
+            "",
+        ]
+    return "\n".join(out).rstrip() + "\n"
+
+
+# Before/after
+
+
+def _register_labware(program):
+    for item in program.labware.values():
+        if not (item.is_trash or item.is_tiprack) and item.load_name not in flex_sim.LABWARE:
+            flex_sim.register_definition(item.definition)
+
+
+def replay(program, time_model=None):
+    """Run the Protocol Designer commands one for one on the simulated Flex deck."""
+    _register_labware(program)
+    context = flex_sim.SimProtocolContext({}, time_model)
+    result = flex_sim.SimResult(params={}, commands=context.commands)
+    racks = _tip_rack_pipettes(program)
+    trash = context.load_trash_bin(FLEX_TRASH_SLOT)
+    labware = {}
+    for key, item in program.labware.items():
+        if item.is_trash:
+            labware[key] = trash
+        elif item.is_tiprack:
+            if key in racks:
+                labware[key] = context.load_labware(flex_tiprack(program, racks[key]), item.slot)
+        else:
+            labware[key] = context.load_labware(item.load_name, item.slot, item.label,
+                                                item.namespace, item.version)
+    pipettes = {
+        pipette: context.load_instrument(
+            flex_pipette(program, pipette), details["mount"],
+            tip_racks=[labware[key] for key, owner in racks.items() if owner == pipette],
+        )
+        for pipette, details in program.pipettes.items()
+    }
+    default = context.time_model.default_flow_rate
+    for op in program.ops:
+        pipette = pipettes.get(op.pipette)
+        target = labware.get(op.labware)
+        if op.well is not None and isinstance(target, flex_sim.SimLabware):
+            target = target[op.well]
+        else:
+            target = None
+        rate = (op.motion.flow_rate or default) / default if op.motion else 1.0
+        if op.kind == "pause":
+            context.pause(op.message)
+        elif op.kind == "delay":
+            context.delay(seconds=op.volume, msg=op.message)
+        elif op.kind == "pick_up_tip":
+            pipette.pick_up_tip(target)
+        elif op.kind == "aspirate":
+            pipette.aspirate(op.volume, target, rate=rate)
+        elif op.kind == "air_gap":
+            pipette.air_gap(op.volume)
+        elif op.kind == "dispense":
+            pipette.dispense(op.volume, target, rate=rate)
+        elif op.kind == "blow_out":
+            pipette.blow_out(target)
+        elif op.kind == "drop_tip":
+            pipette.drop_tip(target or trash)
+        elif op.kind == "move" and target is not None:
+            pipette.move_to(target)
+    return result
+
+
+def run_script(script, time_model=None):
+    """Simulate protocol source text with ``biof_tools.flex_sim``."""
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False, encoding="utf-8") as fh:
+        fh.write(script)
+    try:
+        return flex_sim.run_protocol(flex_sim.load_protocol(fh.name), time_model=time_model)
+    finally:
+        os.unlink(fh.name)
+
+
+@dataclass
+class Compiled:
+    program: Program
+    script: str
+    before: flex_sim.SimResult = None
+    after: flex_sim.SimResult = None
+
+
+def compile_file(path, passes=PASSES, simulate=True, time_model=None):
+    """Compile a Protocol Designer file; with ``simulate``, cost it before and after."""
+    program = lower(lift(path))
+    before = None
+    if simulate:
+        before = replay(program, time_model)
+    optimise(program, passes)
+    script = emit(program)
+    after = run_script(script, time_model) if simulate else None
+    return Compiled(program, script, before, after)
+
+
+def _robot_counts(result):
+    return Counter({kind: count for kind, count in result.counts().items()
+                    if not kind.startswith("load_")})
+
+
+def report(compiled):
+    """Return the before/after lines for one compiled file."""
+    program = compiled.program
+    log = program.log
+    transfers = [step for step in program.steps if isinstance(step, Transfer)]
+    lines = [
+        f"{program.metadata.get('protocolName') or program.path}: "
+        f"{program.source_commands} Protocol Designer commands -> {len(calls(program))} API calls",
+        f"  folded into liquid classes: {log['blowouts folded']} blowouts, "
+        f"{log['air gaps folded']} air gaps; {log['moves collapsed']} explicit moves collapsed",
+        f"  merge-pauses: {log['pauses merged']} pause(s) merged; "
+        f"{log['slot references rewritten']} OT-2 slot reference(s) and {log['tip sizes rewritten']} "
+        f"tip size(s) rewritten in messages",
+        f"  share-tips: {log['tips saved']} tip(s) saved; "
+        f"multi-dispense: {log['aspirates saved']} aspirate(s) saved",
+    ]
+    if log["tip sizes left unrewritten"]:
+        lines.append(f"  warning: {log['tip sizes left unrewritten']} tip size(s) in messages match no "
+                     "single Flex tip rack; check them against the script")
+    sources = Counter(step.source for step in transfers)
+    if transfers and not (log["tips saved"] or log["aspirates saved"]) and max(sources.values()) == 1:
+        lines.append(f"  every one of the {len(transfers)} transfers has its own source well, "
+                     "so no tip or aspirate can be shared")
+    if compiled.before is None or compiled.after is None:
+        return lines
+    for label, result in (("before", compiled.before), ("after", compiled.after)):
+        if result.error is not None:
+            lines.append(f"{label}: error: {type(result.error).__name__}: {result.error}")
+    before, after = _robot_counts(compiled.before), _robot_counts(compiled.after)
+    lines.append(f"robot commands: {sum(before.values())} -> {sum(after.values())}")
+    for kind in sorted(before.keys() | after.keys()):
+        if before[kind] != after[kind]:
+            lines.append(f"  {kind}: {before[kind]} -> {after[kind]}")
+    tips_before, tips_after = sum(compiled.before.tips_used().values()), sum(compiled.after.tips_used().values())
+    lines.append(f"tips: {tips_before} -> {tips_after}")
+    lines.append(f"estimated run time: {flex_sim.format_duration(compiled.before.seconds)} -> "
+                 f"{flex_sim.format_duration(compiled.after.seconds)} (operator wait "
+                 f"{flex_sim.format_duration(compiled.before.wait_seconds())} -> "
+                 f"{flex_sim.format_duration(compiled.after.wait_seconds())})")
+    if compiled.before.seconds:
+        comparison = flex_sim.compare(compiled.before, compiled.after)
+        # Segments only line up when both runs have the same pauses.
+        same_pauses = len(compiled.before.segments()) == len(compiled.after.segments())
+        lines += comparison if same_pauses else comparison[:1]
+    return lines
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Compile Protocol Designer JSON into a Flex protocol.")
+    parser.add_argument("path")
+    parser.add_argument("-o", "--output", help="write the Flex protocol here; custom labware "
+                        "definitions are written next to it")
+    parser.add_argument("--passes", default=",".join(PASSES),
+                        help=f"comma-separated passes to run (default {','.join(PASSES)}; '' for none)")
+    args = parser.parse_args(argv)
+
+    passes = [name for name in args.passes.split(",") if name]
+    unknown = set(passes) - set(PASSES)
+    if unknown:
+        parser.error(f"unknown pass(es): {', '.join(sorted(unknown))}")
+    try:
+        compiled = compile_file(args.path, passes)
+    except (OSError, CompileError) as exc:
+        print(f"{args.path}: error: {exc}", file=sys.stderr)
+        sys.exit(1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            fh.write(compiled.script)
+        directory = os.path.dirname(os.path.abspath(args.output))
+        for item in compiled.program.labware.values():
+            if item.namespace != "opentrons":
+                definition_path = os.path.join(directory, f"{item.load_name}.json")
+                with open(definition_path, "w", encoding="utf-8") as fh:
+                    json.dump(item.definition, fh, indent=2)
+                print(f"wrote {definition_path}")
+        print(f"wrote {args.output}")
+    print("\n".join(report(compiled)))
+    if compiled.after is not None and compiled.after.error is not None:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,586 @@
+"""Append-only columnar store of protocol command streams, for queries across many runs.
+
+Protocol Designer exports, Opentrons analysis or run-log JSON (a
+``commands`` or ``data`` array of ``commandType``/``params`` objects) and
+Flex Python protocols (run through ``biof_tools.flex_sim``) are ingested
+in bulk. ``Store`` keeps its tables as one file of raw native-endian
+values per column:
+
+* ``runs`` - one row per ingested run: protocol, version, source file,
+  ingest key, time, command count, tips and samples
+* ``commands`` - one row per command: run, ``commandType``, labware ID,
+  labware definition (``opentrons/nest_12_reservoir_15ml/1``), well,
+  pipette, volume and flow rate
+* ``liquid`` - volume and command count per run and slot, summed when the
+  run is ingested. Volumes count every channel (an 8-channel aspirate of
+  20 uL from a reservoir well draws 160 uL), all against the well the
+  command names, and mixing is left out: an aspirate that the same
+  pipette dispenses straight back into the same well moves nothing. A
+  slot is one ``(commandType, definition, well)`` of ``slots``, such as
+  aspirates from A1 of ``nest_12_reservoir_15ml``.
+  Each append writes its rows as one segment (``segments``) sorted by
+  slot, so a query bisects to the slots it wants instead of scanning.
+
+Repeated text (command types, labware and definition IDs, wells, pipettes)
+is coded through one string pool, ``strings.jsonl``. Opening a store
+memory-maps the column files, so nothing is parsed again. Appends go to
+the end of each file, and ``manifest.json`` is replaced last with the new
+row counts. A crash mid-append therefore leaves the store as it was; the
+next append cuts the partial rows off first.
+
+A run's version is its ``metadata.version`` when the file has one, and
+otherwise the first 12 hex digits of its content hash. Its time is taken
+from ``createdAt``, Protocol Designer's ``lastModified`` or the file's
+modification time, in that order. Samples are counted as the most wells
+touched in any one labware, where a multi-channel pipette covers one well
+per channel. Tips are counted per channel picked up.
+
+Ingest in batches rather than one run at a time: every ``add`` writes
+one segment, and queries visit each segment.
+
+    python -m biof_tools.run_store add history/ exports/*.json "Opentrons Flex/"*.py
+    python -m biof_tools.run_store volume history/ --labware reservoir --well A1 --since 2026-09-01
+    python -m biof_tools.run_store tips history/ --by version
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import compress
+import json
+import mmap
+import os
+import sys
+
+TABLES = {
+    "runs": {
+        "protocol": "I", "version": "I", "source": "I", "key": "I", "time": "d",
+        "commands": "I", "tips": "I", "samples": "I",
+    },
+    "commands": {
+        "run": "I", "type": "I", "labware": "I", "definition": "I", "well": "I", "pipette": "I",
+        "volume": "f", "flow_rate": "f",
+    },
+    "slots": {"type": "I", "definition": "I", "well": "I"},
+    "liquid": {"slot": "I", "run": "I", "volume": "d", "count": "I"},
+    "segments": {"start": "Q", "rows": "I"},
+}
+LIQUID_TYPES = ("aspirate", "dispense")
+NAN = float("nan")
+
+# flex_sim command kinds as Opentrons ``commandType``s.
+FLEX_COMMAND_TYPES = {
+    "aspirate": "aspirate", "dispense": "dispense", "pick_up_tip": "pickUpTip",
+    "drop_tip": "dropTip", "blow_out": "blowout", "air_gap": "airGapInPlace",
+    "move": "moveToWell", "pause": "waitForResume", "delay": "waitForDuration",
+    "move_labware": "moveLabware", "comment": "comment", "load_labware": "loadLabware",
+    "load_module": "loadModule", "load_instrument": "loadPipette", "load_liquid": "loadLiquid",
+    "set_temperature": "temperatureModule/setTargetTemperature",
+    "start_set_temperature": "temperatureModule/setTargetTemperature",
+    "await_temperature": "temperatureModule/waitForTemperature",
+}
+
+
+class StoreFormatError(ValueError):
+    """Raised when a store directory is damaged beyond what an append can repair."""
+
+
+def _channels(pipette_name):
+    name = pipette_name or ""
+    if "96" in name:
+        return 96
+    return 8 if "multi" in name or "8channel" in name else 1
+
+
+# Reading command streams
+
+
+class RunRecord:
+    """One run's metadata and its commands as plain values, ready to append."""
+
+    def __init__(self, protocol, version, source, key, time):
+        self.protocol = protocol
+        self.version = version
+        self.source = source
+        self.key = key
+        self.time = time
+        self.commands = []  # (type, labware, definition, well, pipette, volume, flow_rate, channels)
+
+    def add(self, command_type, labware=None, definition=None, well=None, pipette=None,
+            volume=NAN, flow_rate=NAN, channels=1):
+        self.commands.append((command_type, labware or "", definition or "", well or "", pipette or "",
+                              NAN if volume is None else volume, NAN if flow_rate is None else flow_rate,
+                              channels))
+
+    def tips(self):
+        return sum(channels for command_type, *_, channels in self.commands if command_type == "pickUpTip")
+
+    def samples(self):
+        """The most wells touched in one labware, a multi-channel pipette covering one per channel."""
+        reached = {}
+        for command_type, labware, _, well, _, _, _, channels in self.commands:
+            if command_type in LIQUID_TYPES and labware and well:
+                reached[labware, well] = max(reached.get((labware, well), 0), channels)
+        per_labware = {}
+        for (labware, _), channels in reached.items():
+            per_labware[labware] = per_labware.get(labware, 0) + channels
+        return max(per_labware.values(), default=0)
+
+    def mixing(self):
+        """Indexes of aspirates dispensed straight back into the same well, and of those dispenses."""
+        last = {}
+        found = set()
+        for index, (command_type, labware, _, well, pipette, *_) in enumerate(self.commands):
+            if command_type == "aspirate":
+                last[pipette] = (index, labware, well)
+            elif command_type == "dispense":
+                previous = last.pop(pipette, None)
+                if previous is not None and previous[1:] == (labware, well):
+                    found.update((previous[0], index))
+            elif command_type in ("dropTip", "pickUpTip", "blowout"):
+                last.pop(pipette, None)
+        return found
+
+
+def _timestamp(value):
+    """Seconds since the epoch from an ISO time or a millisecond epoch, or ``None``."""
+    if isinstance(value, (int, float)) and value > 0:
+        return value / 1000 if value > 1e11 else float(value)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+    return None
+
+
+def _record(path, metadata, digest, key, *times):
+    time = next((stamp for stamp in map(_timestamp, times) if stamp is not None), None)
+    return RunRecord(
+        protocol=metadata.get("protocolName") or os.path.splitext(os.path.basename(path))[0],
+        version=str(metadata.get("version") or digest[:12]),
+        source=os.path.basename(path),
+        key=key,
+        time=os.path.getmtime(path) if time is None else time,
+    )
+
+
+def _from_commands(record, commands, labware_definitions=None, pipette_names=None):
+    """Add Opentrons ``commandType``/``params`` commands, resolving labware and pipettes as they load."""
+    definitions = dict(labware_definitions or {})
+    pipettes = dict(pipette_names or {})
+    for command in commands:
+        command_type = command.get("commandType", "")
+        params = command.get("params") or {}
+        result = command.get("result") or {}
+        if command_type == "loadLabware":
+            labware_id = result.get("labwareId") or params.get("labwareId")
+            if params.get("loadName"):
+                definitions[labware_id] = (f"{params.get('namespace', 'opentrons')}/{params['loadName']}/"
+                                           f"{params.get('version', 1)}")
+            elif labware_id and ":" in labware_id:
+                definitions.setdefault(labware_id, labware_id.split(":", 1)[1])
+        elif command_type == "loadPipette":
+            pipette_id = result.get("pipetteId") or params.get("pipetteId")
+            if params.get("pipetteName"):
+                pipettes[pipette_id] = params["pipetteName"]
+        labware = params.get("labwareId")
+        pipette = pipettes.get(params.get("pipetteId"), params.get("pipetteId"))
+        record.add(
+            command_type, labware=labware, definition=definitions.get(labware), well=params.get("wellName"),
+            pipette=pipette, volume=params.get("volume"), flow_rate=params.get("flowRate"),
+            channels=_channels(pipette),
+        )
+    return record
+
+
+def read_protocol_designer(path, digest=None):
+    from .bms_diff import file_digest
+    from .pd_reader import ProtocolFile
+
+    digest = digest or file_digest(path)
+    with ProtocolFile(path) as pd:
+        metadata = pd.section("metadata", {}) or {}
+        record = _record(path, metadata, digest, digest, metadata.get("lastModified"), metadata.get("created"))
+        definitions = {key: value.get("definitionId") for key, value in pd.section("labware", {}).items()}
+        pipettes = {key: value.get("name") for key, value in pd.section("pipettes", {}).items()}
+        return _from_commands(record, pd.commands(), definitions, pipettes)
+
+
+def read_opentrons_json(path, document, digest=None):
+    """An analysis (``commands``) or run log (``data``) exported by the robot software."""
+    from .bms_diff import file_digest
+
+    digest = digest or file_digest(path)
+    if isinstance(document, list):
+        document = {"commands": document}
+    commands = document.get("commands")
+    if commands is None:
+        commands = document.get("data")
+    if not isinstance(commands, list):
+        raise ValueError(f"{path}: no commands array")
+    metadata = document.get("metadata") or {}
+    created = document.get("createdAt") or next(
+        (command.get("createdAt") for command in commands if isinstance(command, dict)), None)
+    return _from_commands(_record(path, metadata, digest, digest, created), commands)
+
+
+def read_flex(path, params=None, digest=None):
+    """A Flex Python protocol, run through ``flex_sim`` with ``params``."""
+    from . import flex_sim
+    from .bms_diff import file_digest
+
+    digest = digest or file_digest(path)
+    protocol = flex_sim.load_protocol(path)
+    resolved = flex_sim.parameter_definitions(protocol).resolve(params)
+    result = flex_sim.run_protocol(protocol, resolved)
+    if result.error is not None:
+        raise ValueError(f"{path}: {type(result.error).__name__}: {result.error}")
+    key = f"{digest} {json.dumps(resolved, sort_keys=True)}"
+    record = _record(path, getattr(protocol, "metadata", {}) or {}, digest, key)
+    load_names = {}
+    pipettes = {}
+    for command in result.commands:
+        if command.kind == "load_labware":
+            load_names[command.labware] = f"opentrons/{command.message}"
+        elif command.kind == "load_instrument":
+            pipettes[command.pipette] = command.message
+        record.add(
+            FLEX_COMMAND_TYPES.get(command.kind, command.kind), labware=command.labware,
+            definition=load_names.get(command.labware), well=command.well,
+            pipette=pipettes.get(command.pipette, command.pipette),
+            volume=command.volume if command.kind in ("aspirate", "dispense", "air_gap") else None,
+            channels=len(command.wells) or 1,
+        )
+    return record
+
+
+def read_run(path, params=None):
+    """``RunRecord`` for a ``.py`` Flex protocol or a Protocol Designer / Opentrons ``.json`` file."""
+    if path.endswith(".py"):
+        return read_flex(path, params)
+    with open(path, encoding="utf-8") as handle:
+        head = handle.read(4096)
+    if '"designerApplication"' in head or '"$otSharedSchema"' in head:
+        return read_protocol_designer(path)
+    with open(path, encoding="utf-8") as handle:
+        return read_opentrons_json(path, json.load(handle))
+
+
+# The store
+
+
+def _view(path, typecode, rows, maps):
+    """The first ``rows`` values of a column file, memory-mapped.
+
+    ``maps`` collects the map and its views, to be released in reverse order.
+    """
+    if not rows:
+        return array(typecode)
+    with open(path, "rb") as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    whole = memoryview(mapped)
+    typed = whole.cast(typecode)
+    view = typed[:rows]
+    maps.extend((mapped, whole, typed, view))
+    return view
+
+
+class Store:
+    """A store directory opened for queries and appends."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._maps = []
+        self.manifest = {"rows": {table: 0 for table in TABLES}, "strings": 0, "string_bytes": 0}
+        manifest_path = os.path.join(directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as handle:
+                self.manifest = json.load(handle)
+        self.strings = []
+        if self.manifest["strings"]:
+            with open(os.path.join(directory, "strings.jsonl"), "rb") as handle:
+                lines = handle.read(self.manifest["string_bytes"]).splitlines()
+            self.strings = [json.loads(line) for line in lines]
+            if len(self.strings) != self.manifest["strings"]:
+                raise StoreFormatError(f"{directory}: string pool does not match the manifest")
+        self._codes = {text: code for code, text in enumerate(self.strings)}
+        self.keys = set()
+        self._map_columns()
+
+    def _map_columns(self):
+        self.close()
+        self.tables = {
+            table: {name: _view(self._column_path(table, name, typecode), typecode,
+                                self.manifest["rows"][table], self._maps)
+                    for name, typecode in columns.items()}
+            for table, columns in TABLES.items()
+        }
+        self.keys = {self.strings[code] for code in self.tables["runs"]["key"]}
+        slots = self.tables["slots"]
+        self.slots = {key: slot for slot, key in enumerate(zip(slots["type"], slots["definition"], slots["well"]))}
+
+    def _column_path(self, table, name, typecode):
+        return os.path.join(self.directory, table, f"{name}.{typecode}")
+
+    def close(self):
+        self.tables = {}
+        for mapped in reversed(self._maps):
+            mapped.close() if isinstance(mapped, mmap.mmap) else mapped.release()
+        self._maps = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.manifest["rows"]["runs"]
+
+    # Appending
+
+    def append(self, records):
+        """Append ``RunRecord``s, skipping any whose key is already stored. Returns the number added."""
+        pending = {table: {name: array(typecode) for name, typecode in columns.items()}
+                   for table, columns in TABLES.items()}
+        new_strings = []
+
+        def code(text):
+            found = self._codes.get(text)
+            if found is None:
+                found = self._codes[text] = len(self.strings) + len(new_strings)
+                new_strings.append(text)
+            return found
+
+        run = self.manifest["rows"]["runs"]
+        new_slots = {}
+        liquid = []
+        added = set()
+        for record in records:
+            if record.key in self.keys or record.key in added:
+                continue
+            added.add(record.key)
+            columns = pending["runs"]
+            for name, value in (("protocol", code(record.protocol)), ("version", code(record.version)),
+                                ("source", code(record.source)), ("key", code(record.key)),
+                                ("time", record.time), ("commands", len(record.commands)),
+                                ("tips", record.tips()), ("samples", record.samples())):
+                columns[name].append(value)
+            columns = pending["commands"]
+            totals = {}
+            mixing = record.mixing()
+            for index, command in enumerate(record.commands):
+                command_type, labware, definition, well, pipette, volume, flow_rate, channels = command
+                row = (code(command_type), code(labware), code(definition), code(well))
+                for name, value in zip(("type", "labware", "definition", "well"), row):
+                    columns[name].append(value)
+                columns["run"].append(run)
+                columns["pipette"].append(code(pipette))
+                columns["volume"].append(volume)
+                columns["flow_rate"].append(flow_rate)
+                if command_type in LIQUID_TYPES and well and volume == volume and index not in mixing:
+                    key = (row[0], row[2], row[3])
+                    slot = self.slots.get(key)
+                    if slot is None:
+                        slot = self.slots[key] = new_slots[key] = len(self.slots)
+                    total = totals.setdefault(slot, [0.0, 0])
+                    total[0] += volume * channels
+                    total[1] += 1
+            liquid.extend((slot, run, volume, count) for slot, (volume, count) in totals.items())
+            run += 1
+        if not added:
+            return 0
+
+        columns = pending["slots"]
+        for key in new_slots:
+            for name, value in zip(("type", "definition", "well"), key):
+                columns[name].append(value)
+        columns = pending["liquid"]
+        for row in sorted(liquid):
+            for name, value in zip(("slot", "run", "volume", "count"), row):
+                columns[name].append(value)
+        pending["segments"]["start"].append(self.manifest["rows"]["liquid"])
+        pending["segments"]["rows"].append(len(liquid))
+
+        self.close()
+        rows = self.manifest["rows"]
+        for table, columns in TABLES.items():
+            os.makedirs(os.path.join(self.directory, table), exist_ok=True)
+            for name, typecode in columns.items():
+                path = self._column_path(table, name, typecode)
+                with open(path, "ab") as handle:
+                    handle.truncate(rows[table] * array(typecode).itemsize)
+                    pending[table][name].tofile(handle)
+        strings_path = os.path.join(self.directory, "strings.jsonl")
+        with open(strings_path, "ab") as handle:
+            handle.truncate(self.manifest["string_bytes"])
+            handle.write(b"".join(json.dumps(text).encode() + b"\n" for text in new_strings))
+            string_bytes = handle.tell()
+        self.strings.extend(new_strings)
+        manifest = {
+            "rows": {table: rows[table] + len(pending[table][next(iter(TABLES[table]))]) for table in TABLES},
+            "strings": len(self.strings),
+            "string_bytes": string_bytes,
+        }
+        manifest_path = os.path.join(self.directory, "manifest.json")
+        partial = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(partial, "w", encoding="utf-8") as handle:
+            json.dump(manifest, handle)
+        os.replace(partial, manifest_path)
+        self.manifest = manifest
+        self._map_columns()
+        return len(added)
+
+    # Queries
+
+    def matching(self, text, exact=False):
+        """Codes of the pooled strings equal to (or, unless ``exact``, containing) ``text``."""
+        if exact:
+            return frozenset({self._codes[text]} if text in self._codes else ())
+        return frozenset(code for code, string in enumerate(self.strings) if text in string)
+
+    def runs_between(self, since=None, until=None):
+        """``bytes`` with a 1 for every run whose time lies in ``[since, until)``."""
+        times = self.tables["runs"]["time"]
+        low = -float("inf") if since is None else since
+        high = float("inf") if until is None else until
+        return bytes(map(lambda time: low <= time < high, times))
+
+    def liquid(self, command_type="aspirate", labware=None, well=None, since=None, until=None):
+        """``(volume, commands, runs)`` moved by ``command_type``, from the per-run ``liquid`` table.
+
+        ``labware`` matches part of a definition ID (``reservoir``,
+        ``opentrons/nest_12_reservoir_15ml``), ``well`` a well name exactly.
+        """
+        definitions = self.matching(labware) if labware is not None else None
+        wanted = sorted(
+            slot for (type_code, definition, well_code), slot in self.slots.items()
+            if self.strings[type_code] == command_type
+            and (definitions is None or definition in definitions)
+            and (well is None or self.strings[well_code] == well)
+        )
+        table = self.tables["liquid"]
+        selected = self.runs_between(since, until) if since is not None or until is not None else None
+        volume = 0.0
+        commands = 0
+        runs = set()
+        for start, rows in zip(self.tables["segments"]["start"], self.tables["segments"]["rows"]):
+            slots = table["slot"][start:start + rows]
+            for slot in wanted:
+                low = bisect_left(slots, slot)
+                high = bisect_right(slots, slot, low)
+                if low == high:
+                    continue
+                span = slice(start + low, start + high)
+                if selected is None:
+                    volume += sum(table["volume"][span])
+                    commands += sum(table["count"][span])
+                    runs.update(table["run"][span])
+                else:
+                    mask = bytes(map(selected.__getitem__, table["run"][span]))
+                    volume += sum(compress(table["volume"][span], mask))
+                    commands += sum(compress(table["count"][span], mask))
+                    runs.update(compress(table["run"][span], mask))
+        return volume, commands, len(runs)
+
+    def tips_per_sample(self, by="version", since=None, until=None):
+        """``{value: (tips, samples, runs)}`` over runs grouped by a ``runs`` text column."""
+        runs = self.tables["runs"]
+        selected = self.runs_between(since, until)
+        groups = {}
+        for key, tips, samples, chosen in zip(runs[by], runs["tips"], runs["samples"], selected):
+            if chosen:
+                group = groups.setdefault(key, [0, 0, 0])
+                group[0] += tips
+                group[1] += samples
+                group[2] += 1
+        return {self.strings[key]: tuple(group) for key, group in groups.items()}
+
+    def count(self, table="commands", by="type"):
+        """Rows of ``table`` per value of the text column ``by``."""
+        return {self.strings[code]: count for code, count in Counter(self.tables[table][by]).most_common()}
+
+
+def _date(text):
+    if text is None:
+        return None
+    stamp = _timestamp(text)
+    if stamp is None:
+        raise ValueError(f"not a date: {text!r}")
+    return stamp
+
+
+def main(argv=None):
+    import argparse
+    import time
+
+    from .flex_sim import parse_params
+
+    parser = argparse.ArgumentParser(description="Columnar history of protocol command streams.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    add = sub.add_parser("add", help="ingest PD exports, Opentrons JSON and Flex protocols")
+    add.add_argument("store")
+    add.add_argument("paths", nargs="+")
+    add.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                     help="runtime parameters for .py protocols")
+    info = sub.add_parser("info", help="runs, commands and command types in the store")
+    info.add_argument("store")
+    volume = sub.add_parser("volume", help="total volume aspirated (or dispensed) across runs")
+    volume.add_argument("store")
+    volume.add_argument("--labware", help="part of a labware or definition ID, e.g. reservoir")
+    volume.add_argument("--well")
+    volume.add_argument("--dispensed", action="store_true")
+    tips = sub.add_parser("tips", help="tips per sample, grouped by protocol version or protocol")
+    tips.add_argument("store")
+    tips.add_argument("--by", choices=("version", "protocol", "source"), default="version")
+    for command in (volume, tips):
+        command.add_argument("--since", help="ISO date or time, inclusive")
+        command.add_argument("--until", help="ISO date or time, exclusive")
+    args = parser.parse_args(argv)
+
+    status = 0
+    try:
+        store = Store(args.store)
+        if args.command == "add":
+            params = parse_params(args.param)
+            records = []
+            for path in args.paths:
+                try:
+                    records.append(read_run(path, params))
+                except (OSError, ValueError) as exc:
+                    print(f"{path}: error: {exc}", file=sys.stderr)
+                    status = 1
+            added = store.append(records)
+            print(f"{args.store}: {added} run(s) added, {len(records) - added} already stored; "
+                  f"{len(store)} runs, {store.manifest['rows']['commands']} commands")
+        elif args.command == "info":
+            print(f"{args.store}: {len(store)} runs, {store.manifest['rows']['commands']} commands, "
+                  f"{len(store.strings)} distinct strings")
+            for command_type, count in store.count().items():
+                print(f"  {count:8d}  {command_type}")
+        elif args.command == "volume":
+            started = time.perf_counter()
+            total, commands, runs = store.liquid(
+                "dispense" if args.dispensed else "aspirate", args.labware, args.well,
+                _date(args.since), _date(args.until))
+            elapsed = time.perf_counter() - started
+            print(f"{total:.1f} uL {'dispensed' if args.dispensed else 'aspirated'} in {commands} "
+                  f"commands over {runs} run(s) ({elapsed * 1000:.1f} ms)")
+        else:
+            for key, (tip_count, samples, runs) in sorted(
+                    store.tips_per_sample(args.by, _date(args.since), _date(args.until)).items()):
+                per_sample = f"{tip_count / samples:.2f}" if samples else "-"
+                print(f"{per_sample:>6} tips/sample  {tip_count:>8} tips  {samples:>8} samples  "
+                      f"{runs:>6} runs  {key}")
+        store.close()
+    except (OSError, ValueError) as exc:
+        print(f"{args.store}: error: {exc}", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
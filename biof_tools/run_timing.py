@@ -0,0 +1,179 @@
+"""Step timings across runs of the Flex transformation protocol.
+
+On the robot, the protocol's ``RunTimer`` appends one JSON line per event to
+``/data/user_storage/transformation_timing/<run>.jsonl``. Copy that directory
+off the robot and point this tool at it. The events are:
+
+* ``run`` - header with the run id and its parameters
+* ``step`` - one numbered protocol step, start to end
+* ``call`` - one liquid-handling or temperature module call within a step
+* ``pause`` - one operator pause, from the prompt to the resume
+
+Each step's time is split three ways. ``operator`` is time spent waiting in
+pauses, ``temperature`` is module ramps, and ``robot`` covers liquid-handling
+calls; whatever is left stays unattributed. The report gives p50 and p95
+per step across runs, and the share of all run time each part takes, so
+you can see whether throughput is bound by the robot, the cooling ramp or
+the people answering pauses.
+
+    python -m biof_tools.run_timing timing/
+    python -m biof_tools.run_timing timing/*.jsonl --param number_of_samples=96
+"""
+
+from dataclasses import dataclass, field
+import json
+import math
+import os
+import sys
+
+PARTS = ("robot", "temperature", "operator")
+
+
+@dataclass
+class Run:
+    run_id: str
+    path: str
+    protocol: str = None
+    params: dict = field(default_factory=dict)
+    events: list = field(default_factory=list)
+
+    def steps(self):
+        """``{(number, name): {"seconds", "robot", "temperature", "operator"}}`` in step order."""
+        steps = {}
+        for event in self.events:
+            if event["event"] == "step":
+                steps[event["step"], event["name"]] = dict(dict.fromkeys(PARTS, 0.0), seconds=event["s"])
+        names = {number: name for number, name in steps}
+        for event in self.events:
+            key = (event.get("step"), names.get(event.get("step")))
+            if key not in steps:
+                continue
+            if event["event"] == "pause":
+                steps[key]["operator"] += event["s"]
+            elif event["event"] == "call":
+                part = "temperature" if event["name"].startswith("temperature") else "robot"
+                steps[key][part] += event["s"]
+        return dict(sorted(steps.items(), key=lambda item: item[0][0]))
+
+    @property
+    def complete(self):
+        """False for runs that stopped before their last step ended."""
+        started = {event.get("step") for event in self.events} - {None}
+        ended = {event["step"] for event in self.events if event["event"] == "step"}
+        return bool(ended) and started <= ended
+
+
+def read_runs(path):
+    """Runs in a trace file; a file may hold several runs appended one after another."""
+    runs = []
+    with open(path, encoding="utf-8") as handle:
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                # The robot may have stopped mid-line.
+                print(f"{path}:{number}: skipped unreadable line", file=sys.stderr)
+                continue
+            if event.get("event") == "run":
+                runs.append(Run(event.get("run", f"{path}#{len(runs) + 1}"), path,
+                                event.get("protocol"), event.get("params", {})))
+            elif runs:
+                runs[-1].events.append(event)
+    return runs
+
+
+def trace_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(os.path.join(path, name) for name in os.listdir(path)
+                              if name.endswith(".jsonl"))
+        else:
+            yield path
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile ``q`` (0-100) of ``values``."""
+    values = sorted(values)
+    if not values:
+        return math.nan
+    position = (len(values) - 1) * q / 100
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summary(runs):
+    """Lines with p50/p95 per step and the share of run time per part."""
+    from .flex_sim import format_duration
+
+    lines = []
+    per_step = {}
+    totals = dict.fromkeys(PARTS + ("seconds",), 0.0)
+    for run in runs:
+        for key, timing in run.steps().items():
+            per_step.setdefault(key, []).append(timing)
+            for name in totals:
+                totals[name] += timing[name]
+    lines.append(f"{'step':<36} {'runs':>4} {'p50':>8} {'p95':>8}   "
+                 + "  ".join(f"{part + ' p50':>15}" for part in PARTS))
+    for (number, name), timings in sorted(per_step.items(), key=lambda item: item[0][0]):
+        seconds = [timing["seconds"] for timing in timings]
+        parts = "  ".join(f"{format_duration(percentile([t[part] for t in timings], 50)):>15}"
+                          for part in PARTS)
+        lines.append(f"{f'{number} {name}'[:36]:<36} {len(timings):>4} "
+                     f"{format_duration(percentile(seconds, 50)):>8} "
+                     f"{format_duration(percentile(seconds, 95)):>8}   {parts}")
+    durations = [sum(timing["seconds"] for timing in run.steps().values()) for run in runs]
+    if durations:
+        lines.append(f"whole run: p50 {format_duration(percentile(durations, 50))}, "
+                     f"p95 {format_duration(percentile(durations, 95))}")
+    if totals["seconds"]:
+        other = max(0.0, totals["seconds"] - sum(totals[part] for part in PARTS))
+        shares = {part: totals[part] / totals["seconds"] for part in PARTS}
+        shares["unattributed"] = other / totals["seconds"]
+        lines.append("share of run time: " + ", ".join(
+            f"{part} {100 * share:.0f}%" for part, share in shares.items()))
+        bound = max(PARTS, key=lambda part: totals[part])
+        lines.append(f"most time goes to: {bound}")
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    from .flex_sim import parse_params
+
+    parser = argparse.ArgumentParser(description="Summarise protocol timing traces across runs.")
+    parser.add_argument("paths", nargs="+", help="trace files (.jsonl) or directories of them")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="only runs with this parameter value")
+    parser.add_argument("--include-incomplete", action="store_true",
+                        help="also count runs that stopped part way")
+    args = parser.parse_args(argv)
+
+    wanted = parse_params(args.param)
+    runs = []
+    status = 0
+    for path in trace_files(args.paths):
+        try:
+            runs.extend(read_runs(path))
+        except OSError as exc:
+            print(f"{path}: error: {exc}", file=sys.stderr)
+            status = 1
+    matching = [run for run in runs
+                if all(run.params.get(name) == value for name, value in wanted.items())]
+    incomplete = [run for run in matching if not run.complete]
+    used = matching if args.include_incomplete else [run for run in matching if run.complete]
+    print(f"{len(used)} run(s)"
+          + (" with " + ", ".join(f"{name}={value}" for name, value in wanted.items()) if wanted else "")
+          + (f"; {len(incomplete)} stopped part way" + ("" if args.include_incomplete else ", left out")
+             if incomplete else ""))
+    if used:
+        print("\n".join(summary(used)))
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
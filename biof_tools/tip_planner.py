@@ -0,0 +1,158 @@
+"""Tip budget for the Flex transformation protocol.
+
+``plan`` works out the fewest tips a run can use under the protocol's
+contamination rules:
+
+* comp cells (step 3): one 8-channel tip for the whole run. The tip only
+  touches the cell strips and dispenses above the 384 wells.
+* SOC fill of the recovery plates (step 5): one 8-channel 200 uL tip.
+* staged SOC (step 7, ``staged`` schedule): one 8-channel 200 uL tip, since
+  it is a non-contact multi-dispense.
+* recovery (step 7): a fresh tip for every sample column, as it mixes in the
+  sample. With partial pickup, a part-filled last column takes one tip per
+  sample instead of a full column.
+
+The plan also says how many 50 uL rack loads the left pipette needs (two
+racks on deck, A1 and A2) and so how many rack swaps the run has. ``check``
+runs the protocol through ``biof_tools.flex_sim`` and compares the tips it
+actually picks up with the plan.
+
+    python -m biof_tools.tip_planner 24 89 --partial
+    python -m biof_tools.tip_planner 384 --recovery-plates 4 --check
+"""
+
+from dataclasses import dataclass, field
+import math
+
+from .well_layout import CHANNELS, COLUMNS_96, transformation_layout
+
+LEFT_RACKS_ON_DECK = 2
+RIGHT_RACKS_ON_DECK = 1
+RACK_COLUMNS = 12
+
+
+@dataclass(frozen=True)
+class TipStep:
+    step: str
+    mount: str
+    tip_volume: int
+    pickups: int
+    tips: int
+
+
+@dataclass
+class TipPlan:
+    params: dict
+    steps: list = field(default_factory=list)
+
+    def tips(self, mount=None):
+        return sum(step.tips for step in self.steps if mount in (None, step.mount))
+
+    def rack_columns(self, mount):
+        """Tip-rack columns opened by ``mount``; a partial pickup still opens a column."""
+        return sum(step.pickups for step in self.steps if step.mount == mount)
+
+    def rack_loads(self, mount):
+        racks = LEFT_RACKS_ON_DECK if mount == "left" else RIGHT_RACKS_ON_DECK
+        return max(1, math.ceil(self.rack_columns(mount) / (racks * RACK_COLUMNS)))
+
+    @property
+    def rack_swaps(self):
+        return self.rack_loads("left") - 1 + self.rack_loads("right") - 1
+
+
+def plan(number_of_samples, start_well_384="A1", start_column_96=1, recovery_plates=1,
+         step_7_schedule="sequential", partial_tip_pickup=False):
+    """Return the minimum-tip ``TipPlan`` for one set of run parameters.
+
+    Raises ``ValueError`` for layouts the protocol rejects.
+    """
+    layout = transformation_layout(number_of_samples, start_well_384, start_column_96,
+                                   recovery_plates)
+    columns = layout.num_columns
+    trailing = number_of_samples % CHANNELS
+    recovery_tips = columns * CHANNELS
+    if partial_tip_pickup and trailing:
+        recovery_tips -= CHANNELS - trailing
+    result = TipPlan(params=dict(
+        number_of_samples=number_of_samples, start_well_384=start_well_384,
+        start_column_96=start_column_96, recovery_plates=recovery_plates,
+        step_7_schedule=step_7_schedule, partial_tip_pickup=partial_tip_pickup,
+    ))
+    result.steps.append(TipStep("3 distribute comp cells", "left", 50, 1, CHANNELS))
+    result.steps.append(TipStep("5 SOC to recovery plates", "right", 200, 1, CHANNELS))
+    if step_7_schedule == "staged":
+        result.steps.append(TipStep("7 stage SOC in 384 plate", "right", 200, 1, CHANNELS))
+    result.steps.append(TipStep("7 recover columns", "left", 50, columns, recovery_tips))
+    return result
+
+
+def full_column_tips(number_of_samples):
+    """Tips the recovery step uses when every column takes a full 8-channel pickup."""
+    return math.ceil(number_of_samples / CHANNELS) * CHANNELS
+
+
+def check(tip_plan, protocol=None):
+    """Simulate the protocol for ``tip_plan.params`` and list tip counts that differ."""
+    from . import flex_sim
+
+    result = flex_sim.run_protocol(protocol or flex_sim.DEFAULT_PROTOCOL, tip_plan.params)
+    if result.error is not None:
+        return [f"protocol failed: {type(result.error).__name__}: {result.error}"]
+    used = result.tips_used()
+    return [
+        f"{mount} pipette picks up {used.get(mount, 0)} tips, plan is {tip_plan.tips(mount)}"
+        for mount in ("left", "right")
+        if used.get(mount, 0) != tip_plan.tips(mount)
+    ]
+
+
+def main(argv=None):
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Plan tip use for Flex transformation runs.")
+    parser.add_argument("number_of_samples", type=int, nargs="+", help="one value per run")
+    parser.add_argument("--start-well-384", default="A1")
+    parser.add_argument("--start-column-96", type=int, default=1)
+    parser.add_argument("--recovery-plates", type=int, default=None,
+                        help="default: as many as the sample count needs")
+    parser.add_argument("--schedule", choices=("sequential", "staged"), default="sequential")
+    parser.add_argument("--partial", action="store_true", help="partial tip pickup for the last column")
+    parser.add_argument("--check", action="store_true", help="compare with the simulated protocol")
+    args = parser.parse_args(argv)
+
+    status = 0
+    totals = {"left": 0, "right": 0}
+    print("samples,step,mount,tip_uL,pickups,tips")
+    for samples in args.number_of_samples:
+        plates = args.recovery_plates or math.ceil(
+            (args.start_column_96 - 1 + math.ceil(samples / CHANNELS)) / COLUMNS_96
+        )
+        try:
+            tip_plan = plan(samples, args.start_well_384, args.start_column_96, plates,
+                            args.schedule, args.partial)
+        except ValueError as exc:
+            print(f"{samples},error: {exc}", file=sys.stderr)
+            status = 1
+            continue
+        for step in tip_plan.steps:
+            print(f"{samples},{step.step},{step.mount},{step.tip_volume},{step.pickups},{step.tips}")
+        for mount in totals:
+            totals[mount] += tip_plan.rack_columns(mount)
+        saved = full_column_tips(samples) - tip_plan.steps[-1].tips
+        print(f"# {samples} samples: {tip_plan.tips()} tips "
+              f"(50 uL {tip_plan.tips('left')}, 200 uL {tip_plan.tips('right')}), "
+              f"{tip_plan.rack_swaps} rack swap(s)"
+              + (f", partial pickup saves {saved}" if saved else ""))
+        if args.check:
+            for problem in check(tip_plan):
+                print(f"# {samples} samples: {problem}")
+                status = 1
+    print(f"# racks to stock: 50 uL {math.ceil(totals['left'] / RACK_COLUMNS)}, "
+          f"200 uL {math.ceil(totals['right'] / RACK_COLUMNS)}")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+"""Per-well volume ledger and prep sheet for Flex and Protocol Designer runs.
+
+``Ledger`` replays a run's liquid handling one operation at a time. Each
+well keeps a fixed set of counters (declared load, volume moved in and out,
+and the lowest balance an aspirate leaves), so every aspirate or dispense
+is one dict lookup and a few additions. Replaying checks every operation
+against the declared volumes:
+
+* overdraw - an aspirate leaves less than the well's dead volume (or less
+  than nothing)
+* excess aspirate - the same in a well the run has dispensed into: the
+  run aspirates more than it put there, which no amount of pre-filling
+  should be asked to cover
+* overflow - a dispense takes a well past its capacity
+
+``Ledger.minimum_fill`` is the exact volume a well must start with so that no
+aspirate overdraws it: the dead volume, less the lowest balance any
+aspirate leaves. ``prep_sheet`` lists it for every well with a declared
+load, next to the declared volume, with totals per liquid.
+
+Sources:
+
+* ``from_flex`` replays a ``biof_tools.flex_sim`` run. ``load_liquid`` gives
+  the declared volumes, and every channel of a multi-channel command
+  counts, so an 8-channel aspirate from a reservoir column takes eight
+  volumes from one well.
+* ``from_protocol_designer`` replays the ``commands`` of a Protocol Designer
+  file through ``biof_tools.pd_reader``. ``loadLiquid`` gives the declared
+  volumes, and capacities come from the embedded labware definitions. An
+  aspirate at or above the top of a well draws air, not liquid. The file's
+  dismissed ``ASPIRATE_MORE_THAN_WELL_CONTENTS`` warnings are counted, so
+  they can be compared with what the ledger finds.
+
+``DEAD_VOLUMES`` are planning estimates of what a pipette cannot recover
+from each labware. Override them with ``--dead-volume LOAD_NAME=UL``.
+
+    python -m biof_tools.volume_ledger --param number_of_samples=96
+    python -m biof_tools.volume_ledger Hamilton_Robotic_Protocols/*/*.json --csv prep.csv
+"""
+
+from dataclasses import dataclass
+import csv
+import math
+import os
+import sys
+
+# load name -> volume (uL) left in a well that a pipette cannot aspirate
+DEAD_VOLUMES = {
+    "nest_12_reservoir_15ml": 1000.0,
+    "nest_12_reservoir_22ml": 1000.0,
+    "nest_1_reservoir_195ml": 5000.0,
+    "opentrons_96_aluminumblock_generic_pcr_strip_200ul": 5.0,
+    "biorad_96_wellplate_200ul_pcr": 5.0,
+    "nest_96_wellplate_100ul_pcr_full_skirt": 5.0,
+    "nest_96_wellplate_200ul_flat": 10.0,
+    "appliedbiosystemsmicroamp_384_wellplate_40ul": 2.0,
+    "corning_384_wellplate_112ul_flat": 5.0,
+    "corning_6_wellplate_16.8ml_flat": 200.0,
+    "4ti_0117": 5.0,
+}
+OVERDRAW = "overdraw"
+EXCESS_ASPIRATE = "excess aspirate"
+OVERFLOW = "overflow"
+# Rounding in volume arithmetic is not an overdraw.
+TOLERANCE = 1e-6
+
+
+@dataclass
+class WellLedger:
+    labware: str
+    well: str
+    capacity: float = math.inf
+    dead_volume: float = 0.0
+    liquid: str = None
+    loaded: float = 0.0
+    balance: float = 0.0  # net change since the start of the run
+    low: float = math.inf  # lowest ``balance`` left by an aspirate
+    drawn: float = 0.0
+    added: float = 0.0
+
+    @property
+    def volume(self):
+        """Current volume, assuming the declared load."""
+        return self.loaded + self.balance
+
+    @property
+    def source(self):
+        """Whether the run only draws from the well, so its start volume must cover every aspirate."""
+        return bool(self.drawn) and not self.added
+
+    @property
+    def minimum_fill(self):
+        """Smallest starting volume that no aspirate overdraws."""
+        if not self.drawn:
+            return 0.0
+        return max(0.0, self.dead_volume - self.low)
+
+
+@dataclass(frozen=True)
+class Issue:
+    index: int  # command number in the run
+    problem: str
+    labware: str
+    well: str
+    volume: float  # volume the well would hold after the operation
+
+    def __str__(self):
+        return f"command {self.index + 1}: {self.problem} of {self.labware} {self.well}: {self.volume:g} uL"
+
+
+class Ledger:
+    """Volume counters per well, keyed by ``(labware, well)``."""
+
+    def __init__(self, dead_volumes=None):
+        self.dead_volumes = dict(DEAD_VOLUMES if dead_volumes is None else dead_volumes)
+        self.wells = {}
+        self.issues = []
+        self.discarded = 0.0  # liquid dropped with tips or blown out into the trash
+        self.warnings = {}  # notes from the source, e.g. dismissed Protocol Designer warnings
+        self._labware = {}  # labware -> (capacity, dead volume)
+
+    def add_labware(self, labware, load_name, capacity=math.inf):
+        self._labware[labware] = (capacity, self.dead_volumes.get(load_name, 0.0))
+
+    def well(self, labware, well):
+        key = (labware, well)
+        entry = self.wells.get(key)
+        if entry is None:
+            capacity, dead_volume = self._labware.get(labware, (math.inf, 0.0))
+            entry = self.wells[key] = WellLedger(labware, well, capacity, dead_volume)
+        return entry
+
+    def load(self, labware, well, volume, liquid=None):
+        entry = self.well(labware, well)
+        entry.loaded += volume
+        if liquid is not None:
+            entry.liquid = liquid if entry.liquid in (None, liquid) else f"{entry.liquid} + {liquid}"
+
+    def aspirate(self, index, labware, well, volume):
+        entry = self.well(labware, well)
+        entry.balance -= volume
+        entry.drawn += volume
+        if entry.balance < entry.low:
+            entry.low = entry.balance
+        if entry.volume < entry.dead_volume - TOLERANCE:
+            problem = EXCESS_ASPIRATE if entry.added else OVERDRAW
+            self.issues.append(Issue(index, problem, labware, well, entry.volume))
+
+    def dispense(self, index, labware, well, volume):
+        entry = self.well(labware, well)
+        entry.balance += volume
+        entry.added += volume
+        if entry.volume > entry.capacity + TOLERANCE:
+            self.issues.append(Issue(index, OVERFLOW, labware, well, entry.volume))
+
+    def discard(self, volume):
+        self.discarded += volume
+
+    def first_issues(self):
+        """The first issue of each kind for each well, in run order."""
+        seen = set()
+        first = []
+        for issue in self.issues:
+            key = (issue.problem, issue.labware, issue.well)
+            if key not in seen:
+                seen.add(key)
+                first.append(issue)
+        return first
+
+
+class _Tips:
+    """Liquid held per channel in each pipette's tips."""
+
+    def __init__(self):
+        self.held = {}  # pipette -> (uL per channel, channels)
+
+    def aspirate(self, pipette, volume, channels):
+        held, _ = self.held.get(pipette, (0.0, channels))
+        self.held[pipette] = (held + volume, channels)
+
+    def dispense(self, pipette, volume):
+        held, channels = self.held.get(pipette, (0.0, 1))
+        self.held[pipette] = (max(0.0, held - volume), channels)
+        return min(volume, held)
+
+    def empty(self, pipette):
+        """Remaining uL per channel, and the tips are emptied."""
+        held, channels = self.held.pop(pipette, (0.0, 1))
+        return held, channels
+
+
+# Flex
+
+
+def from_flex(protocol=None, params=None, dead_volumes=None, time_model=None):
+    """Ledger of a Flex protocol, replayed from a ``flex_sim`` run."""
+    from . import flex_sim
+
+    protocol = protocol or flex_sim.DEFAULT_PROTOCOL
+    result = flex_sim.run_protocol(protocol, params, time_model)
+    if result.error is not None:
+        raise result.error
+    return replay_flex(result.commands, dead_volumes)
+
+
+def replay_flex(commands, dead_volumes=None):
+    """Ledger of ``flex_sim`` commands. Labware is named ``"<label> (<first slot>)"``."""
+    from .flex_sim import LABWARE
+
+    ledger = Ledger(dead_volumes)
+    tips = _Tips()
+    names = {}  # current slot -> ledger name, following labware moves
+    last_dispense = {}  # pipette -> (labware, wells) of its last dispense
+
+    for index, command in enumerate(commands):
+        kind = command.kind
+        if kind == "load_labware":
+            name = f"{command.labware} ({command.slot})"
+            names[command.slot] = name
+            if "tiprack" not in command.message:
+                ledger.add_labware(name, command.message, LABWARE[command.message][3])
+            continue
+        if kind == "move_labware":
+            name = names.pop(command.slot, None)
+            if name is not None:
+                names[command.message] = name
+            continue
+        labware = names.get(command.slot, command.labware)
+        if kind == "load_liquid":
+            for well in command.wells:
+                ledger.load(labware, well, command.volume, command.message)
+        elif kind == "aspirate":
+            for well in command.wells:
+                ledger.aspirate(index, labware, well, command.volume)
+            tips.aspirate(command.pipette, command.volume, len(command.wells))
+        elif kind == "dispense":
+            volume = tips.dispense(command.pipette, command.volume)
+            for well in command.wells:
+                ledger.dispense(index, labware, well, volume)
+            last_dispense[command.pipette] = (labware, command.well, command.wells)
+        elif kind == "blow_out":
+            held, channels = tips.empty(command.pipette)
+            if not command.wells:
+                ledger.discard(held * channels)
+                continue
+            # A blow-out over the wells just dispensed into reaches every channel's well.
+            target = last_dispense.get(command.pipette)
+            wells = target[2] if target is not None and target[:2] == (labware, command.well) \
+                else command.wells
+            for well in wells:
+                ledger.dispense(index, labware, well, held)
+        elif kind in ("drop_tip", "pick_up_tip"):
+            held, channels = tips.empty(command.pipette)
+            ledger.discard(held * channels)
+    return ledger
+
+
+# Protocol Designer
+
+
+def _wells_under(definition, well, channels):
+    """Wells below each channel of a head whose primary nozzle is at ``well``."""
+    if channels == 1:
+        return (well,)
+    for column in definition["ordering"]:
+        if well in column:
+            if len(column) == 1:
+                return (well,) * channels
+            step = max(1, len(column) // channels)
+            start = column.index(well)
+            return tuple(column[start::step][:channels])
+    return (well,)
+
+
+def from_protocol_designer(path, dead_volumes=None):
+    """Ledger of a Protocol Designer file's ``commands``."""
+    from .pd_reader import ProtocolFile
+
+    ledger = Ledger(dead_volumes)
+    tips = _Tips()
+    with ProtocolFile(path) as pd:
+        definitions = pd.labware_definitions()
+        labware = {}
+        for key, value in pd.section("labware", {}).items():
+            definition = definitions.get(value.get("definitionId"))
+            labware[key] = (value.get("displayName", key), definition)
+            if definition is None or definition["parameters"].get("isTiprack"):
+                continue
+            capacity = max(well["totalLiquidVolume"] for well in definition["wells"].values())
+            ledger.add_labware(labware[key][0], definition["parameters"]["loadName"], capacity)
+        channels = {key: 8 if "multi" in value.get("name", "") else 1
+                    for key, value in pd.section("pipettes", {}).items()}
+        liquids = {key: value.get("displayName", key) for key, value in pd.section("liquids", {}).items()}
+        design = pd.section("designerApplication", {}).get("data", {})
+        forms = design.get("savedStepForms", {})
+        for step, warnings in design.get("dismissedWarnings", {}).get("timeline", {}).items():
+            for warning in warnings:
+                ledger.warnings.setdefault(warning, []).append(forms.get(step, {}).get("stepName", step))
+
+        for index, command in enumerate(pd.commands()):
+            kind, params = command["commandType"], command.get("params", {})
+            pipette = params.get("pipetteId")
+            name, definition = labware.get(params.get("labwareId"), (params.get("labwareId"), None))
+            if kind == "loadLiquid":
+                for well, volume in params.get("volumeByWell", {}).items():
+                    ledger.load(name, well, volume, liquids.get(params.get("liquidId")))
+                continue
+            if kind in ("aspirate", "dispense") and definition is not None:
+                wells = _wells_under(definition, params["wellName"], channels.get(pipette, 1))
+                volume = params.get("volume", 0.0)
+                if kind == "aspirate":
+                    location = params.get("wellLocation", {})
+                    offset = location.get("offset", {}).get("z", 0.0)
+                    depth = definition["wells"][params["wellName"]]["depth"]
+                    if command.get("meta", {}).get("isAirGap") or location.get("origin") == "top" \
+                            or offset >= depth:
+                        continue  # air
+                    for well in wells:
+                        ledger.aspirate(index, name, well, volume)
+                    tips.aspirate(pipette, volume, len(wells))
+                else:
+                    volume = tips.dispense(pipette, volume)
+                    for well in wells:
+                        ledger.dispense(index, name, well, volume)
+            elif kind in ("blowout", "blowOutInPlace", "dropTip", "dropTipInPlace", "pickUpTip"):
+                held, count = tips.empty(pipette)
+                if kind == "blowout" and definition is not None and "trash" not in \
+                        definition["parameters"]["loadName"]:
+                    for well in _wells_under(definition, params["wellName"], count):
+                        ledger.dispense(index, name, well, held)
+                else:
+                    ledger.discard(held * count)
+    return ledger
+
+
+def load(path, params=None, dead_volumes=None):
+    """Ledger of ``path`` by its extension: ``.py`` Flex, ``.json`` Protocol Designer."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".py":
+        return from_flex(path, params, dead_volumes)
+    if extension == ".json":
+        return from_protocol_designer(path, dead_volumes)
+    raise ValueError(f"{path}: unknown format {extension!r}")
+
+
+# Prep sheet
+
+
+@dataclass(frozen=True)
+class PrepRow:
+    labware: str
+    well: str
+    liquid: str
+    declared: float
+    minimum: float
+    dead_volume: float
+
+    @property
+    def short(self):
+        return self.declared < self.minimum - TOLERANCE
+
+    @property
+    def excess(self):
+        return max(0.0, self.declared - self.minimum)
+
+
+def prep_sheet(ledger):
+    """One row per well with a declared load, in the order the run first met them.
+
+    Only sources (wells the run draws from but never dispenses into) get
+    ``minimum_fill`` as their minimum. Other loaded wells keep their declared
+    volume: they hold samples, not stock, and an aspirate that empties a
+    well the run filled is an excess aspirate, not a fill shortfall.
+    """
+    return [
+        PrepRow(entry.labware, entry.well, entry.liquid or "", entry.loaded,
+                entry.minimum_fill if entry.source else entry.loaded, entry.dead_volume)
+        for entry in ledger.wells.values() if entry.loaded
+    ]
+
+
+def write_prep_sheet(sheets, handle):
+    """Write ``{protocol: prep_sheet rows}`` as one CSV."""
+    writer = csv.writer(handle, lineterminator="\n")
+    writer.writerow(["protocol", "labware", "well", "liquid", "declared_ul", "minimum_ul", "dead_volume_ul"])
+    for protocol, rows in sheets.items():
+        for row in rows:
+            writer.writerow([protocol, row.labware, row.well, row.liquid, f"{row.declared:g}",
+                             f"{math.ceil(row.minimum * 10) / 10:g}", f"{row.dead_volume:g}"])
+
+
+def _well_range(wells):
+    """``A1-H2`` for a full block of rows and columns, else runs down each column: ``A1-B1, A2``."""
+    try:
+        cells = [(int(well[1:]), ord(well[0]) - ord("A")) for well in wells]
+    except ValueError:
+        return ", ".join(wells)
+    columns = sorted({column for column, _ in cells})
+    rows = sorted({row for _, row in cells})
+    if (len(cells) == len(set(cells)) == len(columns) * len(rows)
+            and columns[-1] - columns[0] == len(columns) - 1 and rows[-1] - rows[0] == len(rows) - 1):
+        first, last = f"{chr(ord('A') + rows[0])}{columns[0]}", f"{chr(ord('A') + rows[-1])}{columns[-1]}"
+        return first if first == last else f"{first}-{last}"
+    runs = []
+    for well, (column, row) in zip(wells, cells):
+        if runs and runs[-1][2] == (column, row - 1):
+            runs[-1][1:] = [well, (column, row)]
+        else:
+            runs.append([well, well, (column, row)])
+    return ", ".join(start if start == end else f"{start}-{end}" for start, end, _ in runs)
+
+
+def report(ledger):
+    """Lines summarising a ledger: issues, the prep sheet grouped by labware, totals per liquid."""
+    lines = []
+    issues = ledger.first_issues()
+    counts = {problem: sum(issue.problem == problem for issue in ledger.issues)
+              for problem in (OVERDRAW, EXCESS_ASPIRATE, OVERFLOW)}
+    lines.append(f"{counts[OVERDRAW]} overdraw(s), {counts[EXCESS_ASPIRATE]} excess aspirate(s), "
+                 f"{counts[OVERFLOW]} overflow(s) "
+                 f"in {len({(issue.labware, issue.well) for issue in issues})} well(s); "
+                 f"{ledger.discarded:g} uL discarded with tips and blow-outs")
+    lines.extend(f"  {issue}" for issue in issues[:20])
+    if len(issues) > 20:
+        lines.append(f"  ... and {len(issues) - 20} more")
+    for warning, steps in ledger.warnings.items():
+        lines.append(f"dismissed {warning}: {len(steps)} step(s) ({', '.join(sorted(set(steps)))})")
+
+    groups = {}
+    for row in prep_sheet(ledger):
+        key = (row.labware, row.liquid, row.declared, round(row.minimum, 1))
+        groups.setdefault(key, []).append(row)
+    lines.append("prep sheet (minimum includes the dead volume):")
+    totals = {}
+    for (labware, liquid, declared, minimum), rows in groups.items():
+        flag = "  SHORT" if rows[0].short else (f"  {rows[0].excess:g} uL spare each" if
+                                                 rows[0].excess > TOLERANCE else "")
+        lines.append(f"  {labware} {_well_range([row.well for row in rows])} ({len(rows)} well(s)) "
+                     f"{liquid or '-'}: {math.ceil(minimum * 10) / 10:g} uL each, "
+                     f"declared {declared:g}{flag}")
+        total = totals.setdefault(liquid or "-", [0.0, 0.0])
+        total[0] += minimum * len(rows)
+        total[1] += declared * len(rows)
+    for liquid, (minimum, declared) in totals.items():
+        lines.append(f"  total {liquid}: {minimum:.1f} uL needed, {declared:g} uL declared")
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    from .flex_sim import DEFAULT_PROTOCOL, parse_params
+
+    parser = argparse.ArgumentParser(description="Check well volumes of a run and write its prep sheet.")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_PROTOCOL],
+                        help=".py (Flex) or .json (Protocol Designer)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="runtime parameter for Flex protocols")
+    parser.add_argument("--dead-volume", action="append", default=[], metavar="LOAD_NAME=UL")
+    parser.add_argument("--csv", help="write the prep sheet of every run to this CSV file")
+    args = parser.parse_args(argv)
+
+    dead_volumes = dict(DEAD_VOLUMES)
+    for item in args.dead_volume:
+        name, _, value = item.partition("=")
+        try:
+            dead_volumes[name] = float(value)
+        except ValueError:
+            parser.error(f"--dead-volume takes LOAD_NAME=UL, not {item!r}")
+
+    status = 0
+    sheets = {}
+    for path in args.paths:
+        try:
+            ledger = load(path, parse_params(args.param), dead_volumes)
+        except Exception as exc:
+            print(f"{path}: error: {type(exc).__name__}: {exc}", file=sys.stderr)
+            status = 2
+            continue
+        print(f"{path}:")
+        print("\n".join(report(ledger)))
+        sheets[os.path.basename(path)] = prep_sheet(ledger)
+        if ledger.issues:
+            status = max(status, 1)
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as handle:
+            write_prep_sheet(sheets, handle)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
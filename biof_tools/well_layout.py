@@ -0,0 +1,254 @@
+"""Precomputed 96/384-well layout tables for 8-channel work.
+
+All well positions are handled as integer indexes into tables built once at
+import time, so lookups and validation are O(1) and layouts never have to be
+re-derived from well-name strings.
+
+Indexes are column-major, matching the Opentrons ``wells()`` order:
+
+* a 96-well index is ``(column - 1) * 8 + row`` (A1=0, B1=1, ... H12=95)
+* a 384-well index is ``(column - 1) * 16 + row`` (A1=0, B1=1, ... P24=383)
+
+An 8-channel head on a 384-well plate lands on row A or row B of one of the 24
+columns and covers every other row, giving 48 head positions. They are
+numbered in the order the transformation protocol walks them
+(A1=0, B1=1, A2=2, B2=3, ... B24=47). Each head position covers exactly one
+column of one quadrant, where quadrants are numbered 0-3 for the blocks
+starting at A1, A2, B1 and B2.
+
+The arrays returned by this module are ``array.array`` objects, so they can be
+handed to NumPy without copying (``numpy.frombuffer(arr, dtype=arr.typecode)``).
+"""
+
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+import math
+
+ROWS_96 = "ABCDEFGH"
+ROWS_384 = "ABCDEFGHIJKLMNOP"
+CHANNELS = 8
+COLUMNS_96 = 12
+COLUMNS_384 = 24
+HEAD_POSITIONS_384 = 2 * COLUMNS_384
+QUADRANT_START_WELLS = ("A1", "A2", "B1", "B2")
+MAX_RECOVERY_PLATES = 4
+
+WELL_NAMES_96 = tuple(
+    f"{row}{col}" for col in range(1, COLUMNS_96 + 1) for row in ROWS_96
+)
+WELL_NAMES_384 = tuple(
+    f"{row}{col}" for col in range(1, COLUMNS_384 + 1) for row in ROWS_384
+)
+WELL_INDEX_96 = {name: index for index, name in enumerate(WELL_NAMES_96)}
+WELL_INDEX_384 = {name: index for index, name in enumerate(WELL_NAMES_384)}
+
+HEAD_NAMES_384 = tuple(
+    f"{ROWS_384[head % 2]}{head // 2 + 1}" for head in range(HEAD_POSITIONS_384)
+)
+HEAD_INDEX_384 = {name: head for head, name in enumerate(HEAD_NAMES_384)}
+
+
+def _quadrant_of(row_384, col_384):
+    return (row_384 % 2) * 2 + col_384 % 2
+
+
+def _build_quadrant_tables():
+    to_384 = tuple(array("H", bytes(2 * 96)) for _ in range(4))
+    quadrant_of_384 = array("B", bytes(384))
+    well_96_of_384 = array("B", bytes(384))
+    for index_384 in range(384):
+        col_384, row_384 = divmod(index_384, 16)
+        quadrant = _quadrant_of(row_384, col_384)
+        index_96 = (col_384 // 2) * 8 + row_384 // 2
+        to_384[quadrant][index_96] = index_384
+        quadrant_of_384[index_384] = quadrant
+        well_96_of_384[index_384] = index_96
+    return to_384, quadrant_of_384, well_96_of_384
+
+
+#: ``QUADRANT_TO_384[q][i]`` is the 384-well index of 96-well index ``i`` in quadrant ``q``.
+#: ``QUADRANT_OF_384[j]`` / ``WELL_96_OF_384[j]`` invert it for 384-well index ``j``.
+QUADRANT_TO_384, QUADRANT_OF_384, WELL_96_OF_384 = _build_quadrant_tables()
+
+#: ``HEAD_WELLS_384[head * 8 + channel]`` is the 384-well index under each channel.
+HEAD_WELLS_384 = array(
+    "H",
+    (
+        (head // 2) * 16 + head % 2 + 2 * channel
+        for head in range(HEAD_POSITIONS_384)
+        for channel in range(CHANNELS)
+    ),
+)
+#: Quadrant and 96-well column (1-12) covered by each head position.
+HEAD_QUADRANT_384 = array(
+    "B", (_quadrant_of(head % 2, head // 2) for head in range(HEAD_POSITIONS_384))
+)
+HEAD_COLUMN_96 = array(
+    "B", (head // 4 + 1 for head in range(HEAD_POSITIONS_384))
+)
+
+
+def head_index(well_name):
+    """Return the head position (0-47) of a row A/B well on a 384-well plate."""
+    try:
+        return HEAD_INDEX_384[well_name]
+    except KeyError:
+        raise ValueError(
+            f"{well_name!r} is not an 8-channel start well on a 384-well plate "
+            f"(expected row A or B, columns 1-{COLUMNS_384})"
+        ) from None
+
+
+def head_wells(head):
+    """Return the eight 384-well indexes covered by a head position."""
+    return HEAD_WELLS_384[head * CHANNELS:(head + 1) * CHANNELS]
+
+
+def quadrant_map(quadrant):
+    """Return the 96-entry 96-to-384 index table for one quadrant (0-3)."""
+    if not 0 <= quadrant < 4:
+        raise ValueError(f"Quadrant must be 0-3, got {quadrant}")
+    return QUADRANT_TO_384[quadrant]
+
+
+def quadrant_heads(quadrant):
+    """Return the 12 head positions that cover a quadrant, in 96-column order."""
+    return array(
+        "B",
+        (head for head in range(HEAD_POSITIONS_384) if HEAD_QUADRANT_384[head] == quadrant),
+    )
+
+
+@dataclass(frozen=True)
+class TransformationLayout:
+    """Destination layout of one Flex transformation run.
+
+    ``heads_384`` holds the head positions used on the 384-well assembly plate
+    and ``columns_96`` the matching 96-well recovery columns (1-12), one entry
+    per 8-channel column processed. ``plates_96`` holds the recovery plate
+    (0-3) of each column; columns run on to the next plate when one is full.
+    Layouts are cached and shared, so treat the arrays as read-only.
+    """
+
+    number_of_samples: int
+    heads_384: array
+    columns_96: array
+    plates_96: array
+
+    @property
+    def num_columns(self):
+        return len(self.heads_384)
+
+    @property
+    def dest_wells_384(self):
+        """Well names the 8-channel head targets on the 384-well plate."""
+        return tuple(HEAD_NAMES_384[head] for head in self.heads_384)
+
+    @property
+    def dest_columns_96(self):
+        """Top well names of the 96-well recovery columns."""
+        return tuple(f"A{col}" for col in self.columns_96)
+
+    def sample_wells(self):
+        """Return per-sample ``(384-well index, 96-well index)`` arrays.
+
+        Samples are numbered column by column, eight per 8-channel column.
+        """
+        wells_384 = array("H")
+        wells_96 = array("B")
+        for column, head in enumerate(self.heads_384):
+            first_96 = (self.columns_96[column] - 1) * CHANNELS
+            wells_384.extend(head_wells(head))
+            wells_96.extend(range(first_96, first_96 + CHANNELS))
+        del wells_384[self.number_of_samples:]
+        del wells_96[self.number_of_samples:]
+        return wells_384, wells_96
+
+
+@lru_cache(maxsize=4096)
+def transformation_layout(number_of_samples, start_well_384="A1", start_column_96=1,
+                          recovery_plates=1):
+    """Return the validated layout for a set of transformation run parameters.
+
+    Raises ``ValueError`` with the protocol's messages when either plate runs
+    out of columns. Results are cached, so repeated parameter sets are free.
+    """
+    if not 1 <= recovery_plates <= MAX_RECOVERY_PLATES:
+        raise ValueError(
+            f"Recovery plates must be 1-{MAX_RECOVERY_PLATES}, got {recovery_plates}"
+        )
+    if number_of_samples < 1:
+        raise ValueError(f"Number of samples must be positive, got {number_of_samples}")
+    num_columns = math.ceil(number_of_samples / CHANNELS)
+
+    end_column_96 = start_column_96 + num_columns - 1
+    if start_column_96 < 1 or end_column_96 > COLUMNS_96 * recovery_plates:
+        plates = "96-well plate" if recovery_plates == 1 else f"{recovery_plates} 96-well plates"
+        raise ValueError(
+            f"Not enough columns in {plates}. Need {num_columns} columns "
+            f"starting from column {start_column_96}"
+        )
+
+    start_head = head_index(start_well_384)
+    if start_head + num_columns > HEAD_POSITIONS_384:
+        raise ValueError(
+            f"Not enough columns in 384-well plate. Need {num_columns} columns "
+            f"starting from well {start_well_384}"
+        )
+
+    return TransformationLayout(
+        number_of_samples=number_of_samples,
+        heads_384=array("B", range(start_head, start_head + num_columns)),
+        columns_96=array(
+            "B", ((column - 1) % COLUMNS_96 + 1 for column in range(start_column_96, end_column_96 + 1))
+        ),
+        plates_96=array(
+            "B", ((column - 1) // COLUMNS_96 for column in range(start_column_96, end_column_96 + 1))
+        ),
+    )
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Print the Flex transformation layout for a set of run parameters."
+    )
+    parser.add_argument("number_of_samples", type=int)
+    parser.add_argument("--start-well-384", default="A1")
+    parser.add_argument("--start-column-96", type=int, default=1)
+    parser.add_argument("--recovery-plates", type=int, default=1)
+    parser.add_argument(
+        "--samples", action="store_true", help="list every sample instead of every column"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        layout = transformation_layout(
+            args.number_of_samples, args.start_well_384, args.start_column_96,
+            args.recovery_plates,
+        )
+    except ValueError as exc:
+        parser.exit(1, f"error: {exc}\n")
+
+    if args.samples:
+        wells_384, wells_96 = layout.sample_wells()
+        print("sample,well_384,plate_96,well_96")
+        for sample, (index_384, index_96) in enumerate(zip(wells_384, wells_96), start=1):
+            print(
+                f"{sample},{WELL_NAMES_384[index_384]},"
+                f"{layout.plates_96[(sample - 1) // CHANNELS] + 1},{WELL_NAMES_96[index_96]}"
+            )
+    else:
+        print("column,well_384,quadrant,plate_96,column_96")
+        for column, head in enumerate(layout.heads_384):
+            print(
+                f"{column + 1},{HEAD_NAMES_384[head]},"
+                f"{QUADRANT_START_WELLS[HEAD_QUADRANT_384[head]]},"
+                f"{layout.plates_96[column] + 1},{layout.columns_96[column]}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""Discrete-event model of the lab's instruments working through the whole pipeline.
+
+Samples go through the stages in ``STAGES`` order, in batches:
+
+1. transformation on the Flex (up to 384 samples a run)
+2. spreading onto 6-well plates on the Hamilton (Protocol Designer commands)
+3. colony growth (incubator, no instrument)
+4. colony picking on the Hamilton (BioF-HAM-0001, 16 plates per run)
+5. culture growth (incubator, no instrument)
+6. pellet resuspension (BioF-CYB-0008), Teleshake shaking, plasmid
+   purification (BioF-CYB-0009) and AMPure PCR cleanup (BioF-CYB-0010),
+   all on the Felix
+
+Each instrument is a resource with a number of units. A run waits in
+first-come order for a free unit, holds it for the stage's duration and
+then hands its samples to the next stage. The model runs on ``asyncio``
+under a virtual clock (``VirtualClockLoop``), so a week of lab time takes
+milliseconds.
+
+Durations come from the protocols themselves wherever the repository has
+them:
+
+* Flex - a ``flex_sim`` run for the batch's sample count.
+* Spreading - the Protocol Designer operation stream (``liquid_ir``), with
+  liquid handling scaled by the samples in the run.
+* Felix methods - ``felix_seconds`` follows the method the way it runs.
+  Conditions take the branch that holds, repeats run their count and
+  parallel threads take as long as the slowest. Liquid handling uses the
+  Flex ``TimeModel``, and waits use the method's own times.
+* BioF-CYB-0009 - only the ``.isf`` outline is in the repository, so its
+  time is the purification method's command count times the seconds per
+  command of BioF-CYB-0010.
+* Colony picking - no method file, so it uses ``PICKING_SECONDS_PER_PLATE``,
+  a planning estimate.
+
+The last two are estimated stages. The report marks them, and gives how
+much of each instrument's busy time, the bottleneck's included, rests on
+them. ``--seconds STAGE=SECONDS`` replaces any duration with a measured
+time per run, and ``--set STAGE.NAME=VALUE`` sets a protocol's parameters
+or method variables.
+
+    python -m biof_tools.workcell --samples 768
+    python -m biof_tools.workcell --samples 768 --instruments felix=2
+    python -m biof_tools.workcell --samples 768 --batch 192 --set transformation.deck_mode=pause_free
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+import math
+import os
+import re
+import selectors
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CYBIO = os.path.join(REPO, "CyBio Felix protocols")
+SPREADING_PROTOCOL = os.path.join(
+    REPO, "Hamilton_Robotic_Protocols", "Transformation_Spreading_Protocol_Hamilton",
+    "Transformation Spread to 6 Well Plates.json",
+)
+RESUSPENSION_METHOD = os.path.join(CYBIO, "BioF-CYB-0008 Resuspension of Colony Pellets.bms")
+PURIFICATION_METHOD = os.path.join(CYBIO, "BioF-CYB-0009 Plasmid Purification Using Beckman CosMCPrep v1.bms")
+PCR_CLEANUP_METHOD = os.path.join(CYBIO, "BioF-CYB-0010 AMPure_beads_PCR_cleanup_V14.bms")
+SHAKING_METHOD = os.path.join(REPO, "Shaking_Plates", "Shaking Method.bms")
+
+INSTRUMENTS = {"flex": 1, "hamilton": 1, "felix": 1}
+WELLS_PER_SPREAD_PLATE = 6
+PICKING_SECONDS_PER_PLATE = 150.0  # planning estimate: image, select and pick one 6-well plate
+GROWTH_SECONDS = 16 * 3600.0  # overnight, for colonies and for cultures
+PLATE_SAMPLES = 96
+# Pipeline order: stage -> (instrument, method). Growth stages need no instrument.
+STAGES = {
+    "transformation": ("flex", None),
+    "spreading": ("hamilton", SPREADING_PROTOCOL),
+    "colony growth": (None, None),
+    "picking": ("hamilton", None),
+    "culture growth": (None, None),
+    "resuspension": ("felix", RESUSPENSION_METHOD),
+    "shaking": ("felix", SHAKING_METHOD),
+    "purification": ("felix", PURIFICATION_METHOD),
+    "pcr cleanup": ("felix", PCR_CLEANUP_METHOD),
+}
+# Operations that take the same time however many samples a run holds.
+FIXED_OPS = ("pause", "delay", "temperature", "shake", "move_labware", "comment", "load", "other")
+
+
+@dataclass
+class Stage:
+    """One step of the pipeline: where it runs, how many samples a run takes and for how long."""
+
+    name: str
+    instrument: str  # None for incubations, which need no instrument
+    batch: int
+    seconds: object  # samples in the run -> seconds
+    source: str
+    estimated: bool = False  # a stand-in, not timed from the stage's own method
+
+
+# Durations
+
+
+class _Linear:
+    """Run time of ``fixed + per_sample * samples`` seconds."""
+
+    def __init__(self, fixed, per_sample=0.0):
+        self.fixed = fixed
+        self.per_sample = per_sample
+
+    def __call__(self, samples):
+        return self.fixed + self.per_sample * samples
+
+
+class _FlexRuns:
+    """Flex run time for a sample count, from one ``flex_sim`` run per count (rounded up to a column)."""
+
+    def __init__(self, path=None, params=None):
+        from . import flex_sim
+
+        self.protocol = flex_sim.load_protocol(path or flex_sim.DEFAULT_PROTOCOL)
+        self.params = dict(params or {})
+        self.cache = {}
+
+    def __call__(self, samples):
+        from . import flex_sim
+
+        samples = 8 * math.ceil(samples / 8)
+        if samples not in self.cache:
+            plates = math.ceil(samples / PLATE_SAMPLES)
+            params = dict({"recovery_plates": plates}, **self.params, number_of_samples=samples)
+            result = flex_sim.run_protocol(self.protocol, params)
+            if result.error is not None:
+                raise ValueError(f"transformation with {samples} samples: {result.error}")
+            self.cache[samples] = result.seconds
+        return self.cache[samples]
+
+
+_COMPARISON = re.compile(r"(.*?)(<=|>=|<>|!=|=|<|>)(.*)")
+
+
+def _holds(condition, values):
+    """Truth of a Felix condition, or ``None`` when only the run can tell (counters, piston volume)."""
+    from .liquid_ir import _substitute, evaluate
+
+    text = _substitute(condition or "", values).strip()
+    match = _COMPARISON.fullmatch(text)
+    if match is None or "$(" in text:
+        return None
+    left, op, right = (part.strip() for part in match.groups())
+    if left.startswith('"') or right.startswith('"'):
+        left, right = left.strip('"'), right.strip('"')
+        if op in ("=", "<>", "!="):
+            return (left == right) == (op == "=")
+    left, right = evaluate(left, {}), evaluate(right, {})
+    if math.isnan(left) or math.isnan(right):
+        return None
+    return {"<=": left <= right, ">=": left >= right, "<>": left != right, "!=": left != right,
+            "=": left == right, "<": left < right, ">": left > right}[op]
+
+
+def _text(properties, key):
+    value = properties.get(key)
+    return value if isinstance(value, str) else ""
+
+
+def _block_seconds(command, values, time_model):
+    return sum(_command_seconds(sub, values, time_model) for sub in command.subcommands if sub.enabled)
+
+
+def _command_seconds(command, values, time_model):
+    from .liquid_ir import CYBIO_OPS, evaluate
+
+    kind, properties = command.kind, command.properties
+    if kind == "scripting:cmd:condition":
+        branches = command.subcommands
+        for number, branch in enumerate(branches[:-1], 1):
+            if _holds(_text(properties, f"condition{number}"), values) is not False:
+                return _block_seconds(branch, values, time_model) if branch.enabled else 0.0
+        return _block_seconds(branches[-1], values, time_model) if branches and branches[-1].enabled else 0.0
+    if kind == "scripting:cmd:repeat":
+        count = evaluate(_text(properties, "counter"), values)
+        return _block_seconds(command, values, time_model) * (int(count) if count >= 1 else 1)
+    if kind == "scripting:cmd:parallel":
+        return max((_command_seconds(sub, values, time_model) for sub in command.subcommands if sub.enabled),
+                   default=0.0)
+    op = CYBIO_OPS.get(kind)
+    seconds = 0.0
+    if op in ("aspirate", "dispense"):
+        volume = evaluate(_text(properties, "volume"), values)
+        seconds = time_model.liquid(0.0 if math.isnan(volume) else volume, None)
+    elif op == "delay":
+        wait = evaluate(_text(properties, "wait"), values)
+        seconds = 0.0 if math.isnan(wait) else wait
+    elif op in ("pick_up_tip", "drop_tip", "blow_out", "pause"):
+        seconds = getattr(time_model, op)
+    elif op == "move":
+        seconds = time_model.move_overhead
+    return seconds + _block_seconds(command, values, time_model)
+
+
+def felix_seconds(path, params=None, time_model=None):
+    """Estimated run time of a CyBio Felix method, followed the way it runs.
+
+    A condition takes the first branch whose test holds or cannot be decided
+    before the run. ``params`` overrides the method's variable defaults.
+    """
+    from .bms_patch import variables
+    from .bms_reader import MethodFile
+    from .flex_sim import TimeModel
+
+    time_model = time_model or TimeModel()
+    with MethodFile(path) as method:
+        values = {variable.name.lower(): variable.value for variable in variables(method)}
+        values.update({name.lower(): str(value) for name, value in (params or {}).items()})
+        return _block_seconds(method.root_command, values, time_model)
+
+
+def outline_seconds(path, reference, params=None, time_model=None):
+    """Run time of a method known only by its ``.isf`` outline, at ``reference``'s seconds per command."""
+    from .isf_index import StepIndex
+
+    per_command = felix_seconds(reference, params, time_model) / len(StepIndex.read(reference).depths)
+    return per_command * len(StepIndex.read(path).depths)
+
+
+def spreading_seconds(path=SPREADING_PROTOCOL, time_model=None):
+    """``_Linear`` run time of a Protocol Designer file, liquid handling scaled per sample.
+
+    The file's sample count is the number of source wells it draws from.
+    """
+    from .liquid_ir import OP_CODES, from_protocol_designer
+
+    table = from_protocol_designer(path, time_model)
+    fixed_codes = {OP_CODES[op] for op in FIXED_OPS}
+    fixed = per_run = 0.0
+    for op, seconds in zip(table["op"], table["seconds"]):
+        if not math.isnan(seconds):
+            if op in fixed_codes:
+                fixed += seconds
+            else:
+                per_run += seconds
+    aspirated = table.select(op="aspirate")
+    samples = sum(max(channels, 1) for _, _, channels in table.distinct(("labware", "well", "channels"), aspirated))
+    return _Linear(fixed, per_run / max(samples, 1))
+
+
+def stages(params=None, seconds=None, time_model=None):
+    """The pipeline's ``Stage`` list. ``params`` and ``seconds`` are keyed by stage name."""
+    from .worklist import PLATES_PER_RUN
+
+    params = params or {}
+    seconds = seconds or {}
+    unknown = (set(params) | set(seconds)) - set(STAGES)
+    if unknown:
+        raise ValueError(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    def duration(name):
+        if name in seconds:
+            return _Linear(seconds[name]), "--seconds", False
+        if name == "transformation":
+            return _FlexRuns(params=params.get(name)), "flex_sim", False
+        if name == "spreading":
+            return spreading_seconds(time_model=time_model), os.path.basename(SPREADING_PROTOCOL), False
+        if name.endswith("growth"):
+            return _Linear(GROWTH_SECONDS), "GROWTH_SECONDS", False
+        if name == "picking":
+            return (_Linear(0.0, PICKING_SECONDS_PER_PLATE / WELLS_PER_SPREAD_PLATE),
+                    "PICKING_SECONDS_PER_PLATE", True)
+        if name == "purification":
+            return (_Linear(outline_seconds(PURIFICATION_METHOD, PCR_CLEANUP_METHOD, time_model=time_model)),
+                    os.path.basename(PURIFICATION_METHOD) + ".isf outline", True)
+        path = STAGES[name][1]
+        return _Linear(felix_seconds(path, params.get(name), time_model)), os.path.basename(path), False
+
+    # The Flex takes up to four recovery plates a run; a Hamilton picking run takes 16 spread plates.
+    batches = {"transformation": 4 * PLATE_SAMPLES, "picking": PLATES_PER_RUN * WELLS_PER_SPREAD_PLATE}
+    built = []
+    for name, (instrument, _) in STAGES.items():
+        batch = math.inf if instrument is None else batches.get(name, PLATE_SAMPLES)
+        built.append(Stage(name, instrument, batch, *duration(name)))
+    return built
+
+
+# Simulation
+
+
+class _VirtualSelector(selectors.SelectSelector):
+    """Never blocks: a wait for the next timer moves the clock forward instead."""
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        if timeout:
+            self.now += timeout
+        return super().select(0)
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """An event loop whose clock jumps straight to the next scheduled callback."""
+
+    def __init__(self):
+        self._clock = _VirtualSelector()
+        super().__init__(self._clock)
+
+    def time(self):
+        return self._clock.now
+
+
+@dataclass
+class Instrument:
+    name: str
+    units: int
+    runs: int = 0
+    busy: float = 0.0
+    waits: list = field(default_factory=list)
+    queued: int = 0
+    max_queued: int = 0
+    free: asyncio.Semaphore = None
+
+    async def run(self, seconds):
+        loop = asyncio.get_running_loop()
+        requested = loop.time()
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        async with self.free:
+            self.queued -= 1
+            self.waits.append(loop.time() - requested)
+            await asyncio.sleep(seconds)
+            self.runs += 1
+            self.busy += seconds
+
+
+@dataclass
+class Simulation:
+    samples: int
+    batch: int
+    makespan: float
+    instruments: dict
+    lead_times: list
+    stage_waits: dict
+    stage_runs: dict
+
+
+async def _batch(stages, samples, instruments, released, lead_times, stage_waits, stage_runs):
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(released)
+    for stage in stages:
+        runs = [min(stage.batch, samples - start) for start in
+                range(0, samples, stage.batch if stage.batch != math.inf else samples)]
+        started = loop.time()
+
+        async def one(count, stage=stage):
+            seconds = stage.seconds(count)
+            stage_runs[stage.name].append(seconds)
+            if stage.instrument is None:
+                await asyncio.sleep(seconds)
+            else:
+                await instruments[stage.instrument].run(seconds)
+
+        await asyncio.gather(*(one(count) for count in runs))
+        waited = loop.time() - started - max(stage.seconds(count) for count in runs)
+        stage_waits[stage.name] += max(0.0, waited)
+    lead_times.append(loop.time() - released)
+
+
+def simulate(stages, samples, batch=PLATE_SAMPLES, interval=0.0, instruments=None):
+    """Push ``samples`` through ``stages`` in batches released every ``interval`` seconds."""
+    units = dict(INSTRUMENTS, **(instruments or {}))
+    loop = VirtualClockLoop()
+    try:
+        asyncio.set_event_loop(loop)
+        pool = {name: Instrument(name, count, free=asyncio.Semaphore(count)) for name, count in units.items()}
+        missing = {stage.instrument for stage in stages} - set(pool) - {None}
+        if missing:
+            raise ValueError(f"no units of {', '.join(sorted(missing))}")
+        lead_times = []
+        stage_waits = {stage.name: 0.0 for stage in stages}
+        stage_runs = {stage.name: [] for stage in stages}
+        sizes = [min(batch, samples - start) for start in range(0, samples, batch)]
+        loop.run_until_complete(asyncio.gather(*(
+            _batch(stages, size, pool, index * interval, lead_times, stage_waits, stage_runs)
+            for index, size in enumerate(sizes)
+        )))
+        makespan = loop.time()
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    for instrument in pool.values():
+        instrument.free = None
+    return Simulation(samples, batch, makespan, pool, lead_times, stage_waits, stage_runs)
+
+
+def _hours(seconds):
+    return f"{seconds / 3600:.1f} h"
+
+
+def report(simulation, stages):
+    lines = [f"{simulation.samples} samples in batches of {simulation.batch}: "
+             f"all done after {_hours(simulation.makespan)} "
+             f"({simulation.samples / simulation.makespan * 86400:.0f} samples/day); lead time per batch "
+             f"mean {_hours(sum(simulation.lead_times) / len(simulation.lead_times))}, "
+             f"max {_hours(max(simulation.lead_times))}"]
+    lines.append("")
+    lines.append(f"{'stage':<16} {'instrument':<10} {'runs':>4} {'per run':>10} {'queued':>8}  source")
+    estimated = {}  # instrument -> (busy seconds from estimated stages, their names)
+    for stage in stages:
+        runs = simulation.stage_runs[stage.name]
+        lines.append(f"{stage.name:<16} {stage.instrument or '-':<10} {len(runs):>4} "
+                     f"{sum(runs) / len(runs) / 60:>5.1f} min{'*' if stage.estimated else ' '} "
+                     f"{_hours(simulation.stage_waits[stage.name]):>8}  {stage.source}")
+        if stage.estimated and stage.instrument is not None:
+            busy, names = estimated.get(stage.instrument, (0.0, ()))
+            estimated[stage.instrument] = (busy + sum(runs), names + (stage.name,))
+    if any(stage.estimated for stage in stages):
+        lines.append("* estimated, not timed from the stage's own method; "
+                     "measure it and pass --seconds STAGE=SECONDS")
+    lines.append("")
+    lines.append(f"{'instrument':<10} {'units':>5} {'runs':>4} {'busy':>8} {'estimated':>9} {'utilisation':>11} "
+                 f"{'mean wait':>9} {'max wait':>8} {'max queue':>9}")
+    used = [instrument for instrument in simulation.instruments.values() if instrument.runs]
+    for instrument in used:
+        utilisation = instrument.busy / (instrument.units * simulation.makespan)
+        lines.append(f"{instrument.name:<10} {instrument.units:>5} {instrument.runs:>4} "
+                     f"{_hours(instrument.busy):>8} {_hours(estimated.get(instrument.name, (0.0,))[0]):>9} "
+                     f"{100 * utilisation:>10.0f}% "
+                     f"{_hours(sum(instrument.waits) / len(instrument.waits)):>9} "
+                     f"{_hours(max(instrument.waits)):>8} {instrument.max_queued:>9}")
+    if used:
+        bottleneck = max(used, key=lambda instrument: instrument.busy / instrument.units)
+        lines.append(f"bottleneck: {bottleneck.name} ({_hours(bottleneck.busy / bottleneck.units)} busy "
+                     f"per unit; runs waited {_hours(sum(bottleneck.waits))} for it in all)")
+        busy, names = estimated.get(bottleneck.name, (0.0, ()))
+        if busy:
+            lines.append(f"  {100 * busy / bottleneck.busy:.0f}% of that busy time is estimated "
+                         f"({', '.join(names)}); measure before acting on it")
+    return lines
+
+
+def _assignments(items, option):
+    values = {}
+    for item in items:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"{option} expects NAME=VALUE, got {item!r}")
+        values[name.strip()] = value.strip()
+    return values
+
+
+def main(argv=None):
+    import argparse
+
+    from .flex_sim import parse_params
+
+    parser = argparse.ArgumentParser(description="Simulate samples flowing through the lab's instruments.")
+    parser.add_argument("--samples", type=int, default=768)
+    parser.add_argument("--batch", type=int, default=PLATE_SAMPLES, help="samples released together")
+    parser.add_argument("--interval", type=float, default=0.0, metavar="HOURS",
+                        help="time between batch releases (default: all at once)")
+    parser.add_argument("--instruments", action="append", default=[], metavar="NAME=UNITS",
+                        help=f"units per instrument (default {', '.join(f'{k}={v}' for k, v in INSTRUMENTS.items())})")
+    parser.add_argument("--seconds", action="append", default=[], metavar="STAGE=SECONDS",
+                        help="fixed time per run for a stage, e.g. measured on the instrument")
+    parser.add_argument("--set", action="append", default=[], metavar="STAGE.NAME=VALUE",
+                        help="protocol parameter or method variable for a stage")
+    args = parser.parse_args(argv)
+
+    try:
+        instruments = {name: int(units) for name, units in _assignments(args.instruments, "--instruments").items()}
+        seconds = {name: float(value) for name, value in _assignments(args.seconds, "--seconds").items()}
+        params = {}
+        for item in args.set:
+            stage, _, assignment = item.partition(".")
+            params.setdefault(stage, {}).update(parse_params([assignment]))
+        pipeline = stages(params, seconds)
+        simulation = simulate(pipeline, args.samples, args.batch, args.interval * 3600, instruments)
+    except (OSError, ValueError) as exc:
+        print(f"workcell: error: {exc}", file=sys.stderr)
+        sys.exit(2)
+    print("\n".join(report(simulation, pipeline)))
+
+
+if __name__ == "__main__":
+    main()
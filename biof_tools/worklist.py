@@ -0,0 +1,187 @@
+"""Colony-picking worklists for the Hamilton continuous-multiplate method.
+
+``BioF-HAM-0001 Colony Picking Continuos Multiplate V24`` reads its plates
+from an input file laid out like its template: a ``ColonyPlateID`` header,
+then one plate barcode per line (``ARIA_P1`` ... ``ARIA_P16``), with CRLF
+line endings. A run takes at most ``PLATES_PER_RUN`` plates.
+
+``read_ids`` streams plate IDs from files of any size: single-column lists
+like the template, or wider CSV exports with a ``ColonyPlateID`` column.
+``Validator`` checks each ID as it streams past. It flags malformed
+barcodes, IDs missing from an optional registry of known plates, and
+duplicates of an earlier line, using hash lookups only. ``split`` writes
+the accepted IDs to one input file per run, each written as soon as it is
+full.
+
+    python -m biof_tools.worklist queue.csv --known plates_registry.csv -d runs/
+"""
+
+from dataclasses import dataclass
+import csv
+import os
+import re
+import sys
+
+HEADER = "ColonyPlateID"
+PLATES_PER_RUN = 16
+DEFAULT_PATTERN = r"[A-Za-z0-9][A-Za-z0-9_.\-]*"
+TEMPLATE_NAME = "BioF-HAM-0001 Colony Picking Continuos Multiplate V24 - Input"
+
+
+class WorklistError(ValueError):
+    """Raised for multi-column files without a ``ColonyPlateID`` column."""
+
+
+@dataclass(frozen=True)
+class Issue:
+    path: str
+    line: int
+    plate_id: str
+    problem: str
+
+    def __str__(self):
+        return f"{self.path}:{self.line}: {self.plate_id!r}: {self.problem}"
+
+
+def read_ids(path):
+    """Yield ``(line, plate_id)`` from a plate-ID file, one row at a time.
+
+    The header row is optional for single-column files; blank rows are skipped.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        rows = csv.reader(handle)
+        column = 0
+        for row in rows:
+            cells = [cell.strip() for cell in row]
+            if not any(cells):
+                continue
+            names = [cell.lower() for cell in cells]
+            if HEADER.lower() in names:
+                column = names.index(HEADER.lower())
+            elif len(cells) > 1:
+                raise WorklistError(f"{path}: no {HEADER} column in {row!r}")
+            else:
+                yield rows.line_num, cells[0]
+            break
+        for row in rows:
+            plate_id = row[column].strip() if len(row) > column else ""
+            if plate_id:
+                yield rows.line_num, plate_id
+
+
+def read_known(paths):
+    """Set of plate IDs from registry files in the same format."""
+    known = set()
+    for path in paths:
+        known.update(plate_id for _, plate_id in read_ids(path))
+    return known
+
+
+class Validator:
+    """Streaming checks for one worklist; IDs seen so far live in a dict."""
+
+    def __init__(self, known=None, pattern=DEFAULT_PATTERN):
+        self.known = known
+        self.pattern = re.compile(pattern)
+        self.seen = {}
+        self.issues = []
+
+    def check(self, path, line, plate_id):
+        """Record any problem with ``plate_id`` and return whether it is accepted."""
+        if not self.pattern.fullmatch(plate_id):
+            problem = "malformed barcode"
+        elif self.known is not None and plate_id not in self.known:
+            problem = "unknown barcode"
+        elif plate_id in self.seen:
+            first_path, first_line = self.seen[plate_id]
+            where = f"line {first_line}" if first_path == path else f"{first_path}:{first_line}"
+            problem = f"duplicate of {where}"
+        else:
+            self.seen[plate_id] = (path, line)
+            return True
+        self.issues.append(Issue(path, line, plate_id, problem))
+        return False
+
+    def accepted(self, paths):
+        """Yield the valid IDs of ``paths``, in order, recording the rejected ones."""
+        for path in paths:
+            for line, plate_id in read_ids(path):
+                if self.check(path, line, plate_id):
+                    yield plate_id
+
+
+def write_input(path, plate_ids):
+    """Write a method input file in the template's format."""
+    with open(path, "w", newline="", encoding="ascii") as handle:
+        handle.write(f"{HEADER}\r\n")
+        handle.writelines(f"{plate_id}\r\n" for plate_id in plate_ids)
+
+
+def split(plate_ids, output_dir, name=TEMPLATE_NAME, plates_per_run=PLATES_PER_RUN):
+    """Write ``plate_ids`` as run input files of at most ``plates_per_run``; returns their paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    run = []
+
+    def flush():
+        path = os.path.join(output_dir, f"{name} run {len(written) + 1:03d}.csv")
+        write_input(path, run)
+        written.append(path)
+        run.clear()
+
+    for plate_id in plate_ids:
+        run.append(plate_id)
+        if len(run) == plates_per_run:
+            flush()
+    if run:
+        flush()
+    return written
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate and split colony-picking plate queues.")
+    parser.add_argument("paths", nargs="+", help="plate-ID files, queued in the order given")
+    parser.add_argument("--known", action="append", default=[], metavar="FILE",
+                        help="registry of valid plate IDs (repeatable)")
+    parser.add_argument("--pattern", default=DEFAULT_PATTERN, help="regular expression for a plate ID")
+    parser.add_argument("--plates-per-run", type=int, default=PLATES_PER_RUN)
+    parser.add_argument("-d", "--output-dir", help="write run input files here")
+    parser.add_argument("--name", default=TEMPLATE_NAME, help="run files are named '<name> run NNN.csv'")
+    parser.add_argument("--strict", action="store_true",
+                        help="write nothing if any ID is rejected (reads the queue twice)")
+    args = parser.parse_args(argv)
+    if args.plates_per_run < 1:
+        parser.error("--plates-per-run must be at least 1")
+
+    written = []
+    try:
+        known = read_known(args.known) if args.known else None
+        validator = Validator(known, args.pattern)
+        if args.output_dir is None or args.strict:
+            for _ in validator.accepted(args.paths):
+                pass
+        if args.output_dir is not None and not (args.strict and validator.issues):
+            if args.strict:
+                validator = Validator(known, args.pattern)
+            written = split(validator.accepted(args.paths), args.output_dir, args.name,
+                            args.plates_per_run)
+    except (OSError, ValueError) as exc:
+        # WorklistError and re.error are ValueErrors.
+        print(f"error: {exc}", file=sys.stderr)
+        sys.exit(1)
+
+    for issue in validator.issues:
+        print(issue, file=sys.stderr)
+    plates = len(validator.seen)
+    summary = (f"{plates} plates accepted, {len(validator.issues)} rejected, "
+               f"{-(-plates // args.plates_per_run)} run(s)")
+    if args.output_dir is not None:
+        summary += f"; {len(written)} input file(s) written to {args.output_dir}"
+    print(summary)
+    sys.exit(1 if validator.issues else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import shutil
+
+import pytest
+
+from biof_tools import flex_sim
+from biof_tools.analysis_cache import AnalysisCache, analyze
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnalysisCache(str(tmp_path / "cache"))
+
+
+def test_hit_returns_the_same_run(cache):
+    result, cached = analyze(params={"number_of_samples": 16}, cache=cache)
+    assert not cached
+    again, cached = analyze(params={"number_of_samples": 16}, cache=cache)
+    assert cached
+    assert again.commands == result.commands
+    assert again.params == result.params
+    assert again.seconds == pytest.approx(result.seconds)
+
+
+def test_key_is_the_resolved_parameters(cache):
+    assert not analyze(cache=cache)[1]
+    # 24 is the declared default, so spelling it out is the same analysis.
+    assert analyze(params={"number_of_samples": 24}, cache=cache)[1]
+    assert analyze(params={"number_of_samples": "24"}, cache=cache)[1]
+    assert not analyze(params={"number_of_samples": 32}, cache=cache)[1]
+    assert not analyze(cache=cache, time_model=flex_sim.TimeModel(pick_up_tip=9.0))[1]
+
+
+def test_edited_protocol_misses(cache, tmp_path):
+    copy = tmp_path / "protocol.py"
+    shutil.copyfile(flex_sim.DEFAULT_PROTOCOL, copy)
+    assert not analyze(str(copy), cache=cache)[1]
+    assert analyze(str(copy), cache=cache)[1]
+    with open(copy, "a", encoding="utf-8") as handle:
+        handle.write("\n# edited\n")
+    assert not analyze(str(copy), cache=cache)[1]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache"), max_entries=4)
+    for samples in (8, 16, 24):
+        analyze(params={"number_of_samples": samples}, cache=cache)
+    # Each analysis stores its entry and a small alias pointing at it.
+    assert len(cache.entries()) == 4
+    assert analyze(params={"number_of_samples": 24}, cache=cache)[1]
+    assert not analyze(params={"number_of_samples": 8}, cache=cache)[1]
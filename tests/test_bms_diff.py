@@ -0,0 +1,58 @@
+import copy
+import os
+import shutil
+
+import pytest
+
+from biof_tools.bms_diff import TreeCache, diff, parse_tree
+from biof_tools.bms_patch import patch_file
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHAKING = os.path.join(REPO, "Shaking_Plates", "Shaking Method.bms")
+
+
+@pytest.fixture(scope="module")
+def tree():
+    return parse_tree(SHAKING)
+
+
+def test_same_method_has_no_differences(tree):
+    assert diff(tree, copy.deepcopy(tree)) == []
+
+
+def test_patched_variable_is_the_only_change(tree, tmp_path):
+    out = str(tmp_path / "out.bms")
+    patch_file(SHAKING, {"Shake_Time": "1200"}, out)
+    changes = diff(tree, parse_tree(out))
+    assert [(change.change, change.path, change.values) for change in changes] == [
+        ("changed", (5,), [("variable1.variable_value", "1", "1200")]),
+    ]
+
+
+def test_added_removed_and_retitled_steps(tree):
+    new = copy.deepcopy(tree)
+    removed = new["steps"].pop(1)
+    new["steps"].insert(3, copy.deepcopy(new["steps"][0]))
+    new["steps"][2]["title"] = "Samples"
+    new["steps"][2]["enabled"] = False
+    changes = diff(tree, new)
+    assert [(change.change, change.path, change.kind) for change in changes] == [
+        ("removed", (2,), removed["kind"]),
+        ("changed", (3,), "scripting:cmd:variable:definition"),
+        ("added", (4,), "plugin:felix:lightswitch"),
+    ]
+    assert str(changes[1]) == "~ 3 (was 4) scripting:cmd:variable:definition 'Samples'\n" \
+        "    enabled: True -> False"
+
+
+def test_cache_parses_each_content_once(tmp_path):
+    cache = TreeCache(str(tmp_path / "cache"), max_entries=1)
+    copied = str(tmp_path / "renamed.bms")
+    shutil.copyfile(SHAKING, copied)
+    patched = str(tmp_path / "patched.bms")
+    patch_file(SHAKING, {"Shake_Time": "1200"}, patched)
+    assert cache.get(SHAKING) == cache.get(copied) == parse_tree(SHAKING)
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.get(patched)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert len(cache.entries()) == 1
@@ -0,0 +1,86 @@
+import os
+import shutil
+
+import pytest
+
+from biof_tools.bms_patch import VariableError, batch, patch_file, variables
+from biof_tools.bms_reader import MethodFile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHAKING = os.path.join(REPO, "Shaking_Plates", "Shaking Method.bms")
+
+
+def values(path):
+    with MethodFile(path) as method:
+        return {variable.name: variable.value for variable in variables(method)}
+
+
+def read(path):
+    with open(path, "rb") as handle:
+        return handle.read()
+
+
+@pytest.fixture
+def method(tmp_path):
+    path = str(tmp_path / "shake.bms")
+    shutil.copyfile(SHAKING, path)
+    with open(path + ".isf", "w", encoding="ascii") as handle:
+        handle.write("0 8 1 0 ")
+    return path
+
+
+def test_patch_changes_only_the_named_variable(method, tmp_path):
+    out = str(tmp_path / "out.bms")
+    before = values(method)
+    patch_file(method, {"shake_time": "1200"}, out)
+    after = values(out)
+    assert after["Shake_Time"] == "1200"
+    assert {name: value for name, value in after.items() if name != "Shake_Time"} == \
+        {name: value for name, value in before.items() if name != "Shake_Time"}
+    assert read(out + ".isf") == read(method + ".isf")
+
+
+def test_patching_back_restores_the_original_bytes(method, tmp_path):
+    out = str(tmp_path / "out.bms")
+    original = values(method)["Shake_Time"]
+    patch_file(method, {"Shake_Time": original + "0"}, out)
+    patch_file(out, {"Shake_Time": original}, out)
+    assert read(out) == read(method)
+
+
+def test_patch_in_place(method):
+    patch_file(method, {"Shake_Speed": "1500"}, method)
+    assert values(method)["Shake_Speed"] == "1500"
+    assert read(method + ".isf") == b"0 8 1 0 "
+    assert not [name for name in os.listdir(os.path.dirname(method)) if name.endswith(".tmp")]
+
+
+def test_batch_row_may_name_the_source(method, tmp_path):
+    rows = [{"Shake_Time": "60", "output": "a.bms"}, {"Shake_Time": "90", "output": "shake.bms"}]
+    written = batch(method, rows, str(tmp_path))
+    assert [os.path.basename(path) for path in written] == ["a.bms", "shake.bms"]
+    assert values(str(tmp_path / "a.bms"))["Shake_Time"] == "60"
+    assert values(method)["Shake_Time"] == "90"
+
+
+def test_rejected_value_leaves_no_output(method, tmp_path):
+    out = str(tmp_path / "out.bms")
+    with pytest.raises(VariableError):
+        patch_file(method, {"HeatingRequired": "3"}, out)
+    assert not os.path.exists(out)
+
+
+@pytest.mark.parametrize("names, message", [
+    (["../a.bms"], "not a plain file name"),
+    (["sub/a.bms"], "not a plain file name"),
+    ([".."], "not a plain file name"),
+    (["a.bms", "a.bms"], "row 2: output 'a.bms' is already written by row 1"),
+    (["", "shake_001.bms"], "row 2: output 'shake_001.bms' is already written by row 1"),
+])
+def test_batch_rejects_bad_output_names(method, tmp_path, names, message):
+    out = tmp_path / "out"
+    rows = [{"Shake_Time": "60", "output": name} for name in names]
+    with pytest.raises(ValueError, match=message):
+        batch(method, rows, str(out))
+    assert os.listdir(out) == []
+    assert sorted(os.listdir(tmp_path)) == ["out", "shake.bms", "shake.bms.isf"]
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from biof_tools.bms_reader import MethodFile, MethodFormatError
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FELIX = os.path.join(REPO, "CyBio Felix protocols")
+AMPURE = os.path.join(FELIX, "BioF-CYB-0010 AMPure_beads_PCR_cleanup_V14.bms")
+RESUSPENSION = os.path.join(FELIX, "BioF-CYB-0008 Resuspension of Colony Pellets.bms")
+SHAKING = os.path.join(REPO, "Shaking_Plates", "Shaking Method.bms")
+
+
+@pytest.mark.parametrize("path, records, commands", [
+    (AMPURE, 49189, 491),
+    (RESUSPENSION, 7327, 41),
+    (SHAKING, 4071, 29),
+], ids=["ampure", "resuspension", "shaking"])
+def test_record_and_command_counts(path, records, commands):
+    with MethodFile(path) as method:
+        assert len(method) == records
+        assert len(list(method.walk())) == commands
+        # walk starts below the method root, which is a scripting::CCmd as well.
+        assert method.class_counts()["scripting::CCmd"] == commands + 1
+
+
+def test_parents_and_children_agree():
+    with MethodFile(SHAKING) as method:
+        assert method.root.parent is None
+        for index in range(len(method)):
+            record = method.record(index)
+            assert all(child.parent == record for child in record.children)
+        with pytest.raises(IndexError):
+            method.record(len(method))
+
+
+def test_commands_in_run_order():
+    with MethodFile(AMPURE) as method:
+        assert len(method.commands) == 52
+        assert [command.command_type for command in method.commands[:3]] == [
+            "plugin:felix:initsequence", "plugin:felix:lightswitch", "plugin:felix:supervision",
+        ]
+        depth, aspirate = next((depth, command) for depth, command in method.walk() if command.volume)
+        assert (depth, aspirate.command_type, aspirate.volume) == \
+            (5, "plugin:felix:aspirate", "$(ASPIRATE_VOLUME)+5")
+
+
+@pytest.mark.parametrize("cut", [1, 9])
+def test_truncated_file_raises(tmp_path, cut):
+    path = tmp_path / "cut.bms"
+    with open(SHAKING, "rb") as handle:
+        path.write_bytes(handle.read()[:-cut])
+    with MethodFile(str(path)) as method:
+        with pytest.raises(MethodFormatError):
+            len(method)
@@ -0,0 +1,120 @@
+import pytest
+
+from biof_tools import flex_sim
+
+
+@pytest.fixture
+def parameters():
+    parameters = flex_sim.SimParameterContext()
+    parameters.add_int("samples", "Samples", 24, minimum=8, maximum=384)
+    parameters.add_float("volume", "Volume", 7.5, minimum=1.0, maximum=25.0)
+    parameters.add_bool("partial", "Partial", False)
+    parameters.add_str("mode", "Mode", "standard", choices=[
+        {"display_name": "Standard", "value": "standard"},
+        {"display_name": "Pause-free", "value": "pause_free"},
+    ])
+    return parameters
+
+
+@pytest.mark.parametrize("name, value, expected", [
+    ("samples", "96", 96),
+    ("samples", 96.0, 96),
+    ("volume", "12.5", 12.5),
+    ("volume", 3, 3.0),
+    ("partial", "false", False),
+    ("partial", "True", True),
+    ("partial", "off", False),
+    ("partial", 1, True),
+    ("mode", "pause_free", "pause_free"),
+])
+def test_coerce_to_declared_type(parameters, name, value, expected):
+    coerced = parameters.coerce(name, value)
+    assert coerced == expected
+    assert type(coerced) is type(expected)
+
+
+@pytest.mark.parametrize("name, value, message", [
+    ("samples", "ninety", "expects int"),
+    ("samples", 9.5, "expects int"),
+    ("samples", True, "expects int"),
+    ("samples", 400, "above its maximum 384"),
+    ("samples", "4", "below its minimum 8"),
+    ("volume", "much", "expects float"),
+    ("partial", "maybe", "expects bool"),
+    ("partial", 2, "expects bool"),
+    ("mode", "bogus", "not one of 'standard', 'pause_free'"),
+])
+def test_coerce_rejects(parameters, name, value, message):
+    with pytest.raises(ValueError, match=message):
+        parameters.coerce(name, value)
+
+
+def test_resolve_keeps_defaults_and_rejects_unknown_names(parameters):
+    assert parameters.resolve({"partial": "true"}) == {
+        "samples": 24, "volume": 7.5, "partial": True, "mode": "standard",
+    }
+    with pytest.raises(KeyError):
+        parameters.resolve({"sample": 96})
+
+
+def test_parse_params():
+    assert flex_sim.parse_params(["a=96", "b=0.5", "c=false", "d=TRUE", "e=A1"]) == {
+        "a": 96, "b": 0.5, "c": False, "d": True, "e": "A1",
+    }
+
+
+def test_run_protocol_coerces_command_line_strings():
+    def tips(partial):
+        result = flex_sim.run_protocol(flex_sim.DEFAULT_PROTOCOL,
+                                       {"number_of_samples": "93", "partial_tip_pickup": partial})
+        assert result.error is None
+        assert result.params["partial_tip_pickup"] is (partial == "true")
+        return sum(result.tips_used().values())
+
+    assert tips("false") > tips("true")
+
+
+def test_run_protocol_captures_invalid_parameters():
+    result = flex_sim.run_protocol(flex_sim.DEFAULT_PROTOCOL, {"deck_mode": "bogus"})
+    assert isinstance(result.error, ValueError)
+    assert not result.commands
+
+
+def picked_tips(style, start, end=None, pickups=3):
+    context = flex_sim.SimProtocolContext()
+    rack = context.load_labware("opentrons_flex_96_tiprack_50ul", "A2")
+    pipette = context.load_instrument("flex_8channel_50", "left", tip_racks=[rack])
+    context.load_trash_bin()
+    pipette.configure_nozzle_layout(style=style, start=start, end=end)
+    picked = []
+    for _ in range(pickups):
+        pipette.pick_up_tip()
+        picked.append(context.commands[-1].wells)
+        pipette.drop_tip()
+    return picked
+
+
+def test_front_primary_partial_column_picks_up_from_the_back_rows():
+    # With H1 primary the inactive nozzles are behind it, so they must overhang the back of the rack.
+    assert picked_tips(flex_sim.PARTIAL_COLUMN, "H1", "F1") == [
+        ("A1", "B1", "C1"), ("D1", "E1", "F1"), ("A2", "B2", "C2"),
+    ]
+    assert picked_tips(flex_sim.SINGLE, "H1", pickups=2) == [("A1",), ("B1",)]
+
+
+def test_back_primary_single_picks_up_from_the_front_rows():
+    assert picked_tips(flex_sim.SINGLE, "A1", pickups=2) == [("H1",), ("G1",)]
+
+
+def result(*kinds):
+    return flex_sim.SimResult({}, [flex_sim.SimCommand(kind, seconds=60.0) for kind in kinds])
+
+
+def test_compare_pairs_segments_only_when_the_pauses_match():
+    baseline = result("aspirate", "pause", "aspirate", "aspirate")
+    assert flex_sim.compare(baseline, result("aspirate", "pause", "aspirate"))[1:] == [
+        "  after pause 1: 0:02:00 -> 0:01:00",
+    ]
+    assert flex_sim.compare(baseline, result("aspirate", "aspirate", "aspirate"))[1:] == [
+        "operator pauses: 1 -> 0 (1 removed), operator wait 0:01:00 -> 0:00:00",
+    ]
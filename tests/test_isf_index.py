@@ -0,0 +1,66 @@
+import os
+import shutil
+
+import pytest
+
+from biof_tools.bms_reader import MethodFile
+from biof_tools.isf_index import SidecarFormatError, StepIndex, check, locate, parse_path
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AMPURE = os.path.join(REPO, "CyBio Felix protocols", "BioF-CYB-0010 AMPure_beads_PCR_cleanup_V14.bms")
+SHAKING = os.path.join(REPO, "Shaking_Plates", "Shaking Method.bms")
+
+
+@pytest.fixture(scope="module")
+def index():
+    return StepIndex.read(AMPURE)
+
+
+def test_outline_counts(index):
+    assert len(index) == 492
+    assert index.step_count(0) == 491
+    assert len(index.children(0)) == 52
+
+
+def test_find_and_path_round_trip(index):
+    for path, step in index.steps():
+        assert index.find(path) == step
+        assert index.path(step) == path
+    assert index.find(parse_path("24.2.1")) == 414
+    assert index.find((53,), default=None) is None
+    with pytest.raises(KeyError):
+        index.find((24, 99))
+
+
+def walk_paths(method, command=None, path=()):
+    for number, sub in enumerate((command or method.root_command).subcommands, 1):
+        yield path + (number,), sub
+        yield from walk_paths(method, sub, path + (number,))
+
+
+def test_steps_match_the_method(index):
+    step = index.find((24, 2, 1))
+    with MethodFile(AMPURE) as method:
+        command = locate(method, (24, 2, 1))
+        assert index.step_count(step) == len(list(method.walk(command)))
+        assert [path for path, _ in index.steps()][1:] == \
+            [path for path, _ in walk_paths(method)]
+
+
+def test_check_regenerates_missing_and_stale_sidecars(tmp_path):
+    path = str(tmp_path / "shake.bms")
+    shutil.copyfile(SHAKING, path)
+    status, fresh = check(path)
+    assert (status, len(fresh)) == ("missing", 30)
+    fresh.write(path)
+    assert check(path)[0] == "ok"
+    assert StepIndex.read(path) == fresh
+    with open(path + ".isf", "w", encoding="ascii") as handle:
+        handle.write("0 8 1 0 ")
+    assert check(path)[0] == "stale"
+
+
+@pytest.mark.parametrize("text", ["0 8 1", "1 8 ", "0 8 2 0 ", "0 8 x 0 "])
+def test_malformed_sidecars_raise(text):
+    with pytest.raises(SidecarFormatError):
+        StepIndex.parse(text)
@@ -0,0 +1,56 @@
+import copy
+import json
+import os
+
+import pytest
+
+from biof_tools import labware_store
+from biof_tools.labware_store import LabwareStore, add_file
+from biof_tools.pd_reader import ProtocolFile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPREADING = os.path.join(REPO, "Hamilton_Robotic_Protocols", "Transformation_Spreading_Protocol_Hamilton",
+                         "Transformation Spread to 6 Well Plates.json")
+
+
+@pytest.fixture(scope="module")
+def document():
+    with open(SPREADING, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def test_definitions_are_stored_once(tmp_path, document):
+    respelled = tmp_path / "respelled.json"
+    respelled.write_text(json.dumps(document, indent=4))
+    directory = str(tmp_path / "store")
+    with LabwareStore(directory) as store:
+        assert add_file(store, SPREADING) == (4, 4)
+        assert add_file(store, SPREADING) == (4, 0)
+        # The same definitions written with other whitespace are new spellings, not new definitions.
+        assert add_file(store, str(respelled)) == (4, 0)
+        assert store.flush()
+    with LabwareStore(directory) as reopened:
+        stats = reopened.stats()
+        assert (stats["definitions"], stats["spellings"], stats["packs"]) == (4, 8, 1)
+        assert sorted(reopened.uris()) == sorted(document["labwareDefinitions"])
+
+
+def test_reading_a_protocol_keeps_definitions_in_memory(monkeypatch, document):
+    monkeypatch.setattr(labware_store, "_default_store", None)
+    with ProtocolFile(SPREADING) as pd:
+        definitions = pd.labware_definitions()
+    assert labware_store.thaw(definitions) == document["labwareDefinitions"]
+    assert labware_store.memory_store().directory is None
+    assert labware_store._default_store is None
+    with ProtocolFile(SPREADING) as pd:
+        assert all(pd.labware_definitions()[key] is value for key, value in definitions.items())
+
+
+def test_shared_definitions_are_read_only():
+    with ProtocolFile(SPREADING) as pd:
+        definition = next(iter(pd.labware_definitions().values()))
+    with pytest.raises(TypeError):
+        definition["version"] = 2
+    editable = copy.deepcopy(definition)
+    editable["version"] = 2
+    assert definition["version"] != 2
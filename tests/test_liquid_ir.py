@@ -0,0 +1,67 @@
+import math
+import os
+
+import pytest
+
+from biof_tools.liquid_ir import OpTable, evaluate, from_cybio, from_flex, from_protocol_designer
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPREADING = os.path.join(REPO, "Hamilton_Robotic_Protocols", "Transformation_Spreading_Protocol_Hamilton",
+                         "Transformation Spread to 6 Well Plates.json")
+AMPURE = os.path.join(REPO, "CyBio Felix protocols", "BioF-CYB-0010 AMPure_beads_PCR_cleanup_V14.bms")
+
+
+@pytest.fixture(scope="module")
+def flex():
+    return from_flex(params={"number_of_samples": 24})
+
+
+def test_flex_liquid_moved(flex):
+    aspirated = flex.select(op="aspirate")
+    # Same SOC total as the run store: three 8-channel columns drawing 50 + 10 uL each.
+    assert flex.group_sum("labware", aspirated, liquid=True)["reservoir"] == 1440.0
+    assert flex.count("op")["pick_up_tip"] == 5
+    # Mixing is its own op and never counts as liquid moved.
+    assert flex.count("op")["mix"] == 42
+    assert flex.sum("volume", aspirated, liquid=True) == 2568.0
+
+
+def test_protocol_designer_ops():
+    table = from_protocol_designer(SPREADING)
+    counts = table.count("op")
+    assert {op: counts[op] for op in ("pick_up_tip", "aspirate", "dispense", "drop_tip")} == {
+        "pick_up_tip": 46, "aspirate": 46, "dispense": 46, "drop_tip": 46,
+    }
+    assert table.sum("volume", table.select(op="aspirate"), liquid=True) == 4600.0
+    assert all(table["tip"][row] >= 0 for row in table.select(op=("aspirate", "dispense")))
+
+
+def test_cybio_volumes_come_from_variable_defaults():
+    table = from_cybio(AMPURE)
+    aspirated = table.select(op="aspirate")
+    assert len(aspirated) == 13
+    assert table.group_sum("labware", aspirated, liquid=True) == {
+        "112 @ position_10": 67200.0, "$(PLATE_ID) @ position_7": 6000.0,
+    }
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("$(A)*2", 8.0),
+    ("-$(b) / 2", -1.5),
+    ("$(missing)+1", math.nan),
+    ("__import__('os')", math.nan),
+])
+def test_evaluate(text, expected):
+    value = evaluate(text, {"a": "$(b)+1", "b": "3"})
+    assert value == expected or math.isnan(value) and math.isnan(expected)
+
+
+def test_extend_recodes_strings(flex):
+    other = OpTable()
+    other.append("other.py", 0, "aspirate", labware="reservoir", well="A1", volume=10.0, channels=8)
+    table = OpTable().extend(other).extend(flex)
+    assert len(table) == len(flex) + 1
+    assert table.count("protocol")["other.py"] == 1
+    rows = table.select(op="aspirate", labware="reservoir", well="A1")
+    assert table.sum("volume", rows, liquid=True) == 1440.0 + 80.0
+    assert table.select(labware="nowhere") == table.select(rows=[])
@@ -0,0 +1,92 @@
+import pytest
+
+from biof_tools import pd_compiler
+from biof_tools.pd_compiler import Labware, Motion, Op, Program
+
+PLATE = "opentrons/biorad_96_wellplate_200ul_pcr/1"
+WELL = {"shape": "circular", "diameter": 5.5, "depth": 14.8, "totalLiquidVolume": 200}
+
+
+def definition(category, volume=200, tiprack=False):
+    return {"metadata": {"displayCategory": category}, "parameters": {"isTiprack": tiprack},
+            "wells": {f"{row}{column}": dict(WELL, totalLiquidVolume=volume)
+                      for row in "ABCDEFGH" for column in range(1, 13)}}
+
+
+def program(dests, volume=30.0, air_gap=0.0, pipette="p300_single_gen2", dispense_z=-1.0):
+    """One transfer per dest from plate A1, each with its own tip, like Protocol Designer writes them."""
+    labware = {
+        "tips": Labware("tips", "opentrons/opentrons_96_tiprack_300ul/1", "Tips", "10",
+                        definition("tipRack", 300, tiprack=True)),
+        "plate": Labware("plate", PLATE, "Plate", "1", definition("wellPlate")),
+        "trash": Labware("trash", "opentrons/opentrons_1_trash_1100ml_fixed/1", "Trash", "12",
+                         definition("trash")),
+    }
+    aspirate, dispense = Motion(50.0, "bottom", 1.0), Motion(50.0, "top", dispense_z)
+    ops = []
+    for number, dest in enumerate(dests):
+        ops.append(Op("pick_up_tip", len(ops), "p", "tips", f"A{number + 1}"))
+        ops.append(Op("aspirate", len(ops), "p", "plate", "A1", volume, aspirate))
+        ops.append(Op("dispense", len(ops), "p", "plate", dest, volume, dispense))
+        if air_gap:
+            ops.append(Op("air_gap", len(ops), "p", "plate", dest, air_gap, dispense))
+        ops.append(Op("blow_out", len(ops), "p", "trash", "A1", motion=Motion(100.0, "top")))
+        ops.append(Op("drop_tip", len(ops), "p", "trash", "A1"))
+    return pd_compiler.lower(Program(
+        path="test.json", metadata={}, pipettes={"p": {"name": pipette, "mount": "left"}},
+        labware=labware, liquids={}, liquid_loads=[], ops=ops, forms=[],
+    ))
+
+
+def transfers(program):
+    return [step for step in program.steps if isinstance(step, pd_compiler.Transfer)]
+
+
+def test_share_tips_keeps_one_tip_per_source():
+    compiled = program(["B1", "B2", "B3"])
+    pd_compiler.share_tips(compiled)
+    assert compiled.log["tips saved"] == 2
+    assert len({step.tip for step in transfers(compiled)}) == 1
+
+
+def test_share_tips_needs_a_dispense_clear_of_the_liquid():
+    compiled = program(["B1", "B2", "B3"], dispense_z=-14.0)
+    pd_compiler.share_tips(compiled)
+    assert compiled.log["tips saved"] == 0
+
+
+def test_multi_dispense_keeps_air_gaps_and_resizes_the_tip():
+    compiled = program(["B1", "B2", "B3"], air_gap=20.0)
+    # 30 uL plus a 20 uL air gap fills a 50 uL tip, which cannot hold two dispenses.
+    assert pd_compiler.flex_tiprack(compiled, "p") == "opentrons_flex_96_tiprack_50ul"
+    pd_compiler.optimise(compiled)
+    assert compiled.log["aspirates saved"] == 2
+    [merged] = transfers(compiled)
+    assert merged.dests == [("plate", "B1"), ("plate", "B2"), ("plate", "B3")]
+    assert merged.dispense_air_gap == 20.0
+    assert pd_compiler.flex_tiprack(compiled, "p") == "opentrons_flex_96_tiprack_200ul"
+    settings = pd_compiler.class_spec(compiled, merged)["set"]
+    assert settings["multi_dispense.retract.air_gap_by_volume"] == [(0, 20)]
+
+    after = pd_compiler.run_script(pd_compiler.emit(compiled))
+    assert after.error is None
+    counts = after.counts()
+    assert (counts["pick_up_tip"], counts["aspirate"], counts["dispense"], counts["air_gap"]) == (1, 1, 3, 3)
+
+
+def test_multi_dispense_stays_within_the_largest_tip():
+    # A 50 uL pipette's largest tip holds 30 uL once with its air gap and disposal.
+    compiled = pd_compiler.optimise(program(["B1", "B2"], air_gap=10.0, pipette="p20_single_gen2"))
+    assert compiled.log["tips saved"] == 1
+    assert compiled.log["aspirates saved"] == 0
+    assert [step.dispense_air_gap for step in transfers(compiled)] == [10.0, 10.0]
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Place a 300 ul tip rack on position 10", "Place a 200 ul tip rack on position A1"),
+    ("Load 300uL filter tips in slot 4", "Load 200uL filter tips in slot C1"),
+    ("Use 20 ul of buffer", "Use 20 ul of buffer"),
+])
+def test_messages_name_the_flex_slots_and_tips(message, expected):
+    compiled = pd_compiler.optimise(program(["B1", "B2", "B3"], air_gap=20.0))
+    assert pd_compiler.rewrite_message(compiled, message) == expected
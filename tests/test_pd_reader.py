@@ -0,0 +1,116 @@
+from collections import Counter
+import json
+import os
+
+import pytest
+
+from biof_tools.pd_reader import ProtocolFile, ProtocolFormatError
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPREADING = os.path.join(REPO, "Hamilton_Robotic_Protocols", "Transformation_Spreading_Protocol_Hamilton",
+                         "Transformation Spread to 6 Well Plates.json")
+
+
+@pytest.fixture(scope="module")
+def document():
+    with open(SPREADING, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def expected_index(commands, field):
+    """``{value: [command indexes]}`` of ``field`` anywhere in each command."""
+    index = {}
+
+    def values(value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if key == field and isinstance(item, str):
+                    yield item
+                else:
+                    yield from values(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from values(item)
+
+    for number, command in enumerate(commands):
+        for value in dict.fromkeys(values(command)):
+            index.setdefault(value, []).append(number)
+    return index
+
+
+@pytest.fixture
+def protocol():
+    with ProtocolFile(SPREADING) as pd:
+        yield pd
+
+
+def test_sections_span_the_top_level_values(protocol, document):
+    assert list(protocol.sections) == list(document)
+    for key, value in document.items():
+        assert json.loads(protocol.raw(key)) == value
+
+
+def test_command_spans_match_json_load(protocol, document):
+    commands = document["commands"]
+    assert len(protocol) == len(commands)
+    for index, command in enumerate(commands):
+        assert json.loads(protocol.command_bytes(index)) == command
+
+
+def test_commands_and_sections(protocol, document):
+    assert len(protocol) == len(document["commands"])
+    assert list(protocol.commands()) == document["commands"]
+    assert protocol.command(len(protocol) - 1) == document["commands"][-1]
+    assert protocol.section("metadata") == document["metadata"]
+    assert protocol.section("missing", {}) == {}
+    with pytest.raises(IndexError):
+        protocol.command(len(protocol))
+
+
+def test_counting_decodes_only_the_commands(protocol, document):
+    assert protocol.counts() == Counter(command["commandType"] for command in document["commands"])
+    # The commands were found from the end of the file, without scanning the keys before them.
+    assert protocol._spans == {}
+
+
+@pytest.mark.parametrize("field", ["commandType", "labwareId", "pipetteId"])
+def test_indexes_match_json_load(protocol, document, field):
+    index = {value: list(indexes) for value, indexes in protocol.index(field).items()}
+    assert index == expected_index(document["commands"], field)
+
+
+@pytest.mark.parametrize("document", [
+    # commands is not last, so it is found by scanning the top-level keys
+    {"commands": [{"commandType": "home"}], "metadata": {"commands": []}},
+    # the last "commands" key is nested, and its array is followed by two closing braces
+    {"metadata": {}, "commands": [{"commandType": "home"}], "z": {"commands": [{"commandType": "x"}]}},
+    # a string value that looks like the key
+    {"metadata": {}, "commands": [{"commandType": "home", "params": {"message": "commands"}}]},
+], ids=["not-last", "nested-last", "string"])
+def test_commands_found_wherever_they_are(tmp_path, document):
+    path = tmp_path / "protocol.json"
+    path.write_text(json.dumps(document, indent=1))
+    with ProtocolFile(str(path)) as pd:
+        assert list(pd.commands()) == document["commands"]
+        assert pd.counts() == {"home": 1}
+        assert list(pd.sections) == list(document)
+
+
+def test_nested_ids_are_indexed(tmp_path):
+    path = tmp_path / "nested.json"
+    path.write_text(json.dumps({"metadata": {}, "commands": [
+        {"commandType": "moveLabware", "params": {"labwareId": "a", "newLocation": {"labwareId": "b"}}},
+        {"commandType": "aspirate", "params": {"labwareId": "b", "pipetteId": "p"}},
+    ]}))
+    with ProtocolFile(str(path)) as pd:
+        assert {key: list(value) for key, value in pd.by_labware.items()} == {"a": [0], "b": [0, 1]}
+        assert pd.counts() == {"moveLabware": 1, "aspirate": 1}
+
+
+@pytest.mark.parametrize("text", ['{"commands": [1,', '{"commands": {"a": 1}}', '{"metadata": [}'])
+def test_malformed_files_raise(tmp_path, text):
+    path = tmp_path / "bad.json"
+    path.write_text(text)
+    with ProtocolFile(str(path)) as pd:
+        with pytest.raises(ProtocolFormatError):
+            len(pd)
@@ -0,0 +1,66 @@
+import pytest
+
+from biof_tools import flex_sim
+from biof_tools.run_store import RunRecord, Store, read_run
+
+RESERVOIR = "opentrons/nest_12_reservoir_15ml/1"
+PLATE = "opentrons/biorad_96_wellplate_200ul_pcr/1"
+
+
+def record(key, time, columns=2, mixes=3):
+    """A run filling ``columns`` plate columns with 20 uL from reservoir A1, mixing each."""
+    run = RunRecord("fill", "1", "test", key, time)
+    for column in range(1, columns + 1):
+        run.add("pickUpTip", "tips", "opentrons/tips/1", f"A{column}", "p50", channels=8)
+        run.add("aspirate", "reservoir", RESERVOIR, "A1", "p50", 20.0, 10.0, channels=8)
+        run.add("dispense", "plate", PLATE, f"A{column}", "p50", 20.0, 10.0, channels=8)
+        for _ in range(mixes):
+            run.add("aspirate", "plate", PLATE, f"A{column}", "p50", 15.0, 10.0, channels=8)
+            run.add("dispense", "plate", PLATE, f"A{column}", "p50", 15.0, 10.0, channels=8)
+        run.add("dropTip", "trash", "", "", "p50", channels=8)
+    return run
+
+
+@pytest.fixture
+def store(tmp_path):
+    with Store(str(tmp_path / "store")) as store:
+        yield store
+
+
+def test_volumes_count_every_channel(store):
+    store.append([record("a", 0.0)])
+    assert store.liquid("aspirate", "reservoir", "A1") == (320.0, 2, 1)
+    assert store.liquid("dispense", "biorad") == (320.0, 2, 1)
+    assert store.liquid("dispense", "biorad", "A2") == (160.0, 1, 1)
+
+
+def test_mixing_is_left_out(store):
+    store.append([record("a", 0.0)])
+    assert store.liquid("aspirate", "biorad") == (0.0, 0, 0)
+
+
+def test_aspirate_dispensed_elsewhere_is_not_mixing():
+    run = RunRecord("move", "1", "test", "b", 0.0)
+    run.add("aspirate", "plate", PLATE, "A1", "p50", 10.0)
+    run.add("dispense", "plate", PLATE, "A2", "p50", 10.0)
+    run.add("aspirate", "plate", PLATE, "A2", "p50", 10.0)
+    run.add("dropTip", "trash", "", "", "p50")
+    run.add("dispense", "plate", PLATE, "A2", "p50", 10.0)
+    assert run.mixing() == set()
+
+
+def test_totals_add_up_across_segments_and_reopening(store, tmp_path):
+    assert store.append([record("a", 0.0)]) == 1
+    assert store.append([record("b", 100.0, columns=4), record("a", 0.0)]) == 1
+    assert store.liquid("aspirate", "reservoir") == (960.0, 6, 2)
+    assert store.liquid("aspirate", "reservoir", since=50.0) == (640.0, 4, 1)
+    store.close()
+    with Store(str(tmp_path / "store")) as reopened:
+        assert reopened.liquid("aspirate", "reservoir", "A1") == (960.0, 6, 2)
+
+
+def test_flex_protocol_totals(store):
+    store.append([read_run(flex_sim.DEFAULT_PROTOCOL, {"number_of_samples": 24})])
+    # 24 samples are three 8-channel columns, each drawing 50 + 10 uL of SOC per channel from A1.
+    assert store.liquid("aspirate", "reservoir", "A1")[0] == 1440.0
+    assert store.liquid("aspirate", "biorad")[0] == 0.0
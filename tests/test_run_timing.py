@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from biof_tools.run_timing import percentile, read_runs, summary
+
+
+def events(run, params, stop_after=None):
+    """A trace of two steps: a pipetting step with a pause, then a cooling step."""
+    lines = [
+        {"event": "run", "run": run, "protocol": "test", "params": params},
+        {"event": "call", "name": "p50 aspirate", "step": 1, "t": 1.0, "s": 20.0},
+        {"event": "pause", "name": "Load the plate", "step": 1, "t": 21.0, "s": 60.0},
+        {"event": "step", "name": "Transfer", "step": 1, "t": 0.0, "s": 100.0},
+        {"event": "call", "name": "temperature set_temperature", "step": 2, "t": 100.0, "s": 150.0},
+        {"event": "step", "name": "Cool", "step": 2, "t": 100.0, "s": 200.0},
+    ]
+    return lines[:stop_after]
+
+
+def write(path, *traces, garbage=False):
+    with open(path, "w", encoding="utf-8") as handle:
+        for trace in traces:
+            for event in trace:
+                handle.write(json.dumps(event) + "\n")
+            if garbage:
+                handle.write('{"event": "call", "na\n')
+    return str(path)
+
+
+def test_steps_split_into_parts(tmp_path):
+    (run,) = read_runs(write(tmp_path / "a.jsonl", events("a", {"number_of_samples": 24})))
+    assert run.complete
+    assert run.params == {"number_of_samples": 24}
+    assert run.steps() == {
+        (1, "Transfer"): {"seconds": 100.0, "robot": 20.0, "temperature": 0.0, "operator": 60.0},
+        (2, "Cool"): {"seconds": 200.0, "robot": 0.0, "temperature": 150.0, "operator": 0.0},
+    }
+
+
+def test_appended_and_stopped_runs(tmp_path, capsys):
+    path = write(tmp_path / "b.jsonl", events("a", {}), events("b", {}, stop_after=5), garbage=True)
+    runs = read_runs(path)
+    assert [(run.run_id, run.complete) for run in runs] == [("a", True), ("b", False)]
+    assert list(runs[1].steps()) == [(1, "Transfer")]
+    assert capsys.readouterr().err.count("skipped unreadable line") == 2
+
+
+@pytest.mark.parametrize("q, expected", [(0, 10.0), (50, 25.0), (95, 38.5), (100, 40.0)])
+def test_percentile_interpolates(q, expected):
+    assert percentile([40.0, 10.0, 20.0, 30.0], q) == pytest.approx(expected)
+
+
+def test_summary_names_the_bottleneck(tmp_path):
+    runs = read_runs(write(tmp_path / "c.jsonl", events("a", {}), events("b", {})))
+    lines = summary(runs)
+    assert lines[-2] == "share of run time: robot 7%, temperature 50%, operator 20%, unattributed 23%"
+    assert lines[-1] == "most time goes to: temperature"
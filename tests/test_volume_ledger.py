@@ -0,0 +1,59 @@
+from collections import Counter
+import os
+
+import pytest
+
+from biof_tools.volume_ledger import (
+    EXCESS_ASPIRATE, OVERDRAW, OVERFLOW, Ledger, _well_range, from_flex, from_protocol_designer, prep_sheet,
+)
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPREADING = os.path.join(REPO, "Hamilton_Robotic_Protocols", "Transformation_Spreading_Protocol_Hamilton",
+                         "Transformation Spread to 6 Well Plates.json")
+
+
+def test_issues_are_told_apart():
+    ledger = Ledger({"reservoir": 100.0})
+    ledger.add_labware("stock", "reservoir")
+    ledger.add_labware("plate", "plate", capacity=200.0)
+    ledger.load("stock", "A1", 1000.0, "buffer")
+    ledger.aspirate(0, "stock", "A1", 850.0)
+    ledger.aspirate(1, "stock", "A1", 100.0)
+    ledger.dispense(2, "plate", "A1", 150.0)
+    ledger.aspirate(3, "plate", "A1", 160.0)
+    ledger.dispense(4, "plate", "A1", 250.0)
+    assert [(issue.index, issue.problem, issue.volume) for issue in ledger.issues] == [
+        (1, OVERDRAW, 50.0), (3, EXCESS_ASPIRATE, -10.0), (4, OVERFLOW, 240.0),
+    ]
+    stock = ledger.wells["stock", "A1"]
+    assert stock.source and stock.minimum_fill == 1050.0
+    assert [(row.well, row.minimum, row.short) for row in prep_sheet(ledger)] == [("A1", 1050.0, True)]
+
+
+def test_default_flex_run():
+    ledger = from_flex()
+    assert Counter(issue.problem for issue in ledger.issues) == {EXCESS_ASPIRATE: 87}
+    assert len(ledger.first_issues()) == 24
+    sheet = prep_sheet(ledger)
+    assert not any(row.short for row in sheet)
+    soc = [row for row in sheet if row.liquid == "SOC"]
+    assert [(row.well, row.minimum, row.declared) for row in soc] == [("A1", 2440.0, 12000.0)]
+
+
+def test_protocol_designer_overdraws_match_dismissed_warnings():
+    ledger = from_protocol_designer(SPREADING)
+    assert Counter(issue.problem for issue in ledger.issues) == {OVERDRAW: 46}
+    assert len(ledger.warnings["ASPIRATE_MORE_THAN_WELL_CONTENTS"]) == 8
+    short = [row for row in prep_sheet(ledger) if row.short]
+    assert short and all(row.minimum == 105.0 for row in short)
+
+
+@pytest.mark.parametrize("wells, expected", [
+    (["A1"], "A1"),
+    (["A1", "B1", "C1"], "A1-C1"),
+    (["A1", "B1", "A2", "B2"], "A1-B2"),
+    (["A1", "B1", "A2"], "A1-B1, A2"),
+    (["A1", "C1"], "A1, C1"),
+])
+def test_well_range_lists_wells_outside_a_block(wells, expected):
+    assert _well_range(wells) == expected
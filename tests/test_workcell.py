@@ -0,0 +1,52 @@
+import math
+
+import pytest
+
+from biof_tools.workcell import SHAKING_METHOD, Stage, _Linear, felix_seconds, simulate, stages
+
+
+def pipeline(felix_batch=96):
+    return [
+        Stage("prep", "felix", felix_batch, _Linear(100.0), "test"),
+        Stage("growth", None, math.inf, _Linear(1000.0), "test"),
+        Stage("cleanup", "felix", 96, _Linear(50.0, 1.0), "test"),
+    ]
+
+
+def test_runs_queue_for_an_instrument():
+    simulation = simulate(pipeline(), 192)
+    # The second batch's prep waits for the first, then its cleanup waits for the first cleanup.
+    assert simulation.makespan == 1246.0 + 146.0
+    assert simulation.lead_times == [1246.0, 1392.0]
+    assert simulation.stage_waits == {"prep": 100.0, "growth": 0.0, "cleanup": 46.0}
+    felix = simulation.instruments["felix"]
+    assert (felix.runs, felix.busy, felix.max_queued) == (4, 492.0, 1)
+
+
+def test_more_units_and_smaller_stage_batches():
+    assert simulate(pipeline(), 192, instruments={"felix": 2}).makespan == 1246.0
+    simulation = simulate(pipeline(felix_batch=48), 96)
+    assert simulation.stage_runs["prep"] == [100.0, 100.0]
+    assert simulation.makespan == 200.0 + 1000.0 + 146.0
+
+
+def test_batches_released_over_time():
+    simulation = simulate(pipeline(), 192, interval=600.0)
+    assert simulation.lead_times == [1246.0, 1246.0]
+    assert simulation.makespan == 1846.0
+
+
+def test_felix_time_follows_method_variables():
+    base = felix_seconds(SHAKING_METHOD)
+    assert felix_seconds(SHAKING_METHOD, {"Shake_Time": "1200"}) == pytest.approx(base + 1199.0)
+
+
+def test_pipeline_stages():
+    built = {stage.name: stage for stage in stages(seconds={"pcr cleanup": 1800.0})}
+    assert list(built) == ["transformation", "spreading", "colony growth", "picking", "culture growth",
+                           "resuspension", "shaking", "purification", "pcr cleanup"]
+    assert {name for name, stage in built.items() if stage.estimated} == {"picking", "purification"}
+    assert built["pcr cleanup"].seconds(96) == 1800.0
+    assert built["transformation"].batch == 384
+    with pytest.raises(ValueError, match="unknown stage"):
+        stages(seconds={"sequencing": 60.0})